@@ -4,9 +4,11 @@ from datetime import date, timedelta
 from typing import Any, Dict, List
 
 from fastapi import APIRouter, HTTPException
-from sqlalchemy import select, func
+from sqlalchemy import select
 
-from backend.rules_engine.persistence import Audit, Rule, get_session
+from backend.rules_engine.audit_archive import query_audits
+from backend.rules_engine.audit_writer import audit_writer
+from backend.rules_engine.persistence import Rule, RuleDailyStats, get_session
 
 
 router = APIRouter(prefix="/analytics")
@@ -38,18 +40,15 @@ def triggers(
     day_keys = [d.isoformat() for d in days]
 
     with get_session() as session:
-        stmt = (
-            select(Audit.rule_id, Audit.date, func.count(Audit.id))
-            .where(
-                Audit.tenant_id == tenant_id,
-                Audit.fired == True,  # noqa: E712
-                Audit.date >= start,
-                Audit.date <= end,
-            )
-            .group_by(Audit.rule_id, Audit.date)
+        # Resumen diario (rule_daily_stats): una fila por regla y día, sin recorrer audits
+        stmt = select(RuleDailyStats.rule_id, RuleDailyStats.date, RuleDailyStats.fired_count).where(
+            RuleDailyStats.tenant_id == tenant_id,
+            RuleDailyStats.date >= start,
+            RuleDailyStats.date <= end,
+            RuleDailyStats.fired_count > 0,
         )
         if ids:
-            stmt = stmt.where(Audit.rule_id.in_(ids))
+            stmt = stmt.where(RuleDailyStats.rule_id.in_(ids))
         rows = session.execute(stmt).all()
 
         # Collect rule_ids present if not provided
@@ -76,6 +75,26 @@ def triggers(
         return {"start": start.isoformat(), "end": end.isoformat(), "series": series}
 
 
+@router.get("/audits")
+def audits(
+    start: date,
+    end: date,
+    tenant_id: str = "default",
+    user_id: str | None = None,
+    rule_id: str | None = None,
+    fired: bool | None = None,
+    limit: int = 200,
+) -> Dict[str, Any]:
+    if end < start:
+        raise HTTPException(status_code=400, detail="end < start")
+    # Tabla caliente y, para los días anteriores a la ventana de retención, archivo Parquet
+    try:
+        rows = query_audits(tenant_id, start, end, user_id, rule_id, fired, limit=max(1, min(limit, 5000)))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"start": start.isoformat(), "end": end.isoformat(), "count": len(rows), "audits": rows}
+
+
 @router.get("/logs")
 def logs(
     start: date | None = None,
@@ -121,3 +140,7 @@ def logs(
         return out
 
 
+@router.get("/audit-writer")
+def audit_writer_stats() -> Dict[str, Any]:
+    # Profundidad de cola, latencia de volcado y descartes del escritor asíncrono
+    return audit_writer.stats()
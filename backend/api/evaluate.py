@@ -6,8 +6,14 @@ from typing import Any, List
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 
-from backend.rules_engine.engine import evaluate_user
-from backend.rules_engine.features import load_base_dataframe, build_features
+from backend.rules_engine.engine import RecommendationEvent, evaluate_user, evaluate_users
+from backend.rules_engine.feature_state import dataset_feature_state
+from backend.rules_engine.features import (
+    build_features,
+    dataset_cache_stats,
+    invalidate_dataset_cache,
+    load_base_dataframe,
+)
 from backend.rules_engine.persistence import get_session, Audit
 from sqlalchemy import select
 
@@ -27,39 +33,52 @@ class SimulateRequest(BaseModel):
     }
 
 
+class BatchSimulateRequest(BaseModel):
+    user_ids: List[str] = Field(min_length=1)
+    eval_date: date = Field(description="Fecha de evaluación ISO (YYYY-MM-DD)", alias="date")
+    tenant_id: str = "default"
+
+    model_config = {
+        "populate_by_name": True,
+        "protected_namespaces": (),
+    }
+
+
+def _event_dict(e: RecommendationEvent) -> dict:
+    return {
+        "date": str(e.date),
+        "tenant_id": e.tenant_id,
+        "user_id": e.user_id,
+        "rule_id": e.rule_id,
+        "category": e.category,
+        "severity": e.severity,
+        "priority": e.priority,
+        "message_id": e.message_id,
+        "message_text": e.message_text,
+        "locale": e.locale,
+        "why": e.why,
+    }
+
+
 @router.post("/simulate")
 def simulate(req: SimulateRequest) -> dict:
     res = evaluate_user(user_id=req.user_id, target_day=req.eval_date, tenant_id=req.tenant_id, debug=req.debug)
     # evaluate_user puede devolver (results, per_rule_debug) si debug=True
     if req.debug:
-        events, per_rule_debug = res
+        events, debug_payload = res
+        per_rule_debug = debug_payload["rules"]
     else:
         events = res
         per_rule_debug = []
     resp: dict = {
         "count": len(events),
-        "events": [
-            {
-                "date": str(e.date),
-                "tenant_id": e.tenant_id,
-                "user_id": e.user_id,
-                "rule_id": e.rule_id,
-                "category": e.category,
-                "severity": e.severity,
-                "priority": e.priority,
-                "message_id": e.message_id,
-                "message_text": e.message_text,
-                "locale": e.locale,
-                "why": e.why,
-            }
-            for e in events
-        ],
+        "events": [_event_dict(e) for e in events],
     }
     if req.debug:
         # Devolver auditorías últimas por regla para ese usuario/fecha
         # Si evaluate_user devolvió per_rule_debug, úsalo; si no, leer audits de la BD
         if per_rule_debug:
-            resp["debug"] = {"audits": per_rule_debug}
+            resp["debug"] = {"values": debug_payload["values"], "audits": per_rule_debug}
         else:
             audits: list[dict] = []
             with get_session() as session:
@@ -83,6 +102,19 @@ def simulate(req: SimulateRequest) -> dict:
     return resp
 
 
+@router.post("/simulate/batch")
+def simulate_batch(req: BatchSimulateRequest) -> dict:
+    # Un único cálculo de dataset/reglas/histórico para todo el lote
+    results = evaluate_users(req.user_ids, target_day=req.eval_date, tenant_id=req.tenant_id)
+    return {
+        "count": sum(len(events) for events in results.values()),
+        "users": [
+            {"user_id": uid, "count": len(events), "events": [_event_dict(e) for e in events]}
+            for uid, events in results.items()
+        ],
+    }
+
+
 @router.get("/features")
 def features(user_id: str, date: date) -> dict:
     df = load_base_dataframe()
@@ -90,3 +122,14 @@ def features(user_id: str, date: date) -> dict:
     return feats
 
 
+@router.get("/features/cache")
+def features_cache() -> dict:
+    return dataset_cache_stats()
+
+
+@router.post("/features/cache/invalidate")
+def features_cache_invalidate() -> dict:
+    # Forzar relectura de los CSV en la próxima evaluación
+    invalidate_dataset_cache()
+    dataset_feature_state.clear()
+    return dataset_cache_stats()
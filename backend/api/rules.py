@@ -4,10 +4,17 @@ from typing import Any
 
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-from sqlalchemy import select, func
+from sqlalchemy import select
 
 from backend.rules_engine.dsl import RuleModel
-from backend.rules_engine.persistence import Rule, RuleMessage, Audit, ChangeLog, get_session
+from backend.rules_engine.persistence import (
+    Rule,
+    RuleMessage,
+    ChangeLog,
+    RuleDailyStats,
+    bump_rule_set_version,
+    get_session,
+)
 from backend.config import settings
 from typing import Optional
 import csv
@@ -113,6 +120,7 @@ def create_rule(req: CreateRuleRequest, ctx: dict[str, Any] = Depends(_current_u
                     active=True,
                 )
             )
+        bump_rule_set_version(session, db_rule.tenant_id)
         _log_change(session, ctx, "create", "rule", db_rule.id, None, {
             "id": db_rule.id,
             "category": db_rule.category,
@@ -170,6 +178,7 @@ def update_rule(rule_id: str, req: UpdateRuleRequest, ctx: dict[str, Any] = Depe
         if not r:
             raise HTTPException(status_code=404, detail="Rule no encontrada")
         before = _serialize_rule(r)
+        old_tenant = r.tenant_id
         if req.enabled is not None:
             r.enabled = req.enabled
         if req.category is not None:
@@ -205,6 +214,7 @@ def update_rule(rule_id: str, req: UpdateRuleRequest, ctx: dict[str, Any] = Depe
                         active=bool(cand.get("active", True)),
                     )
                 )
+        bump_rule_set_version(session, old_tenant, r.tenant_id)
         _log_change(session, ctx, "update", "rule", r.id, before, _serialize_rule(r))
         session.commit()
         return {"id": r.id}
@@ -222,6 +232,9 @@ def delete_all_rules(ctx: dict[str, Any] = Depends(_current_user)) -> dict[str,
             if total_rules == 0:
                 return {"deleted": 0, "message": "No hay reglas para eliminar"}
             
+            tenants = session.scalars(select(Rule.tenant_id).distinct()).all()
+            bump_rule_set_version(session, *tenants)
+
             # Eliminar todos los mensajes de reglas primero (por FK constraint)
             deleted_messages = session.query(RuleMessage).delete()
             
@@ -256,6 +269,7 @@ def delete_rule(rule_id: str, ctx: dict[str, Any] = Depends(_current_user)) -> d
             # Borrar mensajes primero para evitar problemas de FK en SQLite
             for m in list(r.messages):
                 session.delete(m)
+            bump_rule_set_version(session, r.tenant_id)
             session.delete(r)
             # _log_change(session, ctx, "delete", "rule", rule_id, before, None)
             session.commit()
@@ -286,6 +300,7 @@ def add_variant(rule_id: str, req: VariantCreateRequest, ctx: dict[str, Any] = D
         m = RuleMessage(rule_id=r.id, locale=locale, text=req.text, weight=req.weight, active=req.active)
         session.add(m)
         session.flush()
+        bump_rule_set_version(session, r.tenant_id)
         _log_change(session, ctx, "create", "variant", rule_id, None, {"message_id": m.id, "text": m.text})
         session.commit()
         return {"message_id": m.id}
@@ -314,6 +329,7 @@ def patch_variant(rule_id: str, message_id: int, req: VariantPatchRequest, ctx:
             m.weight = int(req.weight)
         if req.active is not None:
             m.active = bool(req.active)
+        bump_rule_set_version(session, r.tenant_id)
         _log_change(session, ctx, "update", "variant", rule_id, before, {"text": m.text, "weight": m.weight, "active": m.active})
         session.commit()
         return {"message_id": m.id}
@@ -331,6 +347,7 @@ def delete_variant(rule_id: str, message_id: int, ctx: dict[str, Any] = Depends(
             raise HTTPException(status_code=404, detail="Variante no encontrada")
         before = {"text": m.text, "weight": m.weight, "active": m.active}
         session.delete(m)
+        bump_rule_set_version(session, r.tenant_id)
         _log_change(session, ctx, "delete", "variant", rule_id, before, None)
         session.commit()
         return {"message_id": message_id, "deleted": True}
@@ -415,6 +432,7 @@ def import_rules(req: ImportRulesRequest) -> dict[str, Any]:
                 # actualizar
                 r = session.get(Rule, rule_model.id)
                 assert r is not None
+                bump_rule_set_version(session, r.tenant_id, rule_model.tenant_id)
                 r.enabled = rule_model.enabled
                 r.tenant_id = rule_model.tenant_id
                 r.category = rule_model.category
@@ -426,8 +444,8 @@ def import_rules(req: ImportRulesRequest) -> dict[str, Any]:
                 r.logic = rule_model.logic.model_dump() if hasattr(rule_model.logic, "model_dump") else rule_model.logic  # type: ignore
                 r.locale = rule_model.messages.locale
                 # reemplazar mensajes
-        for m in list(r.messages):
-            session.delete(m)
+                for m in list(r.messages):
+                    session.delete(m)
                 for cand in rule_model.messages.candidates:
                     session.add(
                         RuleMessage(
@@ -455,6 +473,7 @@ def import_rules(req: ImportRulesRequest) -> dict[str, Any]:
                 )
                 session.add(db_rule)
                 session.flush()
+                bump_rule_set_version(session, db_rule.tenant_id)
                 for cand in rule_model.messages.candidates:
                     session.add(
                         RuleMessage(
@@ -560,6 +579,7 @@ def import_csv(req: ImportCsvRequest, ctx: dict[str, Any] = Depends(_current_use
                             active=True,
                         )
                     )
+                bump_rule_set_version(session, r.tenant_id)
                 if base_id not in created:
                     updated.append(base_id)
                 # Comentar temporalmente el log de cambios
@@ -573,16 +593,22 @@ def import_csv(req: ImportCsvRequest, ctx: dict[str, Any] = Depends(_current_use
 @router.get("/{rule_id}/stats")
 def rule_stats(rule_id: str) -> dict[str, Any]:
     with get_session() as session:
-        total = session.scalar(
-            select(func.count(Audit.id)).where(Audit.rule_id == rule_id, Audit.fired == True)
-        ) or 0
-        per_variant = session.execute(
-            select(Audit.message_id, func.count(Audit.id))
-            .where(Audit.rule_id == rule_id, Audit.fired == True, Audit.message_id.isnot(None))
-            .group_by(Audit.message_id)
+        # Desde rule_daily_stats: una fila por día y tenant en lugar de contar audits
+        rows = session.execute(
+            select(
+                RuleDailyStats.fired_count, RuleDailyStats.evaluated_count, RuleDailyStats.per_message_counts
+            ).where(RuleDailyStats.rule_id == rule_id)
         ).all()
-        by_message = {int(mid): int(cnt) for (mid, cnt) in per_variant if mid is not None}
-        return {"rule_id": rule_id, "fires": int(total), "by_message": by_message}
+        total = 0
+        evaluations = 0
+        by_message: dict[int, int] = {}
+        for fired, evaluated, per_message in rows:
+            total += int(fired or 0)
+            evaluations += int(evaluated or 0)
+            for mid, cnt in (per_message or {}).items():
+                by_message[int(mid)] = by_message.get(int(mid), 0) + int(cnt)
+        # `evaluations` no depende de `audit_policy`: se cuenta antes de descartar filas
+        return {"rule_id": rule_id, "fires": int(total), "evaluations": evaluations, "by_message": by_message}
 
 
 @router.get("/{rule_id}/changelog")
@@ -619,6 +645,7 @@ def enable_rule(rule_id: str, req: EnableRequest) -> dict[str, Any]:
         if not r:
             raise HTTPException(status_code=404, detail="Rule no encontrada")
         r.enabled = req.enabled
+        bump_rule_set_version(session, r.tenant_id)
         session.commit()
         return {"id": r.id, "enabled": r.enabled}
 
@@ -661,6 +688,7 @@ def clone_rule(rule_id: str, req: CloneRequest) -> dict[str, Any]:
                     active=m.active,
                 )
             )
+        bump_rule_set_version(session, clone.tenant_id)
         session.commit()
         return {"id": clone.id}
 
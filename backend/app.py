@@ -8,12 +8,13 @@ from backend.api.import_export import router as import_export_router
 from backend.api.analytics import router as analytics_router
 from fastapi.middleware.cors import CORSMiddleware
 from backend.config import settings
-from backend.rules_engine.persistence import create_all_tables
+from backend.rules_engine.persistence import backfill_rule_daily_stats, backfill_rule_fire_state, create_all_tables
 from backend.rules_engine.registry import seed_variables_from_json
 from backend.rules_engine.registry import infer_variables_from_csvs
 from backend.rules_engine.persistence import get_session, Variable
 from sqlalchemy import select
 from backend.rules_engine.persistence import seed_rules_from_json
+from backend.rules_engine.audit_writer import audit_writer
 
 
 def create_app() -> FastAPI:
@@ -42,6 +43,10 @@ def create_app() -> FastAPI:
     def on_startup() -> None:
         # DB tables
         create_all_tables()
+        # Estado de último disparo para cooldowns (solo si la tabla está vacía)
+        backfill_rule_fire_state()
+        # Resumen diario para analítica (solo si la tabla está vacía)
+        backfill_rule_daily_stats()
         # Seeds (idempotentes)
         seed_variables_from_json("backend/seeds/variables_seed.json")
         seed_rules_from_json("backend/seeds/rules_seed.json")
@@ -75,6 +80,14 @@ def create_app() -> FastAPI:
         except Exception:
             # No bloquear el arranque si hay problemas con CSV
             pass
+        # Auditorías fuera del camino de respuesta
+        if settings.audit_async:
+            audit_writer.start()
+
+    @app.on_event("shutdown")
+    def on_shutdown() -> None:
+        # Escribir lo que quede en cola antes de salir
+        audit_writer.stop()
 
     return app
 
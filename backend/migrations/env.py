@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from alembic import context
+from sqlalchemy.engine import Connection
+
+from backend.rules_engine.persistence import Base, engine
+
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def _configure(dialect_name: str, **kwargs) -> None:
+    context.configure(
+        target_metadata=target_metadata,
+        # SQLite no admite la mayoría de ALTER TABLE: recrear la tabla en lote
+        render_as_batch=dialect_name == "sqlite",
+        **kwargs,
+    )
+
+
+def run_migrations_offline() -> None:
+    _configure(engine.dialect.name, url=engine.url, literal_binds=True, dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def _run(connection: Connection) -> None:
+    _configure(connection.dialect.name, connection=connection)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    # `persistence.create_all_tables` pasa su propia conexión; la CLI usa el engine de la app
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run(connection)
+        return
+    with engine.connect() as connection:
+        _run(connection)
+        connection.commit()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
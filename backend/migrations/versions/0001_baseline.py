@@ -0,0 +1,118 @@
+"""Esquema base (el que creaba `create_all` antes de las migraciones).
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-09-01
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "variables",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("key", sa.String(length=100), nullable=False),
+        sa.Column("label", sa.String(), nullable=True),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("unit", sa.String(), nullable=True),
+        sa.Column("type", sa.String(length=20), nullable=False),
+        sa.Column("allowed_aggregators", sa.JSON(), nullable=False),
+        sa.Column("valid_min", sa.Float(), nullable=True),
+        sa.Column("valid_max", sa.Float(), nullable=True),
+        sa.Column("missing_policy", sa.String(length=50), nullable=False),
+        sa.Column("decimals", sa.Integer(), nullable=True),
+        sa.Column("category", sa.String(), nullable=True),
+        sa.Column("tenant_id", sa.String(length=50), nullable=False),
+        sa.Column("examples", sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint("id", name="pk_variables"),
+    )
+    op.create_index("ix_variables_key", "variables", ["key"], unique=True)
+    op.create_index("ix_variables_tenant_id", "variables", ["tenant_id"])
+
+    op.create_table(
+        "rules",
+        sa.Column("id", sa.String(length=100), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("enabled", sa.Boolean(), nullable=False),
+        sa.Column("tenant_id", sa.String(length=50), nullable=False),
+        sa.Column("category", sa.String(), nullable=True),
+        sa.Column("priority", sa.Integer(), nullable=False),
+        sa.Column("severity", sa.Integer(), nullable=False),
+        sa.Column("cooldown_days", sa.Integer(), nullable=False),
+        sa.Column("max_per_day", sa.Integer(), nullable=False),
+        sa.Column("tags", sa.JSON(), nullable=True),
+        sa.Column("logic", sa.JSON(), nullable=False),
+        sa.Column("locale", sa.String(length=10), nullable=False),
+        sa.Column("created_by", sa.String(), nullable=True),
+        sa.Column("updated_by", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name="pk_rules"),
+    )
+    op.create_index("ix_rules_enabled", "rules", ["enabled"])
+    op.create_index("ix_rules_tenant_id", "rules", ["tenant_id"])
+
+    op.create_table(
+        "rule_messages",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("rule_id", sa.String(length=100), nullable=False),
+        sa.Column("locale", sa.String(length=10), nullable=False),
+        sa.Column("text", sa.String(), nullable=False),
+        sa.Column("weight", sa.Integer(), nullable=False),
+        sa.Column("active", sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["rule_id"], ["rules.id"], name="fk_rule_messages_rule_id_rules", ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("id", name="pk_rule_messages"),
+    )
+    op.create_index("ix_rule_messages_locale", "rule_messages", ["locale"])
+
+    op.create_table(
+        "audits",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("tenant_id", sa.String(length=50), nullable=False),
+        sa.Column("user_id", sa.String(length=100), nullable=False),
+        sa.Column("date", sa.Date(), nullable=False),
+        sa.Column("rule_id", sa.String(), nullable=True),
+        sa.Column("fired", sa.Boolean(), nullable=False),
+        sa.Column("discarded_reason", sa.String(), nullable=True),
+        sa.Column("why", sa.JSON(), nullable=True),
+        sa.Column("values", sa.JSON(), nullable=True),
+        sa.Column("message_id", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name="pk_audits"),
+    )
+    op.create_index("ix_audits_tenant_id", "audits", ["tenant_id"])
+    op.create_index("ix_audits_user_id", "audits", ["user_id"])
+
+    op.create_table(
+        "change_logs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("user", sa.String(), nullable=True),
+        sa.Column("role", sa.String(), nullable=True),
+        sa.Column("action", sa.String(length=50), nullable=False),
+        sa.Column("entity_type", sa.String(length=50), nullable=False),
+        sa.Column("entity_id", sa.String(), nullable=True),
+        sa.Column("before", sa.JSON(), nullable=True),
+        sa.Column("after", sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint("id", name="pk_change_logs"),
+    )
+    op.create_index("ix_change_logs_created_at", "change_logs", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("change_logs")
+    op.drop_table("audits")
+    op.drop_table("rule_messages")
+    op.drop_table("rules")
+    op.drop_table("variables")
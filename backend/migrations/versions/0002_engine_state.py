@@ -0,0 +1,93 @@
+"""Tablas de estado del motor: rule_set_versions, rule_fire_state y feature_snapshots.
+
+Las bases de datos anteriores a las migraciones pueden tenerlas ya (las creaba
+`create_all`): cada paso comprueba antes lo que existe.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-09-01
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if "rule_set_versions" not in tables:
+        op.create_table(
+            "rule_set_versions",
+            sa.Column("tenant_id", sa.String(length=50), nullable=False),
+            sa.Column("version", sa.Integer(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("tenant_id", name="pk_rule_set_versions"),
+        )
+
+    if "rule_fire_state" not in tables:
+        op.create_table(
+            "rule_fire_state",
+            sa.Column("tenant_id", sa.String(length=50), nullable=False),
+            sa.Column("user_id", sa.String(length=100), nullable=False),
+            sa.Column("rule_id", sa.String(length=100), nullable=False),
+            sa.Column("last_fired_date", sa.Date(), nullable=False),
+            sa.Column("last_message_id", sa.Integer(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("tenant_id", "user_id", "rule_id", name="pk_rule_fire_state"),
+        )
+
+    if "feature_snapshots" not in tables:
+        op.create_table(
+            "feature_snapshots",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("tenant_id", sa.String(length=50), nullable=False),
+            sa.Column("user_id", sa.String(length=100), nullable=False),
+            sa.Column("date", sa.Date(), nullable=False),
+            sa.Column("data_version", sa.String(length=64), nullable=False),
+            sa.Column("values", sa.JSON(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("id", name="pk_feature_snapshots"),
+            sa.UniqueConstraint(
+                "tenant_id", "user_id", "date", "data_version", name="uq_feature_snapshots_tenant_id"
+            ),
+        )
+
+    audit_columns = {c["name"] for c in inspector.get_columns("audits")}
+    if "feature_snapshot_id" not in audit_columns:
+        if op.get_bind().dialect.name == "sqlite":
+            # ADD COLUMN con REFERENCES en línea: evita recrear `audits` en modo batch
+            op.execute(
+                "ALTER TABLE audits ADD COLUMN feature_snapshot_id INTEGER "
+                "CONSTRAINT fk_audits_feature_snapshot_id_feature_snapshots "
+                "REFERENCES feature_snapshots (id) ON DELETE SET NULL"
+            )
+        else:
+            op.add_column("audits", sa.Column("feature_snapshot_id", sa.Integer(), nullable=True))
+            op.create_foreign_key(
+                "fk_audits_feature_snapshot_id_feature_snapshots",
+                "audits",
+                "feature_snapshots",
+                ["feature_snapshot_id"],
+                ["id"],
+                ondelete="SET NULL",
+            )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        with op.batch_alter_table("audits") as batch:
+            batch.drop_column("feature_snapshot_id")
+    else:
+        op.drop_constraint("fk_audits_feature_snapshot_id_feature_snapshots", "audits", type_="foreignkey")
+        op.drop_column("audits", "feature_snapshot_id")
+    op.drop_table("feature_snapshots")
+    op.drop_table("rule_fire_state")
+    op.drop_table("rule_set_versions")
@@ -0,0 +1,57 @@
+"""Índices compuestos y parciales de `audits` para las consultas del motor y de analítica.
+
+- ix_audits_delivered: (tenant_id, user_id, rule_id, date) de los disparos
+  entregados (fired y sin discarded_reason). Anti-repetición de mensajes en
+  `FireHistory.load` y `backfill_rule_fire_state`.
+- ix_audits_user_date: (user_id, date). Auditorías de un usuario y día
+  (`/simulate` con debug); sustituye a ix_audits_user_id, que es su prefijo.
+
+`/analytics/triggers` y `/rules/{id}/stats` no tienen índice aquí: leen
+`rule_daily_stats` (0004), y un índice de disparos en `audits` solo
+encarecería cada escritura.
+
+Los predicados se escriben como los genera SQLAlchemy (`fired = 1` en
+SQLite, `fired = true` en PostgreSQL) para que el planificador pueda usar
+los índices parciales.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-09-01
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+FIRED = {"sqlite": "fired = 1", "postgresql": "fired = true"}
+DELIVERED = {dialect: f"{cond} AND discarded_reason IS NULL" for dialect, cond in FIRED.items()}
+
+
+def _where(predicates: dict[str, str]) -> dict[str, sa.TextClause]:
+    return {f"{dialect}_where": sa.text(cond) for dialect, cond in predicates.items()}
+
+
+def upgrade() -> None:
+    existing = {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes("audits")}
+
+    def create(name: str, columns: list[str], **kwargs) -> None:
+        if name not in existing:
+            op.create_index(name, "audits", columns, **kwargs)
+
+    create("ix_audits_delivered", ["tenant_id", "user_id", "rule_id", "date"], **_where(DELIVERED))
+    create("ix_audits_user_date", ["user_id", "date"])
+    if "ix_audits_user_id" in existing:
+        op.drop_index("ix_audits_user_id", table_name="audits")
+
+
+def downgrade() -> None:
+    op.create_index("ix_audits_user_id", "audits", ["user_id"])
+    op.drop_index("ix_audits_user_date", table_name="audits")
+    op.drop_index("ix_audits_delivered", table_name="audits")
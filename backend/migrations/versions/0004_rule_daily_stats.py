@@ -0,0 +1,45 @@
+"""Resumen diario por regla para analítica (`rule_daily_stats`).
+
+Se rellena al arrancar desde `audits` (`backfill_rule_daily_stats`) y después
+se mantiene en cada escritura de auditorías.
+
+`/analytics/triggers` y `/rules/{id}/stats` leen de aquí en lugar de agregar
+`audits`.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-09-08
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rule_daily_stats",
+        sa.Column("tenant_id", sa.String(length=50), nullable=False),
+        sa.Column("rule_id", sa.String(length=100), nullable=False),
+        sa.Column("date", sa.Date(), nullable=False),
+        sa.Column("fired_count", sa.Integer(), nullable=False),
+        sa.Column("evaluated_count", sa.Integer(), nullable=False),
+        sa.Column("distinct_users", sa.Integer(), nullable=False),
+        sa.Column("per_message_counts", sa.JSON(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("tenant_id", "rule_id", "date", name="pk_rule_daily_stats"),
+    )
+    op.create_index("ix_rule_daily_stats_tenant_date", "rule_daily_stats", ["tenant_id", "date"])
+    op.create_index("ix_rule_daily_stats_rule_date", "rule_daily_stats", ["rule_id", "date"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_rule_daily_stats_rule_date", table_name="rule_daily_stats")
+    op.drop_index("ix_rule_daily_stats_tenant_date", table_name="rule_daily_stats")
+    op.drop_table("rule_daily_stats")
@@ -0,0 +1,27 @@
+"""`audits.sample_weight`: evaluaciones que representa cada fila con `audit_policy=sampled`.
+
+Las filas existentes valen 1 (política `full`).
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-09-15
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("audits", sa.Column("sample_weight", sa.Float(), server_default=sa.text("1"), nullable=False))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("audits") as batch:
+        batch.drop_column("sample_weight")
@@ -0,0 +1,407 @@
+"""Retención de `audits`: ventana caliente en la base de datos y archivo frío en Parquet.
+
+Las auditorías anteriores a la ventana caliente del tenant se exportan a
+`settings.audit_archive_dir` particionadas al estilo Hive
+(`tenant_id=<t>/date=<AAAA-MM-DD>/part-<primer id>-<último id>.parquet`) y
+después se borran de `audits` por sus ids, un lote por transacción. Un id
+está en un solo fichero de su partición: si un lote solapa el rango de ids
+de ficheros existentes (reejecución tras una caída con otros límites de
+lote), se fusionan en un fichero nuevo. Cada
+fila archivada lleva sus features (`values`) en JSON, así que el archivo no
+depende de `feature_snapshots`, cuyos snapshots antiguos también se borran.
+
+`rule_daily_stats` y `rule_fire_state` no se tocan: la analítica agregada y
+los cooldowns siguen funcionando para los días archivados. La ventana nunca
+baja de `MIN_HOT_DAYS` ni de `anti_repeat_days`, que es lo que el motor lee
+de `audits` hacia atrás.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+from datetime import date, timedelta
+from typing import Any, Iterable
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, distinct, func, select
+from sqlalchemy.orm import selectinload
+
+from backend.config import settings
+from backend.rules_engine.persistence import Audit, FeatureSnapshot, get_session
+
+try:  # pyarrow es opcional: sin él no hay archivo, la tabla caliente sigue funcionando
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depende del entorno
+    pa = None
+    pc = None
+    ds = None
+    pq = None
+
+
+# Máximo de `cooldown_days` en `dsl.RuleModel`
+MIN_HOT_DAYS = 30
+# Límite de parámetros por IN (SQLite antiguo admite 999)
+CHUNK = 500
+PART_FILE = re.compile(r"part-(\d+)-(\d+)\.parquet")
+
+ARCHIVE_COLUMNS = [
+    "id",
+    "tenant_id",
+    "date",
+    "user_id",
+    "rule_id",
+    "fired",
+    "discarded_reason",
+    "message_id",
+    "sample_weight",
+    "why",
+    "values",
+    "data_version",
+    "created_at",
+]
+
+
+def _require_pyarrow() -> None:
+    if pq is None:
+        raise RuntimeError("Archivo de auditorías no disponible: instalar pyarrow")
+
+
+def _file_schema() -> Any:
+    # tenant_id y date van en la ruta de la partición, no en el fichero
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("user_id", pa.string()),
+            ("rule_id", pa.string()),
+            ("fired", pa.bool_()),
+            ("discarded_reason", pa.string()),
+            ("message_id", pa.int64()),
+            ("sample_weight", pa.float64()),
+            ("why", pa.string()),
+            ("values", pa.string()),
+            ("data_version", pa.string()),
+            ("created_at", pa.timestamp("us")),
+        ]
+    )
+
+
+def _partition_schema() -> Any:
+    return pa.schema([("tenant_id", pa.string()), ("date", pa.date32())])
+
+
+def _partitioning() -> Any:
+    return ds.partitioning(_partition_schema(), flavor="hive")
+
+
+def archive_dir() -> str:
+    return settings.audit_archive_dir
+
+
+def hot_days(tenant_id: str) -> int:
+    """Días que se conservan en `audits` para el tenant (`audit_hot_days_by_tenant` o el general)."""
+    days = settings.audit_hot_days_by_tenant.get(tenant_id, settings.audit_hot_days)
+    return max(int(days), MIN_HOT_DAYS, int(settings.anti_repeat_days))
+
+
+def archive_cutoff(tenant_id: str, today: date | None = None) -> date:
+    """Primer día que sigue en la tabla caliente; lo anterior se archiva."""
+    return (today or date.today()) - timedelta(days=hot_days(tenant_id) - 1)
+
+
+def _partition_dir(root: str, tenant_id: str, day: date) -> str:
+    return os.path.join(root, f"tenant_id={quote(tenant_id, safe='')}", f"date={day.isoformat()}")
+
+
+def _part_files(parent: str) -> dict[str, tuple[int, int]]:
+    """`{ruta: (primer id, último id)}` de los ficheros de una partición."""
+    out: dict[str, tuple[int, int]] = {}
+    for name in os.listdir(parent):
+        match = PART_FILE.fullmatch(name)
+        if match:
+            out[os.path.join(parent, name)] = (int(match.group(1)), int(match.group(2)))
+    return out
+
+
+def _write_partition(root: str, tenant_id: str, day: date, rows: list[dict[str, Any]]) -> str:
+    """Escribe un fichero de la partición (tmp + `os.replace`) con `rows` ordenadas por id.
+
+    Los ficheros existentes cuyo rango de ids solapa el del lote (de una
+    ejecución interrumpida antes del borrado, con otros límites de lote) se
+    fusionan en el nuevo, quedándose con la versión del lote de cada id, y se
+    eliminan después de escribirlo. Sin solape solo se añade el fichero.
+    """
+    parent = _partition_dir(root, tenant_id, day)
+    os.makedirs(parent, exist_ok=True)
+    table = pa.Table.from_pylist(rows, schema=_file_schema())
+    first, last = rows[0]["id"], rows[-1]["id"]
+    existing = _part_files(parent)
+    merged: list[str] = []
+    while True:
+        overlapping = [p for p, (lo, hi) in existing.items() if p not in merged and lo <= last and hi >= first]
+        if not overlapping:
+            break
+        merged.extend(overlapping)
+        first = min(first, *(existing[p][0] for p in overlapping))
+        last = max(last, *(existing[p][1] for p in overlapping))
+    if merged:
+        old = ds.dataset(merged, schema=_file_schema(), format="parquet").to_table()
+        old = old.filter(pc.invert(pc.is_in(old["id"], value_set=table["id"])))
+        # Los ficheros fusionados también pueden repetir ids entre sí
+        _, keep = np.unique(old["id"].to_numpy(), return_index=True)
+        table = pa.concat_tables([old.take(keep), table]).sort_by("id")
+    path = os.path.join(parent, f"part-{first:012d}-{last:012d}.parquet")
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd", write_statistics=True)
+    os.replace(tmp_path, path)
+    for old_path in merged:
+        if old_path != path:
+            os.remove(old_path)
+    return path
+
+
+def _dumps(value: Any) -> str | None:
+    return None if value is None else json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _archive_row(audit: Audit, snapshot_values: Any, data_version: str | None) -> dict[str, Any]:
+    return {
+        "id": audit.id,
+        "user_id": audit.user_id,
+        "rule_id": audit.rule_id,
+        "fired": bool(audit.fired),
+        "discarded_reason": audit.discarded_reason,
+        "message_id": audit.message_id,
+        "sample_weight": audit.sample_weight,
+        "why": _dumps(audit.why),
+        # Auditorías antiguas guardaban `values` en la fila; las nuevas en el snapshot
+        "values": _dumps(audit.values if audit.values is not None else snapshot_values),
+        "data_version": data_version,
+        "created_at": audit.created_at,
+    }
+
+
+def archive_audits(
+    tenant_id: str | None = None,
+    today: date | None = None,
+    batch_rows: int | None = None,
+    dry_run: bool = False,
+) -> dict[str, dict[str, Any]]:
+    """Exporta y borra las auditorías fuera de la ventana caliente de cada tenant.
+
+    Recorre `audits` por id en lotes de `batch_rows` (por defecto
+    `settings.audit_archive_batch_rows`): escribe un fichero por día del lote y
+    borra exactamente los ids exportados en la misma transacción. Si el proceso se
+    interrumpe entre la escritura y el borrado, la siguiente ejecución vuelve a
+    exportar esas filas y `_write_partition` las fusiona con el fichero ya
+    escrito, aunque los lotes tengan otros límites. Devuelve `{tenant_id: {"cutoff", "archived",
+    "snapshots_deleted", "files"}}`; con `dry_run` solo cuenta las filas.
+    """
+    size = max(1, int(batch_rows or settings.audit_archive_batch_rows))
+    root = archive_dir()
+    if not dry_run:
+        _require_pyarrow()
+    report: dict[str, dict[str, Any]] = {}
+    with get_session() as session:
+        tenants = [tenant_id] if tenant_id else sorted(session.scalars(select(distinct(Audit.tenant_id))).all())
+        for tenant in tenants:
+            cutoff = archive_cutoff(tenant, today)
+            old = (Audit.tenant_id == tenant, Audit.date < cutoff)
+            summary: dict[str, Any] = {"cutoff": cutoff.isoformat(), "archived": 0, "snapshots_deleted": 0, "files": []}
+            report[tenant] = summary
+            if dry_run:
+                summary["archived"] = int(session.scalar(select(func.count(Audit.id)).where(*old)) or 0)
+                continue
+
+            last_id = 0
+            while True:
+                batch = session.execute(
+                    select(Audit, FeatureSnapshot.values, FeatureSnapshot.data_version)
+                    .outerjoin(FeatureSnapshot, Audit.feature_snapshot_id == FeatureSnapshot.id)
+                    .where(*old, Audit.id > last_id)
+                    .order_by(Audit.id)
+                    .limit(size)
+                ).all()
+                if not batch:
+                    break
+                by_day: dict[date, list[dict[str, Any]]] = {}
+                for audit, values, version in batch:
+                    by_day.setdefault(audit.date, []).append(_archive_row(audit, values, version))
+                for day, rows in sorted(by_day.items()):
+                    summary["files"].append(_write_partition(root, tenant, day, rows))
+                # Solo los ids exportados: una fila antigua insertada después del SELECT
+                # (backfill, escritor asíncrono) se queda para la siguiente ejecución
+                exported = [audit.id for audit, _, _ in batch]
+                last_id = exported[-1]
+                for i in range(0, len(exported), CHUNK):
+                    session.execute(delete(Audit).where(Audit.id.in_(exported[i : i + CHUNK])))
+                session.commit()
+                session.expunge_all()
+                summary["archived"] += len(batch)
+
+            # Snapshots anteriores al corte, salvo los que aún usa alguna auditoría sin archivar
+            in_use = set(session.scalars(select(distinct(Audit.feature_snapshot_id)).where(*old)).all())
+            last_id = 0
+            while True:
+                ids = session.scalars(
+                    select(FeatureSnapshot.id)
+                    .where(FeatureSnapshot.tenant_id == tenant, FeatureSnapshot.date < cutoff, FeatureSnapshot.id > last_id)
+                    .order_by(FeatureSnapshot.id)
+                    .limit(CHUNK)
+                ).all()
+                if not ids:
+                    break
+                last_id = ids[-1]
+                unused = [sid for sid in ids if sid not in in_use]
+                if unused:
+                    session.execute(delete(FeatureSnapshot).where(FeatureSnapshot.id.in_(unused)))
+                    session.commit()
+                    summary["snapshots_deleted"] += len(unused)
+    return report
+
+
+def read_archived_audits(
+    tenant_id: str = "default",
+    start: date | None = None,
+    end: date | None = None,
+    user_ids: Iterable[str] | None = None,
+    rule_ids: Iterable[str] | None = None,
+    fired: bool | None = None,
+    columns: Iterable[str] | None = None,
+    path: str | None = None,
+    exclude_ids: Iterable[int] | None = None,
+    limit: int | None = None,
+) -> pd.DataFrame:
+    """Lee el archivo con poda de particiones por tenant y fecha y filtros sobre las columnas.
+
+    Devuelve un DataFrame con `ARCHIVE_COLUMNS` (o las pedidas), `date` como
+    `datetime.date` y `why`/`values` como texto JSON, ordenado por fecha e id.
+    Vacío si no hay archivo. Los ficheros anteriores a `sample_weight` se leen
+    con peso 1. `exclude_ids` descarta esos ids en el escaneo; con `limit`
+    solo se leen enteras las `limit` filas más recientes (fecha e id): un
+    primer escaneo de `date` e `id` las elige. Un id repetido en dos ficheros
+    (caída entre la escritura de una fusión y el borrado de los fusionados) se
+    devuelve una vez.
+    """
+    _require_pyarrow()
+    root = path or archive_dir()
+    cols = list(dict.fromkeys(columns)) if columns is not None else list(ARCHIVE_COLUMNS)
+    if not os.path.isdir(root):
+        return pd.DataFrame(columns=cols)
+
+    # Esquema explícito: las columnas que falten en ficheros antiguos se leen como nulos
+    schema = pa.unify_schemas([_file_schema(), _partition_schema()])
+    dataset = ds.dataset(
+        root, schema=schema, format="parquet", partitioning=_partitioning(), exclude_invalid_files=True
+    )
+    expr = ds.field("tenant_id") == tenant_id
+    if start is not None:
+        expr = expr & (ds.field("date") >= pa.scalar(start, pa.date32()))
+    if end is not None:
+        expr = expr & (ds.field("date") <= pa.scalar(end, pa.date32()))
+    if user_ids is not None:
+        expr = expr & ds.field("user_id").isin([str(u) for u in user_ids])
+    if rule_ids is not None:
+        expr = expr & ds.field("rule_id").isin([str(r) for r in rule_ids])
+    if fired is not None:
+        expr = expr & (ds.field("fired") == fired)
+    if exclude_ids is not None:
+        expr = expr & ~ds.field("id").isin([int(i) for i in exclude_ids])
+    if limit is not None:
+        keys = dataset.to_table(columns=["date", "id"], filter=expr).to_pandas()
+        keys = keys.drop_duplicates("id").sort_values(["date", "id"]).tail(max(int(limit), 0))
+        expr = expr & ds.field("id").isin(keys["id"].tolist())
+    scan = cols if "id" in cols else [*cols, "id"]
+    df = dataset.to_table(columns=scan, filter=expr).to_pandas().drop_duplicates("id")
+    if "message_id" in df.columns:
+        df["message_id"] = df["message_id"].astype("Int64")
+    if "sample_weight" in df.columns:
+        df["sample_weight"] = df["sample_weight"].fillna(1.0)
+    df = df.sort_values([c for c in ("date", "id") if c in df.columns])
+    return df[cols].reset_index(drop=True)
+
+
+def _hot_row(audit: Audit) -> dict[str, Any]:
+    values = audit.values
+    if values is None and audit.feature_snapshot is not None:
+        values = audit.feature_snapshot.values
+    return {
+        "id": audit.id,
+        "tenant_id": audit.tenant_id,
+        "date": audit.date.isoformat(),
+        "user_id": audit.user_id,
+        "rule_id": audit.rule_id,
+        "fired": bool(audit.fired),
+        "discarded_reason": audit.discarded_reason,
+        "message_id": audit.message_id,
+        "sample_weight": audit.sample_weight,
+        "why": audit.why,
+        "values": values,
+        "archived": False,
+    }
+
+
+def _cold_row(record: dict[str, Any]) -> dict[str, Any]:
+    mid = record.get("message_id")
+    return {
+        "id": int(record["id"]),
+        "tenant_id": record["tenant_id"],
+        "date": record["date"].isoformat(),
+        "user_id": record["user_id"],
+        "rule_id": record["rule_id"],
+        "fired": bool(record["fired"]),
+        "discarded_reason": record["discarded_reason"],
+        "message_id": None if pd.isna(mid) else int(mid),
+        "sample_weight": float(record["sample_weight"]),
+        "why": json.loads(record["why"]) if record["why"] else None,
+        "values": json.loads(record["values"]) if record["values"] else None,
+        "archived": True,
+    }
+
+
+def query_audits(
+    tenant_id: str,
+    start: date,
+    end: date,
+    user_id: str | None = None,
+    rule_id: str | None = None,
+    fired: bool | None = None,
+    limit: int = 1000,
+) -> list[dict[str, Any]]:
+    """Auditorías del rango combinando `audits` y, si el rango llega antes del corte, el archivo.
+
+    Más recientes primero (fecha e id descendentes). Un id presente en ambos
+    (archivado pero aún sin borrar) se devuelve una vez, desde la tabla.
+    """
+    stmt = select(Audit).options(selectinload(Audit.feature_snapshot)).where(
+        Audit.tenant_id == tenant_id, Audit.date >= start, Audit.date <= end
+    )
+    if user_id is not None:
+        stmt = stmt.where(Audit.user_id == user_id)
+    if rule_id is not None:
+        stmt = stmt.where(Audit.rule_id == rule_id)
+    if fired is not None:
+        stmt = stmt.where(Audit.fired == fired)
+    with get_session() as session:
+        hot = session.scalars(stmt.order_by(Audit.date.desc(), Audit.id.desc()).limit(limit)).all()
+        rows = [_hot_row(a) for a in hot]
+
+    if start < archive_cutoff(tenant_id) and pq is not None:
+        cold = read_archived_audits(
+            tenant_id,
+            start,
+            end,
+            user_ids=[user_id] if user_id is not None else None,
+            rule_ids=[rule_id] if rule_id is not None else None,
+            fired=fired,
+            exclude_ids=[r["id"] for r in rows],
+            limit=limit,
+        )
+        rows.extend(_cold_row(rec) for rec in cold.to_dict("records"))
+    rows.sort(key=lambda r: (r["date"], r["id"]), reverse=True)
+    return rows[:limit]
@@ -0,0 +1,283 @@
+"""Escritura asíncrona de auditorías en un hilo de fondo.
+
+Las evaluaciones encolan filas de `Audit` (dicts de columnas) y un hilo las
+vacía con `bulk_insert_audits`, agrupando hasta `audit_commit_rows` filas o
+`audit_flush_interval_ms` de espera por transacción. La cola está acotada
+por filas: si está llena, `submit` espera hasta `audit_enqueue_timeout_seconds`
+y después escribe el bloque de forma síncrona en el hilo del llamador.
+
+Un bloque que falla se reintenta hasta `audit_write_retries` veces con
+espera creciente. Después se abandonan sus filas no entregadas (contador
+`failed`), pero los disparos entregados se siguen reintentando: sin ellos
+`rule_fire_state` no se actualiza y cooldowns y anti-repetición dejarían de
+funcionar.
+
+Mientras una fila está en cola o escribiéndose, sus disparos entregados se
+exponen en `pending_fires` para que cooldowns y anti-repetición los vean
+igual que si ya estuvieran en la base de datos. Si el hilo no está
+arrancado, `submit` escribe de forma síncrona.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from datetime import date
+from typing import Any, Iterable
+
+from backend.config import settings
+from backend.rules_engine.persistence import bulk_insert_audits
+
+
+logger = logging.getLogger(__name__)
+
+FireKey = tuple[str, str, str]
+
+
+def _delivered(row: dict[str, Any]) -> bool:
+    return bool(row.get("fired")) and row.get("discarded_reason") is None
+
+
+def _fire_key(row: dict[str, Any]) -> FireKey:
+    return (row.get("tenant_id") or "default", str(row["user_id"]), str(row["rule_id"]))
+
+
+class AuditWriter:
+    def __init__(
+        self,
+        max_rows: int | None = None,
+        flush_rows: int | None = None,
+        flush_interval: float | None = None,
+        enqueue_timeout: float | None = None,
+    ) -> None:
+        self.max_rows = max(1, int(max_rows if max_rows is not None else settings.audit_queue_max_rows))
+        self.flush_rows = max(1, int(flush_rows or settings.audit_commit_rows or 1000))
+        self.flush_interval = (
+            flush_interval if flush_interval is not None else settings.audit_flush_interval_ms / 1000.0
+        )
+        self.enqueue_timeout = (
+            enqueue_timeout if enqueue_timeout is not None else settings.audit_enqueue_timeout_seconds
+        )
+        self._queue: deque[tuple[float, dict[str, Any]]] = deque()
+        self._in_flight: list[tuple[float, dict[str, Any]]] = []
+        self._pending: dict[FireKey, list[tuple[date, int | None]]] = {}
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+        self._flush_requested = False
+        # Métricas
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+        self.sync_writes = 0
+        self.last_flush_seconds = 0.0
+        self.last_flush_latency_seconds = 0.0
+        self.max_flush_latency_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        with self._cond:
+            if self.running:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = 30.0) -> None:
+        """Detiene el hilo tras escribir todo lo pendiente."""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        thread.join(timeout)
+        with self._cond:
+            self._thread = None
+
+    def _write_sync(self, rows: list[dict[str, Any]]) -> None:
+        bulk_insert_audits(rows)
+        with self._cond:
+            self.sync_writes += 1
+            self.written += len(rows)
+
+    def submit(self, rows: list[dict[str, Any]]) -> bool:
+        """Encola las filas de una evaluación; False si se escribieron de forma síncrona.
+
+        Las filas nunca se descartan: sin hilo, con la cola llena tras la espera
+        o durante la parada se escriben en el hilo del llamador, y un error de
+        escritura se propaga.
+        """
+        if not rows:
+            return True
+        if not self.running or self._stopping or len(rows) > self.max_rows:
+            # Sin hilo (scripts, workers) o lote mayor que la cola: escritura directa
+            self._write_sync(rows)
+            return False
+        with self._cond:
+            has_room = self._cond.wait_for(
+                lambda: len(self._queue) + len(rows) <= self.max_rows or not self.running or self._stopping,
+                timeout=self.enqueue_timeout,
+            )
+            queued = has_room and self.running and not self._stopping
+            if queued:
+                self._enqueue(rows)
+        if not queued:
+            logger.warning("audit queue full or stopping: writing %d rows synchronously", len(rows))
+            self._write_sync(rows)
+        return queued
+
+    def _enqueue(self, rows: list[dict[str, Any]]) -> None:
+        # Llamado con el lock
+        now = time.monotonic()
+        for row in rows:
+            self._queue.append((now, row))
+            if _delivered(row):
+                key = _fire_key(row)
+                self._pending.setdefault(key, []).append((row["date"], row.get("message_id")))
+        self.enqueued += len(rows)
+        self._cond.notify_all()
+
+    def flush(self, timeout: float | None = 30.0) -> bool:
+        """Espera a que la cola y la escritura en curso queden vacías."""
+        with self._cond:
+            if not self.running:
+                return not self._queue
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._queue and not self._in_flight, timeout=timeout)
+
+    def pending_fires(
+        self, tenant_id: str, user_ids: Iterable[str], rule_ids: Iterable[str], since: date
+    ) -> list[tuple[str, str, date, int | None]]:
+        """Disparos entregados del tenant aún no confirmados en la base de datos."""
+        users = {str(u) for u in user_ids}
+        rules = {str(r) for r in rule_ids}
+        with self._cond:
+            if not self._pending:
+                return []
+            return [
+                (uid, rid, d, mid)
+                for (tid, uid, rid), fires in self._pending.items()
+                if tid == tenant_id and uid in users and rid in rules
+                for d, mid in fires
+                if d >= since
+            ]
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            oldest = self._queue[0][0] if self._queue else None
+            return {
+                "running": self.running,
+                "queue_depth": len(self._queue),
+                "in_flight": len(self._in_flight),
+                "max_rows": self.max_rows,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "failed": self.failed,
+                "retries": self.retries,
+                "flushes": self.flushes,
+                "sync_writes": self.sync_writes,
+                "oldest_pending_seconds": round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+                "last_flush_seconds": round(self.last_flush_seconds, 4),
+                "last_flush_latency_seconds": round(self.last_flush_latency_seconds, 4),
+                "max_flush_latency_seconds": round(self.max_flush_latency_seconds, 4),
+            }
+
+    def _take_batch(self) -> list[tuple[float, dict[str, Any]]]:
+        # Llamado con el lock: espera a tener un bloque completo, al intervalo o a un flush/stop
+        self._cond.wait_for(lambda: self._queue or self._stopping)
+        if not self._queue:
+            return []
+        deadline = self._queue[0][0] + self.flush_interval
+        self._cond.wait_for(
+            lambda: len(self._queue) >= self.flush_rows or self._stopping or self._flush_requested,
+            timeout=max(0.0, deadline - time.monotonic()),
+        )
+        n = min(len(self._queue), self.flush_rows)
+        batch = [self._queue.popleft() for _ in range(n)]
+        if not self._queue:
+            self._flush_requested = False
+        return batch
+
+    def _release(self, batch: list[tuple[float, dict[str, Any]]]) -> None:
+        for _, row in batch:
+            if not _delivered(row):
+                continue
+            key = _fire_key(row)
+            fires = self._pending.get(key)
+            if not fires:
+                continue
+            try:
+                fires.remove((row["date"], row.get("message_id")))
+            except ValueError:
+                pass
+            if not fires:
+                del self._pending[key]
+
+    def _run(self) -> None:
+        retry: list[tuple[float, dict[str, Any]]] = []
+        attempts = 0
+        while True:
+            with self._cond:
+                batch = retry or self._take_batch()
+                if not batch:
+                    if self._stopping:
+                        return
+                    continue
+                self._in_flight = batch
+                self._cond.notify_all()  # hay hueco para productores bloqueados
+
+            started = time.monotonic()
+            ok = True
+            try:
+                bulk_insert_audits([row for _, row in batch], commit_rows=0)
+            except Exception:  # noqa: BLE001
+                ok = False
+                logger.exception("audit writer: failed to write %d rows (attempt %d)", len(batch), attempts + 1)
+            finished = time.monotonic()
+
+            with self._cond:
+                self.flushes += 1
+                self.last_flush_seconds = finished - started
+                if ok:
+                    self._release(batch)
+                    self._in_flight = []
+                    self.written += len(batch)
+                    self.last_flush_latency_seconds = finished - batch[0][0]
+                    self.max_flush_latency_seconds = max(
+                        self.max_flush_latency_seconds, self.last_flush_latency_seconds
+                    )
+                    retry, attempts = [], 0
+                    self._cond.notify_all()
+                    continue
+
+                attempts += 1
+                self.retries += 1
+                retry = batch
+                if attempts > settings.audit_write_retries:
+                    # Se abandonan las filas no entregadas; los disparos entregados se reintentan siempre
+                    retry = [item for item in batch if _delivered(item[1])]
+                    if len(retry) < len(batch):
+                        self.failed += len(batch) - len(retry)
+                        logger.error(
+                            "audit writer: giving up on %d undelivered rows, retrying %d delivered",
+                            len(batch) - len(retry),
+                            len(retry),
+                        )
+                    self._in_flight = retry
+                    self._cond.notify_all()
+                    if not retry:
+                        attempts = 0
+                        continue
+                # Espera creciente antes del siguiente intento (stop/flush la acortan)
+                self._cond.wait(timeout=min(5.0, 0.1 * 2 ** min(attempts, 6)))
+
+
+audit_writer = AuditWriter()
@@ -0,0 +1,261 @@
+"""Compilación de reglas a predicados.
+
+`compile_rule` valida una `Rule` con el DSL una sola vez y convierte su árbol
+`logic` en closures anidadas: cada hoja tiene ya resuelto el operador, el
+umbral (`in` como frozenset, `between` como (min, max)) y la referencia a la
+feature, de modo que evaluar es llamar a una función sin `isinstance` ni
+comparaciones de strings. El resultado y las entradas de `why` son los mismos
+que los de `engine.eval_node`, incluido el cortocircuito de all/any/none.
+
+Los compilados se cachean por `(Rule.id, Rule.version, Rule.updated_at)`.
+"""
+from __future__ import annotations
+
+import operator
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from backend.rules_engine.dsl import GroupAll, GroupAny, GroupNone, NumericLeaf, RelativeLeaf, RuleModel, iter_feature_refs
+from backend.rules_engine.persistence import Rule
+
+
+Features = Dict[str, Dict[str, Any]]
+Why = list
+Predicate = Callable[[Features, Why], bool]
+
+_ORDER_OPS: dict[str, Callable[[Any, Any], Any]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+}
+
+
+def parse_rule(r: Rule) -> RuleModel:
+    return RuleModel(
+        id=r.id,
+        version=r.version,
+        enabled=r.enabled,
+        tenant_id=r.tenant_id,
+        category=r.category or "",
+        priority=r.priority,
+        severity=r.severity,
+        cooldown_days=r.cooldown_days,
+        max_per_day=r.max_per_day,
+        tags=r.tags or [],
+        logic=r.logic,
+        messages={
+            "locale": r.locale,
+            "candidates": [
+                {"id": str(m.id), "text": m.text, "weight": m.weight}
+                for m in r.messages
+                if m.active
+            ],
+        },
+    )
+
+
+def _comparator(op: str, value: Any) -> Callable[[Any], bool]:
+    """Comparación `observed <op> value` con el umbral ya preparado (mismo criterio que `engine.compare`)."""
+    if op in _ORDER_OPS:
+        fn = _ORDER_OPS[op]
+        if value is None:
+            return lambda left: False
+
+        def cmp(left: Any) -> bool:
+            if left is None:
+                return False
+            return bool(fn(left, value))
+
+        return cmp
+    if op == "between":
+        if value is None or len(value) != 2 or value[0] is None or value[1] is None:
+            return lambda left: False
+        low, high = value
+
+        def between(left: Any) -> bool:
+            if left is None:
+                return False
+            return bool(low <= left <= high)
+
+        return between
+    if op == "in":
+        members: Any = value
+        if isinstance(value, (list, tuple, set, frozenset)):
+            try:
+                members = frozenset(value)
+            except TypeError:  # elementos no hashables: se queda como tupla
+                members = tuple(value)
+
+        def contains(left: Any) -> bool:
+            if left is None:
+                return False
+            try:
+                return bool(left in members)
+            except Exception:  # noqa: BLE001
+                return False
+
+        return contains
+    return lambda left: False
+
+
+def _dynamic_compare(op: str, left: Any, right: Any) -> bool:
+    # Reglas relativas: el lado derecho es una feature, no se puede preparar
+    if left is None or right is None:
+        return False
+    return _comparator(op, right)(left)
+
+
+def _compile_numeric(node: NumericLeaf) -> Predicate:
+    var, agg, op, threshold, required = node.var, node.agg, node.op, node.value, node.required
+    check = _comparator(op, threshold)
+
+    def leaf(features: Features, why: Why) -> bool:
+        val = features.get(var, {}).get(agg)
+        outcome = check(val)
+        why.append(
+            {
+                "type": "numeric",
+                "var": var,
+                "agg": agg,
+                "op": op,
+                "threshold": threshold,
+                "observed": val,
+                "result": outcome,
+            }
+        )
+        if val is None and required:
+            return False
+        return outcome
+
+    return leaf
+
+
+def _compile_relative(node: RelativeLeaf) -> Predicate:
+    lvar, lagg = node.left.var, node.left.agg
+    rvar, ragg, scale = node.right.var, node.right.agg, node.right.scale
+    op, required = node.op, node.required
+    fixed = _ORDER_OPS.get(op)
+
+    def leaf(features: Features, why: Why) -> bool:
+        left = features.get(lvar, {}).get(lagg)
+        right = features.get(rvar, {}).get(ragg)
+        if right is not None and scale is not None:
+            right = right * scale
+        if fixed is not None:
+            outcome = left is not None and right is not None and bool(fixed(left, right))
+        else:
+            outcome = _dynamic_compare(op, left, right)
+        why.append(
+            {
+                "type": "relative",
+                "left": {"var": lvar, "agg": lagg, "observed": left},
+                "op": op,
+                "right": {"var": rvar, "agg": ragg, "scale": scale, "observed": right},
+                "result": outcome,
+            }
+        )
+        if (left is None or right is None) and required:
+            return False
+        return outcome
+
+    return leaf
+
+
+def compile_node(node: Any) -> Predicate:
+    """Convierte un nodo `logic` validado en `predicate(features, why) -> bool`."""
+    if isinstance(node, NumericLeaf):
+        return _compile_numeric(node)
+    if isinstance(node, RelativeLeaf):
+        return _compile_relative(node)
+    if isinstance(node, GroupAll):
+        children = tuple(compile_node(c) for c in node.all)
+        return lambda features, why: all(c(features, why) for c in children)
+    if isinstance(node, GroupAny):
+        children = tuple(compile_node(c) for c in node.any)
+        return lambda features, why: any(c(features, why) for c in children)
+    if isinstance(node, GroupNone):
+        children = tuple(compile_node(c) for c in node.none)
+        return lambda features, why: not any(c(features, why) for c in children)
+    return lambda features, why: False
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    rule_id: str
+    key: tuple[Any, ...]
+    logic: Any
+    model: Optional[RuleModel] = None
+    predicate: Optional[Predicate] = None
+    required: frozenset[tuple[str, str]] = field(default_factory=frozenset)
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.predicate is not None
+
+    def evaluate(self, features: Features, why: Why) -> bool:
+        if self.predicate is None:
+            return False
+        return self.predicate(features, why)
+
+
+def rule_cache_key(r: Rule) -> tuple[Any, ...]:
+    return (r.id, r.version, r.updated_at)
+
+
+def compile_rule(r: Rule) -> CompiledRule:
+    """Valida y compila una regla; los errores de validación quedan en `error`.
+
+    `required` solo cubre el árbol `logic`: los mensajes se editan sin tocar la
+    fila de la regla (y por tanto su clave de caché), así que sus placeholders
+    se leen de la regla viva en cada evaluación.
+    """
+    key = rule_cache_key(r)
+    try:
+        model = parse_rule(r)
+    except Exception as e:  # noqa: BLE001
+        return CompiledRule(rule_id=r.id, key=key, logic=r.logic, error=str(e))
+    return CompiledRule(
+        rule_id=r.id,
+        key=key,
+        logic=r.logic,
+        model=model,
+        predicate=compile_node(model.logic),
+        required=frozenset(iter_feature_refs(model.logic)),
+    )
+
+
+class CompiledRuleCache:
+    """Una entrada por regla; una versión nueva reemplaza a la anterior."""
+
+    def __init__(self) -> None:
+        self._entries: dict[str, CompiledRule] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, r: Rule) -> CompiledRule:
+        key = rule_cache_key(r)
+        entry = self._entries.get(r.id)
+        # `logic ==` protege de updated_at con resolución de segundos (borrar y recrear con el mismo id)
+        if entry is not None and entry.key == key and entry.logic == r.logic:
+            self.hits += 1
+            return entry
+        compiled = compile_rule(r)
+        with self._lock:
+            self._entries[r.id] = compiled
+            self.misses += 1
+        return compiled
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+compiled_rules = CompiledRuleCache()
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any, Literal, Optional
+from typing import Any, Iterator, Literal, Optional
 
 from pydantic import BaseModel, Field, model_validator
 
@@ -87,3 +87,19 @@ class RuleModel(BaseModel):
     messages: RuleMessages
 
 
+def iter_feature_refs(node: Any) -> Iterator[tuple[str, str]]:
+    """Pares (var, agg) que lee un árbol `logic` ya validado."""
+    if isinstance(node, NumericLeaf):
+        yield node.var, node.agg
+    elif isinstance(node, RelativeLeaf):
+        yield node.left.var, node.left.agg
+        yield node.right.var, node.right.agg
+    elif isinstance(node, GroupAll):
+        for child in node.all:
+            yield from iter_feature_refs(child)
+    elif isinstance(node, GroupAny):
+        for child in node.any:
+            yield from iter_feature_refs(child)
+    elif isinstance(node, GroupNone):
+        for child in node.none:
+            yield from iter_feature_refs(child)
@@ -2,17 +2,37 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import date, timedelta
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Tuple
 import math
 from numpy import bool_ as np_bool
 from numpy import floating as np_floating
 from numpy import integer as np_integer
+from sqlalchemy import select
 
 from backend.config import settings
 from backend.rules_engine.dsl import GroupAll, GroupAny, GroupNone, NumericLeaf, RelativeLeaf, RuleModel, VarRef
-from backend.rules_engine.features import build_features, load_base_dataframe
-from backend.rules_engine.messages import render_message, select_weighted_random
-from backend.rules_engine.persistence import Audit, Rule, RuleMessage, get_enabled_rules, get_session
+from backend.rules_engine.features import (
+    build_features,
+    build_features_all,
+    dataset_scope,
+    dataset_version,
+    features_from_matrix,
+    load_base_dataframe,
+)
+from backend.rules_engine.feature_state import dataset_feature_state
+from backend.rules_engine.messages import placeholder_refs, render_message, select_weighted_random
+from backend.rules_engine.audit_writer import audit_writer
+from backend.rules_engine.persistence import (
+    BUDGET_EXHAUSTED,
+    Audit,
+    Rule,
+    RuleMessage,
+    get_session,
+    keeps_unfired_audits,
+    load_fire_state,
+)
+from backend.rules_engine.rule_snapshot import rule_sets
+from backend.rules_engine.vectorized import evaluate_matrix
 
 
 @dataclass
@@ -33,6 +53,9 @@ class RecommendationEvent:
 def compare(op: str, left: Any, right: Any) -> bool:
     if left is None:
         return False
+    if right is None and op in ("<", "<=", ">", ">=", "=="):
+        # Feature de referencia sin dato (reglas relativas): no dispara
+        return False
     if op == "<":
         return bool(left < right)
     if op == "<=":
@@ -113,7 +136,104 @@ def eval_node(node: Any, features: Dict[str, Dict[str, Any]], why: list[dict[str
     return False
 
 
-def select_message_for_rule(rule: Rule, features: Dict[str, Dict[str, Any]], user_id: str, day: date) -> Tuple[int | None, str, list[str]]:
+
+def _anti_repeat_days() -> int:
+    try:
+        return max(0, int(settings.anti_repeat_days))
+    except Exception:
+        return 0
+
+
+class FireHistory:
+    """Disparos entregados (fired y sin `discarded_reason`) por (user_id, rule_id).
+
+    Cooldowns: último día entregado, leído de `rule_fire_state` por clave
+    primaria. Anti-repetición: variantes entregadas en la ventana, leídas de
+    `audits`. Ambas fuentes se completan con las filas aún en cola del
+    escritor asíncrono. Se precarga una vez para todos los usuarios del lote.
+
+    La cola se lee antes que la base de datos: un bloque que el escritor
+    confirme entre ambas lecturas aparece en la segunda. Los disparos que
+    salen en las dos se cuentan una vez.
+    """
+
+    # Límite de parámetros por IN (SQLite antiguo admite 999)
+    CHUNK = 500
+
+    def __init__(self) -> None:
+        self._last: dict[tuple[str, str], date] = {}
+        self._messages: dict[tuple[str, str], list[tuple[date, int | None]]] = {}
+
+    @classmethod
+    def load(
+        cls,
+        tenant_id: str,
+        user_ids: list[str],
+        rule_ids: list[str],
+        messages_since: date | None = None,
+    ) -> "FireHistory":
+        history = cls()
+        if not user_ids or not rule_ids:
+            return history
+        # Primero la cola (con el lock del escritor), después la base de datos
+        pending = audit_writer.pending_fires(tenant_id, user_ids, rule_ids, date.min)
+        wanted = set(rule_ids)
+        for (uid, rid), day in load_fire_state(tenant_id, user_ids, chunk=cls.CHUNK).items():
+            if rid in wanted:
+                history._mark(uid, rid, day)
+        if messages_since is not None:
+            with get_session() as session:
+                for i in range(0, len(user_ids), cls.CHUNK):
+                    rows = session.execute(
+                        select(Audit.user_id, Audit.rule_id, Audit.date, Audit.message_id).where(
+                            Audit.tenant_id == tenant_id,
+                            Audit.user_id.in_(user_ids[i : i + cls.CHUNK]),
+                            Audit.rule_id.in_(rule_ids),
+                            Audit.fired == True,
+                            Audit.discarded_reason.is_(None),
+                            Audit.date >= messages_since,
+                            Audit.message_id.isnot(None),
+                        )
+                    ).all()
+                    for uid, rid, day, mid in rows:
+                        history._add_message(uid, rid, day, mid)
+        for uid, rid, day, mid in pending:
+            history.add(uid, rid, day, mid)
+        return history
+
+    def _mark(self, user_id: str, rule_id: str, day: date) -> None:
+        last = self._last.get((user_id, rule_id))
+        if last is None or day > last:
+            self._last[(user_id, rule_id)] = day
+
+    def _add_message(self, user_id: str, rule_id: str, day: date, message_id: int | None) -> None:
+        fires = self._messages.setdefault((user_id, rule_id), [])
+        if (day, message_id) not in fires:
+            fires.append((day, message_id))
+
+    def add(self, user_id: str, rule_id: str, day: date, message_id: int | None) -> None:
+        self._mark(user_id, rule_id, day)
+        self._add_message(user_id, rule_id, day, message_id)
+
+    def fired_since(self, user_id: str, rule_id: str, since: date) -> bool:
+        last = self._last.get((user_id, rule_id))
+        return last is not None and last >= since
+
+    def messages_since(self, user_id: str, rule_id: str, since: date) -> set[int]:
+        return {
+            mid
+            for d, mid in self._messages.get((user_id, rule_id), ())
+            if d >= since and isinstance(mid, int)
+        }
+
+
+def select_message_for_rule(
+    rule: Rule,
+    features: Dict[str, Dict[str, Any]],
+    user_id: str,
+    day: date,
+    history: FireHistory | None = None,
+) -> Tuple[int | None, str, list[str]]:
     # Construir candidatos activos
     candidates = [
         {"id": m.id, "text": m.text, "weight": m.weight}
@@ -125,27 +245,12 @@ def select_message_for_rule(rule: Rule, features: Dict[str, Dict[str, Any]], use
 
     # Anti-repetición: excluir variantes usadas en los últimos N días y preferir no vistas
     recent_ids: set[int] = set()
-    try:
-        days = max(0, int(settings.anti_repeat_days))
-    except Exception:
-        days = 0
+    days = _anti_repeat_days()
     if days > 0:
         since = day - timedelta(days=days)
-        with get_session() as session:
-            rows = (
-                session.query(Audit.message_id)
-                .filter(
-                    Audit.user_id == user_id,
-                    Audit.rule_id == rule.id,
-                    Audit.fired == True,
-                    Audit.date >= since,
-                    Audit.message_id.isnot(None),
-                )
-                .all()
-            )
-            for (mid,) in rows:
-                if isinstance(mid, int):
-                    recent_ids.add(mid)
+        if history is None:
+            history = FireHistory.load(rule.tenant_id, [user_id], [rule.id], messages_since=since)
+        recent_ids = history.messages_since(user_id, rule.id, since)
 
     preferred = [c for c in candidates if c.get("id") not in recent_ids]
     pool = preferred if preferred else candidates
@@ -157,133 +262,188 @@ def select_message_for_rule(rule: Rule, features: Dict[str, Dict[str, Any]], use
     return int(choice.get("id")), text, warnings
 
 
-def resolve_conflicts(events: list[RecommendationEvent]) -> list[RecommendationEvent]:
+def _resolve_with_reasons(events: list[RecommendationEvent]) -> tuple[list[RecommendationEvent], list[tuple[RecommendationEvent, str]]]:
     # Sort by priority desc, severity desc
     events.sort(key=lambda e: (e.priority, e.severity), reverse=True)
-    # Apply per-rule max_per_day first (if any)
-    per_rule: dict[str, int] = {}
-    tmp: list[RecommendationEvent] = []
-    for e in events:
-        per_rule[e.rule_id] = per_rule.get(e.rule_id, 0)
-        tmp.append(e)
 
     # Deduplicate per category/day if configured
     max_per_category = settings.max_recs_per_category_per_day
     out: list[RecommendationEvent] = []
+    discarded: list[tuple[RecommendationEvent, str]] = []
     per_category: dict[str | None, int] = {}
-    for e in tmp:
+    for e in events:
         if max_per_category > 0:
             if per_category.get(e.category, 0) >= max_per_category:
+                discarded.append((e, "category_cap"))
                 continue
         out.append(e)
         per_category[e.category] = per_category.get(e.category, 0) + 1
     # Global cap
     if settings.max_recs_per_day > 0:
+        discarded.extend((e, "daily_cap") for e in out[settings.max_recs_per_day :])
         out = out[: settings.max_recs_per_day]
-    return out
+    return out, discarded
+
+
+def resolve_conflicts(events: list[RecommendationEvent]) -> list[RecommendationEvent]:
+    return _resolve_with_reasons(events)[0]
+
+
+def _cooldown_blocked(rule: Any, user_id: str, day: date, history: FireHistory) -> bool:
+    if not rule.cooldown_days or rule.cooldown_days <= 0:
+        return False
+    return history.fired_since(user_id, rule.id, day - timedelta(days=rule.cooldown_days))
 
 
 def enforce_cooldowns(user_id: str, day: date, events: list[RecommendationEvent]) -> list[RecommendationEvent]:
-    # Read audits for prior fires
-    kept: list[RecommendationEvent] = []
+    # Último disparo por regla desde rule_fire_state (una consulta para todas las reglas del usuario)
+    if not events:
+        return []
     with get_session() as session:
-        for e in events:
-            rule = session.get(Rule, e.rule_id)
-            if not rule:
-                continue
-            if rule.cooldown_days and rule.cooldown_days > 0:
-                since = day - timedelta(days=rule.cooldown_days)
-                q = (
-                    session.query(Audit)
-                    .filter(
-                        Audit.user_id == user_id,
-                        Audit.rule_id == rule.id,
-                        Audit.fired == True,
-                        Audit.date >= since,
-                    )
-                )
-                if session.query(q.exists()).scalar():
-                    continue
-            kept.append(e)
+        rules = {r.id: r for r in session.scalars(select(Rule).where(Rule.id.in_({e.rule_id for e in events})))}
+    history = FireHistory.load(events[0].tenant_id, [user_id], list(rules))
+    kept: list[RecommendationEvent] = []
+    for e in events:
+        rule = rules.get(e.rule_id)
+        if not rule:
+            continue
+        if _cooldown_blocked(rule, user_id, day, history):
+            continue
+        kept.append(e)
     return kept
 
 
-def evaluate_user(user_id: str, target_day: date, tenant_id: str = "default", debug: bool = False) -> list[RecommendationEvent]:
-    df = load_base_dataframe()
-    feats = build_features(df, target_day, user_id)
-    rules = get_enabled_rules(tenant_id)
+def _jsonable(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {k: _jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_jsonable(v) for v in obj]
+    if isinstance(obj, np_bool):
+        return bool(obj)
+    if isinstance(obj, np_integer):
+        try:
+            return int(obj)
+        except Exception:
+            return None
+    if isinstance(obj, np_floating):
+        try:
+            v = float(obj)
+            return v if math.isfinite(v) else None
+        except Exception:
+            return None
+    return obj
 
+
+@dataclass
+class UserEvaluation:
+    user_id: str
+    events: list[RecommendationEvent]
+    rules: list[dict[str, Any]]
+    # Filas para `bulk_insert_audits` (columnas de `Audit` + `feature_snapshot`)
+    audits: list[dict[str, Any]]
+    # Features de la evaluación, una sola vez (no por regla)
+    values: dict[str, Any]
+
+
+def _evaluate_one(
+    rule_set: Any,
+    feats: Dict[str, Dict[str, Any]],
+    user_id: str,
+    target_day: date,
+    tenant_id: str,
+    history: FireHistory,
+    early_stop: bool = False,
+    data_version: str = "",
+    fired_mask: Mapping[str, bool] | None = None,
+    trace_unfired: bool = True,
+) -> UserEvaluation:
+    """Evalúa las reglas del snapshot para un usuario.
+
+    Con `early_stop` las reglas se recorren en orden de prioridad y, una vez
+    completo el presupuesto diario o el de su categoría, las siguientes no se
+    trazan ni se eligen mensajes para ellas. El cooldown se comprueba antes
+    que el presupuesto, como al evaluar todas las reglas. Los eventos
+    entregados son los mismos que evaluando todas las reglas, y cada regla
+    saltada deja una auditoría mínima (`discarded_reason="budget_exhausted"`,
+    sin `why` ni snapshot) con su resultado real (de `fired_mask` o del
+    predicado sin traza): auditorías, `fired_count` y `evaluated_count`
+    cuadran con una evaluación en debug.
+
+    `fired_mask` (`{rule_id: dispara}` de `evaluate_matrix`) evita trazar las
+    reglas que no disparan cuando `trace_unfired` es False (la política de
+    auditoría no guarda las no disparadas de este usuario): quedan con una
+    auditoría sin `why` ni snapshot. Con `trace_unfired` cada regla se traza
+    igualmente, porque su `why` se guarda.
+
+    El mensaje se elige y se renderiza solo para los eventos que sobreviven a
+    cooldowns y límites; el resto de auditorías quedan sin `message_id`.
+    """
     results: list[RecommendationEvent] = []
     per_rule_debug: list[dict[str, Any]] = []
+    debug_by_rule: dict[str, dict[str, Any]] = {}
+    evaluated: list[tuple[Any, bool, list[dict[str, Any]]]] = []
+    reasons: dict[str, str] = {}
+    values = _jsonable(feats)
+    daily_budget = settings.max_recs_per_day if early_stop else 0
+    category_budget = settings.max_recs_per_category_per_day if early_stop else 0
+    per_category: dict[str | None, int] = {}
 
-    def _jsonable(obj: Any) -> Any:
-        if isinstance(obj, dict):
-            return {k: _jsonable(v) for k, v in obj.items()}
-        if isinstance(obj, list):
-            return [_jsonable(v) for v in obj]
-        if isinstance(obj, np_bool):
-            return bool(obj)
-        if isinstance(obj, np_integer):
-            try:
-                return int(obj)
-            except Exception:
-                return None
-        if isinstance(obj, np_floating):
-            try:
-                v = float(obj)
-                return v if math.isfinite(v) else None
-            except Exception:
-                return None
-        return obj
-
-    for r in rules:
-        # Parse logic via DSL model for safety
-        try:
-            model = RuleModel(
-                id=r.id,
-                version=r.version,
-                enabled=r.enabled,
-                tenant_id=r.tenant_id,
-                category=r.category or "",
-                priority=r.priority,
-                severity=r.severity,
-                cooldown_days=r.cooldown_days,
-                max_per_day=r.max_per_day,
-                tags=r.tags or [],
-                logic=r.logic,
-                messages={
-                    "locale": r.locale,
-                    "candidates": [
-                        {"id": str(m.id), "text": m.text, "weight": m.weight}
-                        for m in r.messages
-                        if m.active
-                    ],
-                },
-            )
-        except Exception as e:
-            if debug:
-                per_rule_debug.append({
-                    "rule_id": r.id,
-                    "fired": False,
-                    "priority": r.priority,
-                    "severity": r.severity,
-                    "why": [{"parse_error": str(e)}],
-                })
+    for r in rule_set.rules:
+        c = r.compiled
+        if not c.ok:
+            per_rule_debug.append({
+                "rule_id": r.id,
+                "fired": False,
+                "priority": r.priority,
+                "severity": r.severity,
+                "why": [{"parse_error": c.error}],
+            })
             # Skip invalid rule
             continue
 
+        # Cooldown activo: ni predicado ni mensaje, solo la auditoría de descarte
+        if _cooldown_blocked(r, user_id, target_day, history):
+            reasons[r.id] = "cooldown"
+            per_rule_debug.append({
+                "rule_id": r.id,
+                "fired": False,
+                "discarded_reason": "cooldown",
+                "priority": r.priority,
+                "severity": r.severity,
+                "why": [],
+            })
+            evaluated.append((r, False, []))
+            continue
+
+        # Presupuesto cubierto: el evento no se entregaría; se guarda si la regla casa, sin traza
+        if (daily_budget > 0 and len(results) >= daily_budget) or (
+            category_budget > 0 and per_category.get(r.category, 0) >= category_budget
+        ):
+            reasons[r.id] = BUDGET_EXHAUSTED
+            matched = fired_mask.get(r.id) if fired_mask is not None else None
+            if matched is None:
+                matched = c.evaluate(feats, [])
+            evaluated.append((r, bool(matched), None))
+            continue
+
+        if not trace_unfired and fired_mask is not None and fired_mask.get(r.id) is False:
+            evaluated.append((r, False, None))
+            continue
+
         why: list[dict[str, Any]] = []
-        fired = eval_node(model.logic, feats, why)
-        msg_id, msg_text, warn = select_message_for_rule(r, feats, user_id, target_day)
-        per_rule_debug.append({
+        fired = c.evaluate(feats, why)
+        entry = {
             "rule_id": r.id,
             "fired": bool(fired),
             "priority": r.priority,
             "severity": r.severity,
-            "why": _jsonable(why + ([{"warnings": warn}] if warn else [])),
-            "values": _jsonable(feats),
-        })
+            "why": _jsonable(why),
+        }
+        per_rule_debug.append(entry)
+        debug_by_rule[r.id] = entry
+        evaluated.append((r, bool(fired), why))
         if fired:
+            per_category[r.category] = per_category.get(r.category, 0) + 1
             results.append(
                 RecommendationEvent(
                     date=target_day,
@@ -293,37 +453,158 @@ def evaluate_user(user_id: str, target_day: date, tenant_id: str = "default", de
                     category=r.category,
                     severity=r.severity,
                     priority=r.priority,
-                    message_id=msg_id,
-                    message_text=msg_text,
+                    message_id=None,
+                    message_text="",
                     locale=r.locale,
-                    why=why + ([{"warnings": warn}] if warn else []),
+                    why=list(why),
                 )
             )
 
-        # Always write audit (incluye values y why aunque no dispare)
-        with get_session() as session:
-            session.add(
-                Audit(
-                    tenant_id=tenant_id,
-                    user_id=user_id,
-                    date=target_day,
-                    rule_id=r.id,
-                    fired=fired,
-                    discarded_reason=None,
-                    why=_jsonable({"conditions": why}),
-                    values=_jsonable(feats),
-                    message_id=msg_id,
+    # Presupuestos por categoría y día
+    delivered, capped = _resolve_with_reasons(results)
+    for e, reason in capped:
+        reasons[e.rule_id] = reason
+
+    # Mensaje solo para los eventos entregados (como mucho `max_recs_per_day`)
+    rules_by_id = {r.id: r for r, _, _ in evaluated}
+    message_ids: dict[str, int | None] = {}
+    for e in delivered:
+        msg_id, msg_text, warn = select_message_for_rule(rules_by_id[e.rule_id], feats, user_id, target_day, history)
+        e.message_id, e.message_text = msg_id, msg_text
+        message_ids[e.rule_id] = msg_id
+        if warn:
+            e.why.append({"warnings": warn})
+            debug_by_rule[e.rule_id]["why"] = _jsonable(e.why)
+
+    # Una auditoría por regla (why aunque no dispare); las features van una vez en su snapshot.
+    # Las no trazadas (presupuesto o `fired_mask`, why None) no llevan ni why ni snapshot.
+    snapshot = {
+        "tenant_id": tenant_id,
+        "user_id": user_id,
+        "date": target_day,
+        "data_version": data_version,
+        "values": values,
+    }
+    audits: list[dict[str, Any]] = []
+    for r, fired, why in evaluated:
+        reason = reasons.get(r.id)
+        msg_id = message_ids.get(r.id)
+        audits.append(
+            {
+                "tenant_id": tenant_id,
+                "user_id": user_id,
+                "date": target_day,
+                "rule_id": r.id,
+                "fired": fired,
+                "discarded_reason": reason,
+                "why": None if why is None else _jsonable({"conditions": why}),
+                "feature_snapshot": None if why is None else snapshot,
+                "message_id": msg_id,
+            }
+        )
+        if fired and reason is None:
+            history.add(user_id, r.id, target_day, msg_id)
+
+    return UserEvaluation(user_id=user_id, events=delivered, rules=per_rule_debug, audits=audits, values=values)
+
+
+def _user_features(
+    df: Any, target_day: date, user_id: str, required: set[tuple[str, str]] | None, data_version: str
+) -> Dict[str, Dict[str, Any]]:
+    """Features de un usuario: del estado incremental si cubre `target_day`; si no, `build_features`."""
+    feats = dataset_feature_state.features(df, user_id, target_day, data_version, required)
+    if feats is None:
+        return build_features(df, target_day, user_id, required=required)
+    return feats
+
+
+def _evaluate_batch(
+    user_ids: Iterable[str],
+    target_day: date,
+    tenant_id: str,
+    debug: bool,
+    audit_sink: Callable[[list[dict[str, Any]]], Any] | None = None,
+) -> list[UserEvaluation]:
+    users = list(dict.fromkeys(str(u) for u in user_ids))
+
+    # Snapshot inmutable de reglas activas con la lógica ya compilada
+    rule_set = rule_sets.get(tenant_id)
+
+    # Solo se calculan las features que usan las reglas; en debug, todas (se devuelven en `values`)
+    required = None if debug else set(rule_set.required)
+    # Del feature store solo esas variables y las filas hasta `target_day`
+    df = load_base_dataframe(**dataset_scope(required, target_day))
+    data_version = dataset_version()
+
+    # Cooldowns (rule_fire_state) y anti-repetición (audits) de todo el lote, una consulta por fuente
+    days = _anti_repeat_days()
+    history = FireHistory.load(
+        tenant_id,
+        users,
+        [r.id for r in rule_set.rules],
+        messages_since=target_day - timedelta(days=days) if days > 0 else None,
+    )
+
+    # En debug se evalúan todas las reglas para devolver su traza
+    early_stop = settings.engine_early_termination and not debug
+
+    out: list[UserEvaluation] = []
+    if debug or len(users) == 1:
+        for uid in users:
+            feats = _user_features(df, target_day, uid, required, data_version)
+            out.append(_evaluate_one(rule_set, feats, uid, target_day, tenant_id, history, early_stop, data_version))
+    else:
+        # Lote: features y máscara usuarios × reglas de todos los usuarios en una pasada.
+        # Solo se trazan las reglas que disparan y, si la política de auditoría guarda las
+        # no disparadas del usuario (`full`, muestreo), también esas, porque su `why` se guarda.
+        matrix = build_features_all(df, target_day, user_ids=users, required=required)
+        fired = evaluate_matrix(matrix, [r.compiled for r in rule_set.rules if r.compiled.ok])
+        rule_ids = list(fired.columns)
+        masks = fired.to_numpy()
+        row_of = {uid: i for i, uid in enumerate(fired.index)}
+        for uid in users:
+            feats = features_from_matrix(matrix, uid)
+            i = row_of.get(uid)
+            mask = dict(zip(rule_ids, masks[i].tolist())) if i is not None else None
+            out.append(
+                _evaluate_one(
+                    rule_set, feats, uid, target_day, tenant_id, history, early_stop, data_version,
+                    mask, keeps_unfired_audits(tenant_id, uid),
                 )
             )
-            session.commit()
 
-    # Cooldowns and budgets
-    # Cooldowns and budgets
-    results = enforce_cooldowns(user_id, target_day, results)
-    results = resolve_conflicts(results)
+    # Auditorías del lote: al hilo de escritura si está arrancado; si no, INSERT masivo directo
+    (audit_sink or audit_writer.submit)([a for ev in out for a in ev.audits])
+    return out
+
+
+def _debug_payload(ev: UserEvaluation) -> dict[str, Any]:
+    return {"values": ev.values, "rules": ev.rules}
+
 
+def evaluate_users(
+    user_ids: Iterable[str],
+    target_day: date,
+    tenant_id: str = "default",
+    debug: bool = False,
+    audit_sink: Callable[[list[dict[str, Any]]], Any] | None = None,
+) -> dict[str, Any]:
+    """Evalúa varios usuarios compartiendo dataset, reglas compiladas e histórico.
+
+    Devuelve `{user_id: eventos}` (o `{user_id: (eventos, debug)}` con
+    `debug=True`, donde debug es `{"values": features, "rules": traza por
+    regla}`), con el mismo resultado que llamar a `evaluate_user` por
+    usuario en el mismo orden. Las auditorías se entregan a `audit_writer`,
+    o a `audit_sink` (lista de filas para `bulk_insert_audits`) si se indica.
+    """
+    evaluations = _evaluate_batch(user_ids, target_day, tenant_id, debug, audit_sink)
     if debug:
-        return results, per_rule_debug
-    return results
+        return {ev.user_id: (ev.events, _debug_payload(ev)) for ev in evaluations}
+    return {ev.user_id: ev.events for ev in evaluations}
 
 
+def evaluate_user(user_id: str, target_day: date, tenant_id: str = "default", debug: bool = False) -> list[RecommendationEvent]:
+    ev = _evaluate_batch([user_id], target_day, tenant_id, debug)[0]
+    if debug:
+        return ev.events, _debug_payload(ev)
+    return ev.events
@@ -0,0 +1,224 @@
+"""Cubo usuarios × días × variables en disco, leído con memory-map.
+
+Pensado para backtests y simulaciones por rango: varios procesos pueden
+abrir el mismo directorio y compartir las páginas del fichero en lugar de
+mantener cada uno un DataFrame de pandas.
+
+Contenido del directorio:
+- values.npy     (usuarios, días, variables), NaN donde no hay dato
+- present.npy    (usuarios, días), True si el usuario tiene fila en esa posición
+- rank.npy       (usuarios, días), nº de filas del usuario hasta esa posición incluida
+- users.json / dates.json / variables.json  posiciones de cada eje
+
+El eje de días tiene tantas posiciones por fecha como filas tenga el usuario
+con más filas ese día (normalmente una): las filas repetidas de un mismo
+(user_id, date) ocupan posiciones consecutivas en el orden de
+`build_features`, que las cuenta como filas distintas. `dates.json` guarda la
+fecha de cada posición.
+
+Las ventanas de `build_features` cuentan filas, no días de calendario; con
+`rank` la ventana de las últimas N filas es un slice contiguo del eje de
+días filtrado por `present`. Los agregados salen de `window_aggregates`, igual
+que en `build_features_all`. Solo hay variables numéricas (y la derivada
+`max_hr_pct_user_max`); las de texto no tienen sitio en el cubo.
+"""
+from __future__ import annotations
+
+import json
+import os
+from datetime import date
+from typing import Any, Iterable
+
+import numpy as np
+import pandas as pd
+
+from backend.rules_engine.features import (
+    MAX_WINDOW,
+    NON_NUMERIC_COLUMNS,
+    WINDOW_AGGREGATORS,
+    _sort_by_user_date,
+    column_as_float,
+    window_aggregates,
+)
+
+
+VALUES_FILE = "values.npy"
+PRESENT_FILE = "present.npy"
+RANK_FILE = "rank.npy"
+USERS_FILE = "users.json"
+DATES_FILE = "dates.json"
+VARIABLES_FILE = "variables.json"
+
+
+def _numeric_columns(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    out: dict[str, np.ndarray] = {}
+    for key in df.columns:
+        if key in NON_NUMERIC_COLUMNS:
+            continue
+        try:
+            out[key] = column_as_float(df, key).to_numpy()
+        except (ValueError, TypeError):
+            continue
+    return out
+
+
+def write_feature_cube(df: pd.DataFrame, out_dir: str, dtype: str = "float64") -> None:
+    """Materializa el dataset diario como cubo denso en `out_dir`.
+
+    Las filas repetidas de un (user_id, date) se conservan todas, en
+    posiciones consecutivas del eje de días.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    base = _sort_by_user_date(df.dropna(subset=["date", "user_id"]))
+
+    users = pd.Index(pd.unique(base["user_id"].astype(str)))
+    day = pd.to_datetime(base["date"]).dt.normalize()
+    days = pd.DatetimeIndex(sorted(day.unique()))
+    # Posiciones por fecha: el máximo de filas de un usuario ese día
+    dup = base.groupby([base["user_id"].astype(str), day], sort=False).cumcount().to_numpy()
+    d_idx = days.get_indexer(day)
+    per_day = np.zeros(len(days), dtype=np.int64)
+    np.maximum.at(per_day, d_idx, dup + 1)
+    offsets = np.concatenate(([0], np.cumsum(per_day)[:-1])).astype(np.int64)
+    slots = offsets[d_idx] + dup
+    n_slots = int(per_day.sum())
+
+    numeric = _numeric_columns(base)
+    variables = list(numeric)
+    u_idx = users.get_indexer(base["user_id"].astype(str))
+
+    values = np.lib.format.open_memmap(
+        os.path.join(out_dir, VALUES_FILE), mode="w+", dtype=dtype, shape=(len(users), n_slots, len(variables))
+    )
+    values[...] = np.nan
+    for v, key in enumerate(variables):
+        values[u_idx, slots, v] = numeric[key]
+    values.flush()
+    del values
+
+    present = np.zeros((len(users), n_slots), dtype=bool)
+    present[u_idx, slots] = True
+    np.save(os.path.join(out_dir, PRESENT_FILE), present)
+    np.save(os.path.join(out_dir, RANK_FILE), np.cumsum(present, axis=1, dtype=np.int32))
+
+    with open(os.path.join(out_dir, USERS_FILE), "w", encoding="utf-8") as f:
+        json.dump(list(users), f)
+    with open(os.path.join(out_dir, DATES_FILE), "w", encoding="utf-8") as f:
+        json.dump([d.date().isoformat() for d in np.repeat(days, per_day)], f)
+    with open(os.path.join(out_dir, VARIABLES_FILE), "w", encoding="utf-8") as f:
+        json.dump(variables, f)
+
+
+class FeatureCube:
+    """Vista de solo lectura sobre un cubo escrito por `write_feature_cube`."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.values = np.load(os.path.join(path, VALUES_FILE), mmap_mode="r")
+        self.present = np.load(os.path.join(path, PRESENT_FILE), mmap_mode="r")
+        self.rank = np.load(os.path.join(path, RANK_FILE), mmap_mode="r")
+        with open(os.path.join(path, USERS_FILE), "r", encoding="utf-8") as f:
+            self.users: list[str] = json.load(f)
+        with open(os.path.join(path, DATES_FILE), "r", encoding="utf-8") as f:
+            self.dates = pd.DatetimeIndex(pd.to_datetime(json.load(f)))
+        with open(os.path.join(path, VARIABLES_FILE), "r", encoding="utf-8") as f:
+            self.variables: list[str] = json.load(f)
+        self._user_pos = {u: i for i, u in enumerate(self.users)}
+        self._var_pos = {v: i for i, v in enumerate(self.variables)}
+        self._has_max_hr = {"max_heart_rate_bpm", "user_max_heart_rate_bpm"} <= set(self.variables)
+
+    @classmethod
+    def open(cls, path: str) -> "FeatureCube":
+        return cls(path)
+
+    def user_position(self, user_id: str) -> int | None:
+        return self._user_pos.get(str(user_id))
+
+    def variable_position(self, var: str) -> int | None:
+        return self._var_pos.get(var)
+
+    def day_position(self, target_date: date) -> int:
+        """Último índice del eje de días <= target_date (-1 si es anterior al cubo)."""
+        pos = int(self.dates.searchsorted(pd.Timestamp(target_date), side="right")) - 1
+        return min(pos, len(self.dates) - 1)
+
+    def window_slice(self, user_id: str, target_date: date, rows: int) -> tuple[int, int]:
+        """Slice [start, stop) del eje de días que contiene las últimas `rows` filas del usuario."""
+        u = self.user_position(user_id)
+        t = self.day_position(target_date)
+        if u is None or t < 0:
+            return 0, 0
+        rank_row = self.rank[u, : t + 1]
+        last = int(rank_row[-1])
+        start = int(np.searchsorted(rank_row, last - rows, side="right"))
+        return start, t + 1
+
+    def user_window(self, user_id: str, target_date: date, rows: int) -> np.ndarray:
+        """Valores (filas, variables) de las últimas `rows` filas del usuario hasta target_date."""
+        start, stop = self.window_slice(user_id, target_date, rows)
+        u = self.user_position(user_id)
+        if u is None or start == stop:
+            return np.empty((0, len(self.variables)))
+        mask = np.asarray(self.present[u, start:stop])
+        return np.asarray(self.values[u, start:stop])[mask]
+
+    def aggregate(
+        self,
+        target_date: date,
+        user_ids: Iterable[str] | None = None,
+        chunk_size: int = 2048,
+    ) -> pd.DataFrame:
+        """Matriz usuarios × (var, agg) como `build_features_all`, solo variables numéricas y derivadas."""
+        t = self.day_position(target_date)
+        if user_ids is None:
+            positions = np.arange(len(self.users))
+        else:
+            positions = np.array([p for p in (self.user_position(u) for u in user_ids) if p is not None], dtype=int)
+
+        pairs = [(v, a) for v in self.variables for a in ["current", *WINDOW_AGGREGATORS]]
+        if self._has_max_hr:
+            pairs.append(("max_hr_pct_user_max", "current"))
+        columns = pd.MultiIndex.from_tuples(pairs, names=["var", "agg"])
+        if t < 0 or len(positions) == 0:
+            return pd.DataFrame(index=pd.Index([], name="user_id"), columns=columns, dtype=float)
+
+        rank_t = np.asarray(self.rank[positions, t])
+        positions = positions[rank_t > 0]
+
+        frames: list[pd.DataFrame] = []
+        for i in range(0, len(positions), max(1, int(chunk_size))):
+            frames.append(self._aggregate_chunk(positions[i : i + chunk_size], t, columns))
+        if not frames:
+            return pd.DataFrame(index=pd.Index([], name="user_id"), columns=columns, dtype=float)
+        return pd.concat(frames)
+
+    def _aggregate_chunk(self, positions: np.ndarray, t: int, columns: pd.MultiIndex) -> pd.DataFrame:
+        rank_t = np.asarray(self.rank[positions, t])
+        start = min(
+            int(np.searchsorted(np.asarray(self.rank[p, : t + 1]), r - MAX_WINDOW, side="right"))
+            for p, r in zip(positions, rank_t)
+        )
+        vals = np.asarray(self.values[positions, start : t + 1, :], dtype=float)
+        present = np.asarray(self.present[positions, start : t + 1])
+        rank = np.asarray(self.rank[positions, start : t + 1])
+
+        # Últimas MAX_WINDOW filas de cada usuario alineadas a la derecha, como en `build_features_all`
+        back = rank_t[:, None] - rank
+        rows, cols = np.nonzero(present & (back < MAX_WINDOW))
+        slots = MAX_WINDOW - 1 - back[rows, cols]
+        counts = np.minimum(rank_t, MAX_WINDOW)
+        current = vals[np.arange(len(positions)), np.argmax(present & (back == 0), axis=1), :]
+
+        blocks: list[np.ndarray] = []
+        for v in range(len(self.variables)):
+            window = np.zeros((len(positions), MAX_WINDOW))
+            window[rows, slots] = vals[rows, cols, v]
+            aggs = window_aggregates(window, counts)
+            blocks.extend([current[:, v], *(aggs[a] for a in WINDOW_AGGREGATORS)])
+        if self._has_max_hr:
+            max_hr = current[:, self._var_pos["max_heart_rate_bpm"]]
+            user_max = current[:, self._var_pos["user_max_heart_rate_bpm"]]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                blocks.append(max_hr / np.where(user_max != 0, user_max, np.nan))
+        index = pd.Index([self.users[p] for p in positions], name="user_id")
+        return pd.DataFrame(np.column_stack(blocks), index=index, columns=columns)
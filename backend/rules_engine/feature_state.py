@@ -0,0 +1,395 @@
+"""Estado incremental de features por usuario.
+
+Guarda, por usuario, las últimas `MAX_WINDOW` filas diarias (la ventana más
+larga es `zscore_28d`) como arrays de NumPy: una matriz float con las
+columnas numéricas y otra de objetos con las de texto, solo para las
+columnas pedidas. Añadir o reemplazar un día cuesta O(ventana) y los
+agregadores se calculan al leer, solo los pedidos, con `window_aggregates`
+igual que `build_features`, sin volver a recorrer el histórico.
+
+`dataset_feature_state` es el estado del dataset cacheado que usa el motor
+en las evaluaciones de un solo usuario (`/simulate`). Cada usuario se siembra
+con sus últimas filas la primera vez; cuando cambian los datos, sus filas
+nuevas o modificadas se aplican con `upsert` en lugar de volver a sembrarlo.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, Iterable, Mapping
+
+import numpy as np
+import pandas as pd
+
+from backend.config import settings
+from backend.rules_engine.features import (
+    MAX_WINDOW,
+    NON_NUMERIC_COLUMNS,
+    WINDOW_AGGREGATORS,
+    _restore_scalar,
+    _sort_by_user_date,
+    column_as_float,
+    dataset_cache,
+    expand_required,
+    tail_window,
+    user_rows,
+    window_aggregates,
+)
+
+
+_NO_SOURCE = pd.DataFrame()
+_MAX_HR = ("max_hr_pct_user_max", "current")
+
+
+def _to_float(value: Any) -> float:
+    if value is None or value is pd.NA:
+        return float("nan")
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return float("nan")
+
+
+def _features(
+    numeric_columns: list[str],
+    numeric: np.ndarray,
+    other_columns: list[str],
+    other_last: Any,
+    required: set[tuple[str, str]] | None,
+) -> Dict[str, Dict[str, Any]]:
+    """Features de `build_features` a partir de las últimas filas (n, columnas) de un usuario."""
+    features: Dict[str, Dict[str, Any]] = {}
+
+    def add(key: str, agg: str, value: Any) -> None:
+        features.setdefault(key, {})[agg] = None if pd.isna(value) else value
+
+    def wants(key: str, agg: str) -> bool:
+        return required is None or (key, agg) in required
+
+    if len(numeric) == 0:
+        return features
+    for i, key in enumerate(other_columns):
+        if wants(key, "current"):
+            add(key, "current", other_last[i])
+    for i, key in enumerate(numeric_columns):
+        if wants(key, "current"):
+            add(key, "current", float(numeric[-1, i]))
+        aggs = [agg for agg in WINDOW_AGGREGATORS if wants(key, agg)]
+        if aggs:
+            window, counts = tail_window(numeric[:, i])
+            for agg, values in window_aggregates(window, counts, aggs).items():
+                if agg in aggs:
+                    add(key, agg, float(values[0]))
+
+    if wants(*_MAX_HR):
+        max_hr = features.get("max_heart_rate_bpm", {}).get("current")
+        user_max_hr = features.get("user_max_heart_rate_bpm", {}).get("current")
+        if max_hr is not None and user_max_hr not in (None, 0):
+            add(*_MAX_HR, max_hr / user_max_hr)
+    return features
+
+
+def window_features(rows: list[Mapping[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Features de `build_features` a partir de las últimas filas de un usuario (orden ascendente)."""
+    if not rows:
+        return {}
+    keys: dict[str, None] = {}
+    for row in rows:
+        keys.update(dict.fromkeys(row))
+    keys.pop("date", None)
+    keys.pop("user_id", None)
+
+    numeric_columns: list[str] = []
+    other_columns: list[str] = []
+    columns: list[np.ndarray] = []
+    for key in keys:
+        if key not in NON_NUMERIC_COLUMNS:
+            try:
+                columns.append(np.array([np.nan if pd.isna(r.get(key)) else float(r.get(key)) for r in rows]))
+                numeric_columns.append(key)
+                continue
+            except (ValueError, TypeError):
+                pass
+        other_columns.append(key)
+    numeric = np.column_stack(columns) if columns else np.empty((len(rows), 0))
+    other_last = [rows[-1].get(key) for key in other_columns]
+    return _features(numeric_columns, numeric, other_columns, other_last, None)
+
+
+class _UserBuffer:
+    __slots__ = ("dates", "numeric", "other", "version")
+
+    def __init__(self, dates: np.ndarray, numeric: np.ndarray, other: np.ndarray, version: str | None = None) -> None:
+        self.dates = dates
+        self.numeric = numeric
+        self.other = other
+        self.version = version
+
+
+class FeatureStateStore:
+    """Buffers por usuario para recalcular features al llegar un nuevo día.
+
+    `features(user_id)` equivale a `build_features(df, last_date, user_id)`
+    siendo `last_date` el día más reciente recibido para ese usuario. Sin
+    `numeric_columns`/`other_columns`, las columnas salen del primer
+    DataFrame sembrado. Con `max_users` se descartan los usuarios menos
+    usados recientemente.
+    """
+
+    def __init__(
+        self,
+        numeric_columns: Iterable[str] | None = None,
+        other_columns: Iterable[str] = (),
+        window: int = MAX_WINDOW,
+        max_users: int | None = None,
+    ) -> None:
+        self.window = max(MAX_WINDOW, int(window))
+        self.max_users = max_users
+        self.numeric_columns: list[str] | None = None if numeric_columns is None else list(numeric_columns)
+        self.other_columns: list[str] = list(other_columns)
+        self._users: OrderedDict[str, _UserBuffer] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, user_id: object) -> bool:
+        return str(user_id) in self._users
+
+    @staticmethod
+    def split_columns(df: pd.DataFrame, columns: Iterable[str] | None = None) -> tuple[list[str], list[str]]:
+        """(numéricas, texto) de `df` según su dtype, como las trata `build_features`."""
+        keys = [c for c in (df.columns if columns is None else columns) if c in df.columns and c not in {"user_id", "date"}]
+        numeric, other = [], []
+        for key in keys:
+            dtype = df[key].dtype
+            if key not in NON_NUMERIC_COLUMNS and (pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)):
+                numeric.append(key)
+            else:
+                other.append(key)
+        return numeric, other
+
+    def add_columns(self, numeric_columns: Iterable[str], other_columns: Iterable[str] = ()) -> None:
+        """Amplía las columnas guardadas; los buffers existentes quedan pendientes de `refresh`."""
+        with self._lock:
+            new_numeric = [c for c in numeric_columns if c not in (self.numeric_columns or [])]
+            new_other = [c for c in other_columns if c not in self.other_columns]
+            if not new_numeric and not new_other:
+                return
+            self.numeric_columns = [*(self.numeric_columns or []), *new_numeric]
+            self.other_columns = [*self.other_columns, *new_other]
+            for buf in self._users.values():
+                n = len(buf.dates)
+                buf.numeric = np.hstack([buf.numeric, np.full((n, len(new_numeric)), np.nan)])
+                buf.other = np.hstack([buf.other, np.full((n, len(new_other)), None, dtype=object)])
+                buf.version = None
+
+    def _arrays(self, rows: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(fechas, numéricas, texto) de las filas de un usuario ordenadas por fecha."""
+        dates = rows["date"].to_numpy(dtype="datetime64[ns]")
+        numeric = np.empty((len(rows), len(self.numeric_columns or [])))
+        for i, key in enumerate(self.numeric_columns or []):
+            numeric[:, i] = column_as_float(rows, key).to_numpy() if key in rows.columns else np.nan
+        other = np.full((len(rows), len(self.other_columns)), None, dtype=object)
+        for i, key in enumerate(self.other_columns):
+            if key in rows.columns:
+                other[:, i] = [_restore_scalar(rows, key, v) for v in rows[key].to_numpy(dtype=object)]
+        return dates, numeric, other
+
+    def _put(self, user_id: str, buf: _UserBuffer) -> None:
+        # Con el lock tomado
+        self._users[user_id] = buf
+        self._users.move_to_end(user_id)
+        if self.max_users is not None:
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def seed_user(self, user_id: str, rows: pd.DataFrame, version: str | None = None) -> None:
+        """Siembra un usuario con sus filas (ordenadas por fecha); solo se guardan las últimas."""
+        if self.numeric_columns is None:
+            self.numeric_columns, self.other_columns = self.split_columns(rows)
+        tail = rows.dropna(subset=["date"]).tail(self.window)
+        buf = _UserBuffer(*self._arrays(tail), version=version)
+        with self._lock:
+            self._put(str(user_id), buf)
+
+    def seed_from_dataframe(self, df: pd.DataFrame, user_ids: Iterable[str] | None = None) -> int:
+        """Inicializa los buffers con las últimas filas de cada usuario de `df`."""
+        if df.empty:
+            return 0
+        base = df if user_ids is None else df[df["user_id"].isin([str(u) for u in user_ids])]
+        base = _sort_by_user_date(base.dropna(subset=["date"]))
+        tail = base.groupby("user_id", sort=False, observed=True).tail(self.window)
+        seeded = 0
+        for uid, group in tail.groupby("user_id", sort=False, observed=True):
+            self.seed_user(str(uid), group)
+            seeded += 1
+        return seeded
+
+    def upsert(self, user_id: str, day: date, row: Mapping[str, Any], source: pd.DataFrame | None = None) -> None:
+        """Añade el día `day` o reemplaza la fila si ya existe.
+
+        `source` es el DataFrame del que sale la fila: si está compactado
+        (`compact_dataframe`), los valores vuelven a float como en
+        `build_features`. Días más antiguos que todo el buffer lleno se
+        ignoran: no afectan a ninguna ventana.
+        """
+        frame = source if source is not None else _NO_SOURCE
+        if self.numeric_columns is None:
+            self.numeric_columns = [k for k in row if k not in {"user_id", "date"} | NON_NUMERIC_COLUMNS]
+            self.other_columns = [k for k in row if k in NON_NUMERIC_COLUMNS - {"user_id", "date"}]
+        ts = np.datetime64(pd.Timestamp(day), "ns")
+        numeric = np.array([_to_float(_restore_scalar(frame, k, row.get(k))) for k in self.numeric_columns])
+        other = np.array([_restore_scalar(frame, k, row.get(k)) for k in self.other_columns] + [None], dtype=object)[:-1]
+        uid = str(user_id)
+        with self._lock:
+            buf = self._users.get(uid)
+            if buf is None:
+                buf = _UserBuffer(
+                    np.array([], dtype="datetime64[ns]"),
+                    np.empty((0, len(self.numeric_columns))),
+                    np.empty((0, len(self.other_columns)), dtype=object),
+                )
+            pos = int(np.searchsorted(buf.dates, ts))
+            if pos < len(buf.dates) and buf.dates[pos] == ts:
+                buf.numeric = buf.numeric.copy()
+                buf.other = buf.other.copy()
+                buf.numeric[pos] = numeric
+                buf.other[pos] = other
+            elif pos == 0 and len(buf.dates) >= self.window:
+                return
+            else:
+                drop = 1 if len(buf.dates) >= self.window else 0
+                buf.dates = np.insert(buf.dates, pos, ts)[drop:]
+                buf.numeric = np.insert(buf.numeric, pos, numeric, axis=0)[drop:]
+                buf.other = np.insert(buf.other, pos, other, axis=0)[drop:]
+            self._put(uid, buf)
+
+    def refresh(self, user_id: str, rows: pd.DataFrame, version: str | None = None) -> int:
+        """Pone al día un usuario con sus filas actuales (ordenadas por fecha).
+
+        Compara las últimas filas con el buffer y aplica con `upsert` solo los
+        días nuevos o cambiados; si faltan días o hay fechas repetidas, vuelve
+        a sembrarlo. Devuelve el número de filas aplicadas.
+        """
+        uid = str(user_id)
+        tail = rows.dropna(subset=["date"]).tail(self.window)
+        with self._lock:
+            buf = self._users.get(uid)
+        dates, numeric, other = self._arrays(tail)
+        known = buf is not None and len(buf.dates) > 0 and len(dates) > 0
+        # Días del buffer que ya no están (o no caben en una ventana completa): resiembra
+        if (
+            not known
+            or len(np.unique(dates)) != len(dates)
+            or not np.isin(buf.dates[buf.dates >= dates[0]], dates).all()
+            or (len(dates) < self.window and (buf.dates < dates[0]).any())
+        ):
+            self.seed_user(uid, tail, version)
+            return len(dates)
+        applied = 0
+        for i, ts in enumerate(dates):
+            pos = int(np.searchsorted(buf.dates, ts))
+            if (
+                pos < len(buf.dates)
+                and buf.dates[pos] == ts
+                and np.array_equal(buf.numeric[pos], numeric[i], equal_nan=True)
+                and list(buf.other[pos]) == list(other[i])
+            ):
+                continue
+            row = dict(zip(self.numeric_columns or [], numeric[i]))
+            row.update(zip(self.other_columns, other[i]))
+            self.upsert(uid, pd.Timestamp(ts).date(), row)
+            with self._lock:
+                buf = self._users[uid]
+            applied += 1
+        buf.version = version
+        return applied
+
+    def version(self, user_id: str) -> str | None:
+        buf = self._users.get(str(user_id))
+        return None if buf is None else buf.version
+
+    def last_date(self, user_id: str) -> date | None:
+        buf = self._users.get(str(user_id))
+        if buf is None or not len(buf.dates):
+            return None
+        return pd.Timestamp(buf.dates[-1]).date()
+
+    def features(self, user_id: str, required: set[tuple[str, str]] | None = None) -> Dict[str, Dict[str, Any]]:
+        """Features a `last_date(user_id)`; con `required`, solo esos pares (var, agg)."""
+        with self._lock:
+            buf = self._users.get(str(user_id))
+            if buf is None:
+                return {}
+            self._users.move_to_end(str(user_id))
+            numeric, other = buf.numeric, buf.other
+            numeric_columns, other_columns = list(self.numeric_columns or []), list(self.other_columns)
+        if required is not None:
+            required = expand_required(required)
+        other_last = other[-1] if len(other) else []
+        return _features(numeric_columns, numeric, other_columns, other_last, required)
+
+
+class DatasetFeatureState:
+    """`FeatureStateStore` del dataset cacheado.
+
+    Guarda solo las columnas que han pedido las reglas y como mucho
+    `settings.feature_state_max_users` usuarios. Cuando cambia la
+    `data_version`, cada usuario se pone al día con `refresh` (sus últimas
+    filas, vía el índice por usuario) la próxima vez que se pide.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._store = self._new_store()
+
+    @staticmethod
+    def _new_store() -> FeatureStateStore:
+        return FeatureStateStore(numeric_columns=[], max_users=settings.feature_state_max_users)
+
+    def features(
+        self,
+        df: pd.DataFrame,
+        user_id: str,
+        target_day: date,
+        version: str,
+        required: set[tuple[str, str]] | None = None,
+    ) -> Dict[str, Dict[str, Any]] | None:
+        """`build_features(df, target_day, user_id, required)` desde el estado, o None si no lo cubre.
+
+        El estado guarda las últimas filas del usuario: solo sirve si ninguna
+        es posterior a `target_day` (la evaluación del último día con datos).
+        Con un DataFrame que no es el cacheado también devuelve None.
+        """
+        if dataset_cache.index_for(df) is None:
+            return None
+        with self._lock:
+            store = self._store
+        if required is None:
+            columns = None
+        else:
+            needed = {var for var, _ in expand_required(required)}
+            columns = [c for c in df.columns if c in needed]
+        store.add_columns(*store.split_columns(df, columns))
+
+        uid = str(user_id)
+        if uid not in store:
+            rows = user_rows(df, uid, pd.Timestamp.max.date())
+            if rows.empty:
+                return None
+            store.seed_user(uid, rows, version)
+        elif store.version(uid) != version:
+            store.refresh(uid, user_rows(df, uid, pd.Timestamp.max.date()), version)
+        last = store.last_date(uid)
+        if last is None or last > target_day:
+            return None
+        return store.features(uid, required)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._store = self._new_store()
+
+
+dataset_feature_state = DatasetFeatureState()
@@ -0,0 +1,132 @@
+"""Almacén columnar (Parquet) del dataset diario que consume el motor.
+
+`scripts/10_load_and_merge.py` lo escribe y `features.load_base_dataframe()`
+lo lee como fuente principal. Las filas se guardan ordenadas por
+(user_id, date) en row groups con estadísticas, de modo que los filtros por
+usuario y fecha descartan row groups completos sin leerlos, y la proyección
+de columnas solo descomprime las columnas pedidas.
+"""
+from __future__ import annotations
+
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Iterable
+
+import pandas as pd
+
+try:  # pyarrow es opcional: sin él, el backend sigue leyendo CSV
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depende del entorno
+    pa = None
+    pq = None
+
+
+FEATURE_STORE_FORMAT_VERSION = 1
+FEATURE_STORE_METADATA_KEY = b"eterna.feature_store"
+DEFAULT_ROW_GROUP_SIZE = 50_000
+
+
+def feature_store_path() -> str:
+    return os.getenv("FEATURE_STORE_PATH", os.path.join("output", "daily_merged.parquet"))
+
+
+def feature_store_available() -> bool:
+    return pq is not None
+
+
+def _require_pyarrow() -> None:
+    if pq is None:
+        raise RuntimeError("Feature store no disponible: instalar pyarrow")
+
+
+def write_feature_store(df: pd.DataFrame, path: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> None:
+    """Escribe el dataset diario ordenado por (user_id, date).
+
+    La escritura es atómica (fichero temporal + `os.replace`) para que un
+    backend que esté leyendo nunca vea un Parquet a medias.
+    """
+    _require_pyarrow()
+    out = df.copy()
+    out["user_id"] = out["user_id"].astype(str)
+    out["date"] = pd.to_datetime(out["date"], errors="coerce").dt.date
+    out = out.sort_values(["user_id", "date"], kind="stable", na_position="last").reset_index(drop=True)
+
+    table = pa.Table.from_pandas(out, preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[FEATURE_STORE_METADATA_KEY] = json.dumps(
+        {"version": FEATURE_STORE_FORMAT_VERSION, "sorted_by": ["user_id", "date"]}
+    ).encode("utf-8")
+    table = table.replace_schema_metadata(meta)
+
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(
+        table,
+        tmp_path,
+        row_group_size=max(1, int(row_group_size)),
+        compression="zstd",
+        write_statistics=True,
+    )
+    os.replace(tmp_path, path)
+
+
+def _store_metadata(schema: Any) -> dict[str, Any]:
+    raw = (schema.metadata or {}).get(FEATURE_STORE_METADATA_KEY)
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw.decode("utf-8"))
+    except Exception:  # noqa: BLE001
+        return {}
+
+
+def _date_filter_value(field_type: Any, value: date) -> Any:
+    if pa.types.is_timestamp(field_type):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def read_feature_store(
+    path: str | None = None,
+    columns: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    start: date | None = None,
+    end: date | None = None,
+) -> pd.DataFrame:
+    """Lee el feature store con proyección de columnas y filtros por usuario/fecha.
+
+    `user_id` y `date` se incluyen siempre. Las columnas pedidas que no existan
+    en el fichero se ignoran. El resultado tiene `date` como datetime64 y
+    `user_id` como str, igual que la ruta CSV.
+    """
+    _require_pyarrow()
+    path = path or feature_store_path()
+    schema = pq.read_schema(path)
+    names = set(schema.names)
+
+    cols: list[str] | None = None
+    if columns is not None:
+        cols = [c for c in dict.fromkeys(["user_id", "date", *columns]) if c in names]
+
+    filters: list[tuple[str, str, Any]] = []
+    if user_ids is not None:
+        filters.append(("user_id", "in", [str(u) for u in user_ids]))
+    if start is not None:
+        filters.append(("date", ">=", _date_filter_value(schema.field("date").type, start)))
+    if end is not None:
+        filters.append(("date", "<=", _date_filter_value(schema.field("date").type, end)))
+
+    table = pq.read_table(path, columns=cols, filters=filters or None)
+    df = table.to_pandas()
+    if "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    if "user_id" in df.columns:
+        df["user_id"] = df["user_id"].astype(str)
+    if _store_metadata(schema).get("sorted_by") != ["user_id", "date"]:
+        # Parquet escrito por otra herramienta: garantizar el orden que espera el motor
+        df = df.sort_values(["user_id", "date"]).reset_index(drop=True)
+    return df
@@ -1,14 +1,22 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import date
-from typing import Any, Dict
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable
 
+import hashlib
 import os
+import threading
+import time
+import warnings
 
 import numpy as np
 import pandas as pd
 
+from backend.config import settings
+from backend.rules_engine.feature_store import feature_store_available, feature_store_path, read_feature_store
+from src.data.ingest import SCHEMAS, read_csv_typed
+
 
 @dataclass
 class FeatureComputationContext:
@@ -16,16 +24,398 @@ class FeatureComputationContext:
     target_date: date
 
 
-def load_base_dataframe() -> pd.DataFrame:
+# Columnas crudas que se leen de cada CSV original (antes de renombrar)
+_DAILY_RAW_COLUMNS = [
+    "patient_id", "date", "steps", "low_intensity_minutes", "moderate_intensity_minutes",
+    "vigorous_intensity_minutes", "heart_rate_average_bpm", "max_heart_rate_bpm", "min_heart_rate_bpm",
+    "resting_heart_rate_bpm", "user_max_heart_rate_bpm", "heart_rate_variability_sdnn",
+]
+_SLEEP_RAW_COLUMNS = [
+    "patient_id", "calculation_date", "rem_sleep_minutes", "asleep_state_minutes", "deep_sleep_state_minutes",
+    "light_sleep_state_minutes", "awake_state_minutes", "avg_breaths_per_min", "heart_rate_variability_sdnn",
+    "resting_heart_rate_bpm", "max_heart_rate_bpm", "min_heart_rate_bpm", "user_max_heart_rate_bpm",
+]
+
+
+def _processed_csv_path() -> str:
+    return os.path.join("data", "daily_processed.csv")
+
+
+def _dataset_source_paths() -> list[str]:
+    """Ficheros de los que depende el DataFrame base (en el orden en que se consultan)."""
+    store_path = feature_store_path()
+    if feature_store_available() and os.path.exists(store_path):
+        return [store_path]
+    processed_path = _processed_csv_path()
+    if os.path.exists(processed_path):
+        return [processed_path]
+    return [
+        os.getenv("DAILY_CSV_PATH", os.path.join("data", "patient_daily_data.csv")),
+        os.getenv("SLEEP_CSV_PATH", os.path.join("data", "patient_sleep_data.csv")),
+    ]
+
+
+def _file_signature(path: str) -> tuple[str, int | None, int | None]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (os.path.abspath(path), None, None)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def _sort_by_user_date(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty or not {"user_id", "date"}.issubset(df.columns):
+        return df
+    if pd.MultiIndex.from_frame(df[["user_id", "date"]]).is_monotonic_increasing:
+        return df
+    return df.sort_values(["user_id", "date"], kind="stable").reset_index(drop=True)
+
+
+class UserRowIndex:
+    """Índice user_id -> rango contiguo de filas de un DataFrame ordenado por (user_id, date).
+
+    Se construye una vez por carga del dataset; cada consulta cuesta una
+    búsqueda binaria sobre las fechas del usuario en lugar de un filtro
+    booleano sobre toda la tabla.
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.frame = _sort_by_user_date(df)
+        self._spans: dict[str, tuple[int, int]] = {}
+        if self.frame.empty or "user_id" not in self.frame.columns:
+            self._dates = np.array([], dtype="datetime64[ns]")
+            return
+        codes, uniques = pd.factorize(self.frame["user_id"], sort=False)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1))
+        stops = np.append(starts[1:], len(codes))
+        for code, start, stop in zip(codes[starts], starts, stops):
+            if code < 0:
+                continue
+            self._spans[str(uniques[code])] = (int(start), int(stop))
+        self._dates = self.frame["date"].to_numpy(dtype="datetime64[ns]")
+
+    def __contains__(self, user_id: object) -> bool:
+        return str(user_id) in self._spans
+
+    def user_ids(self) -> list[str]:
+        return list(self._spans)
+
+    def span(self, user_id: str, target_date: date | None = None) -> tuple[int, int]:
+        """Rango [start, stop) de filas del usuario con date <= target_date."""
+        start, stop = self._spans.get(str(user_id), (0, 0))
+        if target_date is None or start == stop:
+            return start, stop
+        cutoff = np.datetime64(pd.Timestamp(target_date), "ns")
+        # NaT queda al final del rango ordenado, así que nunca entra en el corte
+        return start, start + int(np.searchsorted(self._dates[start:stop], cutoff, side="right"))
+
+    def rows(self, user_id: str, target_date: date | None = None) -> pd.DataFrame:
+        start, stop = self.span(user_id, target_date)
+        return self.frame.iloc[start:stop]
+
+
+FLOAT32_DECIMALS_ATTR = "float32_decimals"
+# Columnas float64 del origen compactadas a Int*: se devuelven como float
+COMPACT_INT_ATTR = "compact_int_columns"
+
+# float32 representa sin pérdida valores con `d` decimales si |x|·10^d < 2^22
+_FLOAT32_EXACT_LIMIT = float(2 ** 22)
+
+_INT_DTYPES = [("Int8", np.int8), ("Int16", np.int16), ("Int32", np.int32)]
+
+
+def _variable_precision() -> dict[str, dict[str, Any]]:
+    try:
+        from backend.rules_engine.registry import variable_precision
+
+        return variable_precision()
+    except Exception:  # noqa: BLE001
+        return {}
+
+
+def compact_dataframe(df: pd.DataFrame, precision: dict[str, dict[str, Any]] | None = None) -> pd.DataFrame:
+    """Reduce la memoria del DataFrame base sin cambiar ningún valor.
+
+    - `user_id` pasa a categórica (códigos enteros + tabla de usuarios).
+    - Métricas con todos los valores enteros -> Int8/Int16/Int32 nullable.
+    - Métricas cuyo `Variable.decimals` (y `valid_min`/`valid_max`) cabe en
+      float32 -> float32; `column_as_float` recupera el float64 exacto
+      redondeando a esos decimales.
+    Modifica y devuelve `df`. Los valores escalares (`current`) se devuelven
+    como float igual que sin compactar (`_restore_scalar`).
+    """
+    precision = precision or {}
+    float32_decimals: dict[str, int] = {}
+    int_columns: list[str] = []
+    if "user_id" in df.columns and not isinstance(df["user_id"].dtype, pd.CategoricalDtype):
+        df["user_id"] = df["user_id"].astype("category")
+    for key in list(df.columns):
+        if key in NON_NUMERIC_COLUMNS or df[key].dtype != np.float64:
+            continue
+        values = df[key].to_numpy()
+        finite = values[~np.isnan(values)]
+        if finite.size and np.all(finite == np.round(finite)):
+            lo, hi = finite.min(), finite.max()
+            for name, np_type in _INT_DTYPES:
+                info = np.iinfo(np_type)
+                if info.min <= lo and hi <= info.max:
+                    df[key] = df[key].astype(name)
+                    int_columns.append(key)
+                    break
+            continue
+        decimals = (precision.get(key) or {}).get("decimals")
+        if decimals is None or int(decimals) <= 0 or not finite.size:
+            continue
+        decimals = int(decimals)
+        spec = precision.get(key) or {}
+        bounds = [abs(float(b)) for b in (spec.get("valid_min"), spec.get("valid_max")) if b is not None]
+        magnitude = max([float(np.abs(finite).max()), *bounds])
+        if magnitude * 10 ** decimals >= _FLOAT32_EXACT_LIMIT:
+            continue
+        if not np.all(np.round(finite, decimals) == finite):
+            continue
+        df[key] = df[key].astype(np.float32)
+        float32_decimals[key] = decimals
+    df.attrs[FLOAT32_DECIMALS_ATTR] = float32_decimals
+    df.attrs[COMPACT_INT_ATTR] = int_columns
+    return df
+
+
+def column_as_float(frame: pd.DataFrame, key: str) -> pd.Series:
+    """Columna como float64, deshaciendo la compactación float32 de `compact_dataframe`."""
+    series = frame[key]
+    decimals = frame.attrs.get(FLOAT32_DECIMALS_ATTR, {}).get(key)
+    if decimals is not None and series.dtype == np.float32:
+        return series.astype(float).round(decimals)
+    return series.astype(float)
+
+
+def restore_float_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Copia de `df` con las columnas compactadas (float32 e Int*) devueltas a float64 exacto."""
+    decimals = df.attrs.get(FLOAT32_DECIMALS_ATTR, {})
+    int_columns = df.attrs.get(COMPACT_INT_ATTR, [])
+    if not decimals and not int_columns:
+        return df
+    out = df.copy()
+    for key in [*decimals, *int_columns]:
+        if key in out.columns:
+            out[key] = column_as_float(df, key)
+    out.attrs[FLOAT32_DECIMALS_ATTR] = {}
+    out.attrs[COMPACT_INT_ATTR] = []
+    return out
+
+
+def _restore_scalar(frame: pd.DataFrame, key: str, value: Any) -> Any:
+    # Escalares numpy de columnas compactas (int16, float32...) -> tipos Python
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or pd.isna(value):
+        return value
+    decimals = frame.attrs.get(FLOAT32_DECIMALS_ATTR, {}).get(key)
+    if decimals is not None:
+        return round(float(value), decimals)
+    if key in frame.attrs.get(COMPACT_INT_ATTR, ()):
+        # En el origen era float64: `/simulate` y `why` siguen mostrando 5000.0
+        return float(value)
+    return value
+
+
+# Proyección del DataFrame base: (columnas, primer día, último día); None = sin límite
+DatasetScope = tuple[frozenset[str] | None, date | None, date | None]
+FULL_SCOPE: DatasetScope = (None, None, None)
+
+
+def _covers(loaded: DatasetScope, wanted: DatasetScope) -> bool:
+    (cols, start, end), (want_cols, want_start, want_end) = loaded, wanted
+    return (
+        (cols is None or (want_cols is not None and want_cols <= cols))
+        and (start is None or (want_start is not None and want_start >= start))
+        and (end is None or (want_end is not None and want_end <= end))
+    )
+
+
+def _widen(loaded: DatasetScope, wanted: DatasetScope) -> DatasetScope:
+    """Ámbito que cubre lo cargado y lo pedido; un límite de fecha que se supera se quita del todo.
+
+    Así una secuencia de días crecientes (o decrecientes) recarga una vez, no
+    una vez por día.
+    """
+    (cols, start, end), (want_cols, want_start, want_end) = loaded, wanted
+    return (
+        None if cols is None or want_cols is None else cols | want_cols,
+        start if start is not None and want_start is not None and want_start >= start else None,
+        end if end is not None and want_end is not None and want_end <= end else None,
+    )
+
+
+class DatasetCache:
+    """Caché de proceso para el DataFrame base.
+
+    La clave es (ruta, tamaño, mtime) de cada fichero fuente, así que el
+    DataFrame solo se vuelve a leer cuando cambian los CSV. El DataFrame
+    devuelto es compartido entre peticiones: tratarlo como solo lectura.
+
+    Con el feature store, `get` puede pedir solo unas columnas y un rango de
+    fechas (proyección y filtro en la lectura del Parquet). Una petición que
+    cabe en lo ya cargado lo reutiliza, aunque traiga más columnas o fechas
+    de las pedidas; si no cabe, se relee la unión (ver `_widen`).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._key: tuple[Any, ...] | None = None
+        self._scope: DatasetScope = FULL_SCOPE
+        self._frame: pd.DataFrame | None = None
+        self._index: UserRowIndex | None = None
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._last_load_seconds: float | None = None
+        self._memory_bytes = 0
+
+    def current_key(self) -> tuple[Any, ...]:
+        return tuple(_file_signature(p) for p in _dataset_source_paths())
+
+    def get(
+        self, columns: Iterable[str] | None = None, start: date | None = None, end: date | None = None
+    ) -> pd.DataFrame:
+        key = self.current_key()
+        wanted: DatasetScope = (frozenset(columns) if columns is not None else None, start, end)
+        with self._lock:
+            cached = self._frame is not None and self._key == key
+            if cached and _covers(self._scope, wanted):
+                self._hits += 1
+                return self._frame
+            self._misses += 1
+            started = time.perf_counter()
+            scope = _widen(self._scope, wanted) if cached else wanted
+            frame, filtered = _read_base_dataframe(*scope)
+            scope = scope if filtered else FULL_SCOPE
+            if settings.dataset_compact_dtypes:
+                frame = compact_dataframe(frame, _variable_precision())
+            index = UserRowIndex(frame)
+            self._last_load_seconds = time.perf_counter() - started
+            self._memory_bytes = int(index.frame.memory_usage(deep=True).sum())
+            self._key = key
+            self._scope = scope
+            self._frame = index.frame
+            self._index = index
+            return index.frame
+
+    def data_version(self) -> str:
+        """Huella corta de los ficheros fuente y del ámbito cargado: cambia cuando cambia el DataFrame."""
+        key = (self._key, self._scope) if self._key is not None else (self.current_key(), FULL_SCOPE)
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+
+    def index_for(self, df: pd.DataFrame) -> UserRowIndex | None:
+        """Índice por usuario si `df` es el DataFrame cacheado; None en otro caso."""
+        index = self._index
+        if index is not None and index.frame is df:
+            return index
+        return None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._key = None
+            self._scope = FULL_SCOPE
+            self._frame = None
+            self._index = None
+            self._invalidations += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+                "loaded": self._frame is not None,
+                "rows": int(len(self._frame)) if self._frame is not None else 0,
+                "columns": sorted(self._scope[0]) if self._scope[0] is not None else None,
+                "start": self._scope[1].isoformat() if self._scope[1] is not None else None,
+                "end": self._scope[2].isoformat() if self._scope[2] is not None else None,
+                "sources": [
+                    {"path": path, "size": size, "mtime_ns": mtime}
+                    for path, size, mtime in (self._key or ())
+                ],
+                "last_load_seconds": self._last_load_seconds,
+                "memory_bytes": self._memory_bytes if self._frame is not None else 0,
+                "data_version": self.data_version() if self._key is not None else None,
+            }
+
+
+dataset_cache = DatasetCache()
+
+
+def load_base_dataframe(
+    columns: Iterable[str] | None = None, start: date | None = None, end: date | None = None
+) -> pd.DataFrame:
+    """Devuelve el DataFrame base desde la caché de proceso (ver `DatasetCache`).
+
+    `columns`, `start` y `end` son lo mínimo que necesita quien llama: el
+    DataFrame puede traer más (`user_id` y `date` siempre).
+    """
+    return dataset_cache.get(columns, start, end)
+
+
+def dataset_scope(required: set[tuple[str, str]] | None, target_day: date) -> dict[str, Any]:
+    """Argumentos de `load_base_dataframe` para evaluar `target_day` con las features `required`.
+
+    Las variables de `required` (con las dependencias de las derivadas; todas
+    si es None) y las filas hasta `target_day`. Las ventanas son las últimas
+    `MAX_WINDOW` filas de cada usuario, no días, así que por defecto no hay
+    primer día; `dataset_history_days` > 0 lo fija en `target_day` menos esos
+    días.
+    """
+    columns = None
+    if required is not None:
+        # Las derivadas se calculan, no están en el fichero
+        derived = {var for var, _ in DERIVED_FEATURES}
+        columns = sorted({var for var, _ in expand_required(required)} - derived)
+    days = int(settings.dataset_history_days)
+    return {
+        "columns": columns,
+        "start": target_day - timedelta(days=days) if days > 0 else None,
+        "end": target_day,
+    }
+
+
+def invalidate_dataset_cache() -> None:
+    dataset_cache.invalidate()
+
+
+def dataset_cache_stats() -> dict[str, Any]:
+    return dataset_cache.stats()
+
+
+def dataset_version() -> str:
+    return dataset_cache.data_version()
+
+
+def _read_base_dataframe(
+    columns: Iterable[str] | None = None, start: date | None = None, end: date | None = None
+) -> tuple[pd.DataFrame, bool]:
     """Carga el DataFrame procesado con variables derivadas.
 
-    Primero intenta cargar el CSV procesado (data/daily_processed.csv)
-    que contiene todas las variables derivadas (acwr, trimp, readiness_score, etc.).
-    
-    Si no existe, fallback a los CSV originales para compatibilidad.
+    Orden de fuentes:
+    1. Feature store Parquet (output/daily_merged.parquet o FEATURE_STORE_PATH),
+       escrito por scripts/10_load_and_merge.py, con proyección de `columns`
+       y filtro de fechas `start`/`end`.
+    2. CSV procesado (data/daily_processed.csv) con las variables derivadas
+       (acwr, trimp, readiness_score, etc.).
+    3. CSV originales, por compatibilidad.
+
+    Devuelve (DataFrame, si se aplicaron proyección y filtro); los CSV se leen
+    siempre enteros.
     """
+    store_path = feature_store_path()
+    if feature_store_available() and os.path.exists(store_path):
+        try:
+            return read_feature_store(store_path, columns=columns, start=start, end=end), True
+        except Exception as e:
+            print(f"Warning: Error loading feature store: {e}, falling back to CSV")
+
     # Intentar cargar el CSV procesado primero
-    processed_path = os.path.join("data", "daily_processed.csv")
+    processed_path = _processed_csv_path()
     if os.path.exists(processed_path):
         try:
             df = pd.read_csv(processed_path)
@@ -33,7 +423,7 @@ def load_base_dataframe() -> pd.DataFrame:
                 df["date"] = pd.to_datetime(df["date"], errors="coerce")
             if "user_id" in df.columns:
                 df["user_id"] = df["user_id"].astype(str)
-            return df
+            return df, False
         except Exception as e:
             print(f"Warning: Error loading processed CSV: {e}, falling back to original CSV")
     
@@ -65,13 +455,8 @@ def load_base_dataframe() -> pd.DataFrame:
         return pd.DataFrame(columns=cols)
 
     try:
-        # Leer CSV de actividad (separador ';')
-        d = pd.read_csv(
-            daily_path,
-            sep=";",
-            engine="python",
-            parse_dates=[c for c in ["date", "start_date_time", "webhook_date_time", "last_webhook_update_date_time"] if os.path.exists(daily_path)],
-        )
+        # Leer CSV de actividad con el esquema declarado (separador ';', NULL, fechas)
+        d = read_csv_typed(daily_path, SCHEMAS["activity_daily"], usecols=_DAILY_RAW_COLUMNS)
         # Normalizar nombres
         d = d.rename(
             columns={
@@ -108,17 +493,13 @@ def load_base_dataframe() -> pd.DataFrame:
             if c in d.columns
         ]
         d = d[keep_d]
-    except Exception:
+    except Exception as e:
+        print(f"Warning: Error loading daily CSV {daily_path}: {e}, activity columns will be empty")
         d = _empty_df()
 
     try:
-        # Leer CSV de sueño (separador ';')
-        s = pd.read_csv(
-            sleep_path,
-            sep=";",
-            engine="python",
-            parse_dates=[c for c in ["calculation_date", "start_date_time", "end_date_time"] if os.path.exists(sleep_path)],
-        )
+        # Leer CSV de sueño con el esquema declarado (separador ';', NULL, fechas)
+        s = read_csv_typed(sleep_path, SCHEMAS["sleep_daily"], usecols=_SLEEP_RAW_COLUMNS)
         s = s.rename(
             columns={
                 "patient_id": "user_id",
@@ -152,7 +533,8 @@ def load_base_dataframe() -> pd.DataFrame:
         # Homogeneizar resting_heart_rate si viene con sufijo _bpm
         if "resting_heart_rate" not in s.columns and "resting_heart_rate_bpm" in s.columns:
             s = s.rename(columns={"resting_heart_rate_bpm": "resting_heart_rate"})
-    except Exception:
+    except Exception as e:
+        print(f"Warning: Error loading sleep CSV {sleep_path}: {e}, sleep columns will be empty")
         s = _empty_df()
 
     try:
@@ -165,14 +547,24 @@ def load_base_dataframe() -> pd.DataFrame:
     if not df.empty:
         if "date" in df.columns:
             df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        # Asegurar tipos numéricos donde aplique
+        # Asegurar tipos numéricos donde aplique (las columnas tipadas por el esquema ya lo son)
         for col in df.columns:
-            if col in {"user_id", "date"}:
+            if col in {"user_id", "date"} or df[col].dtype != object:
                 continue
             df[col] = pd.to_numeric(df[col], errors="coerce")
         df = df.sort_values(["user_id", "date"]).reset_index(drop=True)
 
-    return df
+    return df, False
+
+
+# Columnas de fecha/hora y texto que no admiten agregados de ventana
+NON_NUMERIC_COLUMNS = {
+    "date", "user_id", "bedtime", "waketime", "start_date_time", "end_date_time",
+    "calculation_date", "webhook_date_time", "last_webhook_update_date_time",
+    "device_source", "sex", "gender",
+}
+
+WINDOW_AGGREGATORS = ["mean_3d", "mean_7d", "mean_14d", "median_14d", "delta_pct_3v14", "zscore_28d"]
 
 
 def rolling_mean(series: pd.Series, window_days: int) -> float | None:
@@ -191,20 +583,115 @@ def rolling_median(series: pd.Series, window_days: int) -> float | None:
 
 def zscore(series: pd.Series, window_days: int) -> float | None:
     try:
-        arr = series.tail(window_days).astype(float).values
+        arr = series.tail(window_days).astype(float).to_numpy()
         if len(arr) == 0:
             return None
-        mu = float(np.mean(arr))
-        sd = float(np.std(arr))
-        if sd == 0:
-            return 0.0
-        return float((arr[-1] - mu) / sd)
+        window, counts = tail_window(arr)
+        return float(window_aggregates(window, counts, {"zscore_28d"})["zscore_28d"][0])
     except Exception:  # noqa: BLE001
         return None
 
 
-def build_features(df: pd.DataFrame, target_date: date, user_id: str) -> Dict[str, Dict[str, Any]]:
-    user_df = df[(df["user_id"] == user_id) & (df["date"] <= pd.Timestamp(target_date))].sort_values("date")
+# Filas de la ventana más larga (zscore_28d)
+MAX_WINDOW = 28
+# Filas de cada agregado de ventana
+AGGREGATOR_ROWS = {"mean_3d": 3, "mean_7d": 7, "mean_14d": 14, "median_14d": 14, "zscore_28d": MAX_WINDOW}
+# Desviación típica despreciable frente a la media: ventana constante, zscore 0. `np.std` de
+# 28 copias de 0.1 no da 0 exacto, y el resultado dependería del orden de las sumas.
+ZSCORE_SD_RTOL = 1e-9
+
+
+def tail_window(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Últimas `MAX_WINDOW` filas de un usuario como ventana (1, MAX_WINDOW) de `window_aggregates`."""
+    values = np.asarray(values, dtype=float)[-MAX_WINDOW:]
+    window = np.zeros((1, MAX_WINDOW))
+    if len(values):
+        window[0, -len(values):] = values
+    return window, np.array([len(values)])
+
+
+def window_aggregates(
+    window: np.ndarray, counts: np.ndarray, aggs: Iterable[str] = WINDOW_AGGREGATORS
+) -> dict[str, np.ndarray]:
+    """Agregados de ventana por fila de `window` (n, MAX_WINDOW).
+
+    Las últimas `counts[i]` posiciones de la fila i son las últimas filas
+    del usuario (la más reciente al final); el resto se ignora. Es la única
+    implementación de los agregados: `build_features`, `build_features_all`,
+    el estado incremental y el cubo la comparten, así que dan exactamente el
+    mismo resultado con las mismas filas. Los NaN no cuentan en medias y
+    mediana; en `zscore_28d` un NaN en la ventana anula el resultado.
+    """
+    aggs = set(aggs)
+    if "delta_pct_3v14" in aggs:
+        aggs |= {"mean_3d", "mean_14d"}
+    counts = np.asarray(counts)
+    valid = np.arange(MAX_WINDOW)[None, :] >= (MAX_WINDOW - counts)[:, None]
+    present = valid & ~np.isnan(window)
+    out: dict[str, np.ndarray] = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for agg in ("mean_3d", "mean_7d", "mean_14d"):
+            if agg in aggs:
+                n = AGGREGATOR_ROWS[agg]
+                tail = present[:, -n:]
+                total = np.where(tail, window[:, -n:], 0.0).sum(axis=1)
+                out[agg] = total / tail.sum(axis=1)
+        if "median_14d" in aggs:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                out["median_14d"] = np.nanmedian(np.where(present, window, np.nan)[:, -14:], axis=1)
+        if "delta_pct_3v14" in aggs:
+            m14 = out["mean_14d"]
+            out["delta_pct_3v14"] = out["mean_3d"] / np.where(m14 != 0, m14, np.nan) - 1
+        if "zscore_28d" in aggs:
+            n = np.maximum(counts, 1).astype(float)
+            values = np.where(valid, window, 0.0)
+            mu = values.sum(axis=1) / n
+            dev = np.where(valid, window - mu[:, None], 0.0)
+            sd = np.sqrt((dev * dev).sum(axis=1) / n)
+            z = np.where(sd <= ZSCORE_SD_RTOL * np.abs(mu), 0.0, (window[:, -1] - mu) / sd)
+            out["zscore_28d"] = np.where((counts == 0) | np.isnan(values).any(axis=1), np.nan, z)
+    return out
+
+
+def user_rows(df: pd.DataFrame, user_id: str, target_date: date) -> pd.DataFrame:
+    """Filas del usuario con date <= target_date, ordenadas por fecha."""
+    index = dataset_cache.index_for(df)
+    if index is not None:
+        return index.rows(user_id, target_date)
+    return df[(df["user_id"] == user_id) & (df["date"] <= pd.Timestamp(target_date))].sort_values("date")
+
+
+# Features derivadas y las (var, agg) de las que dependen
+DERIVED_FEATURES: dict[tuple[str, str], set[tuple[str, str]]] = {
+    ("max_hr_pct_user_max", "current"): {
+        ("max_heart_rate_bpm", "current"),
+        ("user_max_heart_rate_bpm", "current"),
+    },
+}
+
+
+def expand_required(required: set[tuple[str, str]]) -> set[tuple[str, str]]:
+    """Añade a `required` las dependencias de las features derivadas."""
+    out = set(required)
+    for derived, deps in DERIVED_FEATURES.items():
+        if derived in out:
+            out |= deps
+    return out
+
+
+def build_features(
+    df: pd.DataFrame,
+    target_date: date,
+    user_id: str,
+    required: set[tuple[str, str]] | None = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Features de un usuario a fecha `target_date`.
+
+    Con `required` solo se calculan esos pares (var, agg) (más las
+    dependencias de las derivadas); sin él se calculan todos.
+    """
+    user_df = user_rows(df, user_id, target_date)
 
     features: Dict[str, Dict[str, Any]] = {}
 
@@ -214,48 +701,139 @@ def build_features(df: pd.DataFrame, target_date: date, user_id: str) -> Dict[st
     if user_df.empty:
         return features
 
+    if required is not None:
+        required = expand_required(required)
+        needed_vars = {var for var, _ in required}
+        columns = [c for c in user_df.columns if c in needed_vars]
+    else:
+        columns = list(user_df.columns)
+
+    def wants(key: str, agg: str) -> bool:
+        return required is None or (key, agg) in required
+
     # Current values
     last = user_df.iloc[-1]
-    for key in user_df.columns:
+    for key in columns:
         if key in {"date", "user_id"}:
             continue
-        add(key, "current", last.get(key))
+        if wants(key, "current"):
+            add(key, "current", _restore_scalar(user_df, key, last.get(key)))
 
     # Rolling windows - solo procesar columnas numéricas
-    # Excluir columnas de fecha/hora y texto
-    exclude_cols = {"date", "user_id", "bedtime", "waketime", "start_date_time", "end_date_time", 
-                   "calculation_date", "webhook_date_time", "last_webhook_update_date_time", 
-                   "device_source", "sex", "gender"}
-    
-    for key in user_df.columns:
-        if key in exclude_cols:
+    for key in columns:
+        if key in NON_NUMERIC_COLUMNS:
             continue
-        
+        aggs = [agg for agg in WINDOW_AGGREGATORS if wants(key, agg)]
+        if not aggs:
+            continue
+
         # Intentar convertir a float, saltar si no es posible
         try:
-            s = user_df[key].astype(float)
+            s = column_as_float(user_df, key)
         except (ValueError, TypeError):
             # Si no se puede convertir a float, saltar esta columna
             continue
-        add(key, "mean_3d", rolling_mean(s, 3))
-        add(key, "mean_7d", rolling_mean(s, 7))
-        add(key, "mean_14d", rolling_mean(s, 14))
-        add(key, "median_14d", rolling_median(s, 14))
-        # delta_pct_3v14 = mean_3d/mean_14d - 1
-        m3 = features.get(key, {}).get("mean_3d")
-        m14 = features.get(key, {}).get("mean_14d")
-        if m3 is not None and m14 not in (None, 0):
-            add(key, "delta_pct_3v14", (m3 / m14) - 1)
-        else:
-            add(key, "delta_pct_3v14", None)
-        add(key, "zscore_28d", zscore(s, 28))
+        window, counts = tail_window(s.to_numpy())
+        values = window_aggregates(window, counts, aggs)
+        for agg in aggs:
+            add(key, agg, float(values[agg][0]))
 
     # Derived features
-    max_hr = features.get("max_heart_rate_bpm", {}).get("current")
-    user_max_hr = features.get("user_max_heart_rate_bpm", {}).get("current")
-    if max_hr is not None and user_max_hr not in (None, 0):
-        add("max_hr_pct_user_max", "current", max_hr / user_max_hr)
+    if wants("max_hr_pct_user_max", "current"):
+        max_hr = features.get("max_heart_rate_bpm", {}).get("current")
+        user_max_hr = features.get("user_max_heart_rate_bpm", {}).get("current")
+        if max_hr is not None and user_max_hr not in (None, 0):
+            add("max_hr_pct_user_max", "current", max_hr / user_max_hr)
 
     return features
 
 
+def build_features_all(
+    df: pd.DataFrame,
+    target_date: date,
+    user_ids: list[str] | None = None,
+    required: set[tuple[str, str]] | None = None,
+) -> pd.DataFrame:
+    """Matriz usuarios × features para todos los usuarios en una sola pasada.
+
+    Equivale a llamar a `build_features` por usuario, pero agrupando de forma
+    vectorizada. El índice es `user_id` y las columnas un MultiIndex
+    (var, agg) con los mismos agregadores; los valores ausentes quedan como
+    NaN. Solo aparecen usuarios con al menos una fila en o antes de
+    `target_date`. Con `required` solo se procesan las variables implicadas.
+    """
+    if df.empty or not {"user_id", "date"}.issubset(df.columns):
+        return pd.DataFrame(index=pd.Index([], name="user_id"), columns=pd.MultiIndex.from_tuples([], names=["var", "agg"]))
+
+    base = df[df["date"] <= pd.Timestamp(target_date)]
+    if user_ids is not None:
+        base = base[base["user_id"].isin([str(u) for u in user_ids])]
+    base = _sort_by_user_date(base[base["user_id"].notna()])
+
+    codes, uniques = pd.factorize(base["user_id"], sort=False)
+    users = pd.Index([str(u) for u in uniques], name="user_id")
+    # Posición de cada fila contando desde la última del usuario (0 = más reciente)
+    rev = base.groupby(codes, sort=False).cumcount(ascending=False).to_numpy()
+    last_mask = rev == 0
+
+    value_cols = [c for c in base.columns if c not in {"date", "user_id"}]
+    if required is not None:
+        needed_vars = {var for var, _ in expand_required(required)}
+        value_cols = [c for c in value_cols if c in needed_vars]
+    numeric: dict[str, pd.Series] = {}
+    for key in value_cols:
+        if key in NON_NUMERIC_COLUMNS:
+            continue
+        try:
+            numeric[key] = column_as_float(base, key)
+        except (ValueError, TypeError):
+            continue
+    num = pd.DataFrame(numeric, index=base.index)
+
+    current = base[last_mask][value_cols]
+    for key in base.attrs.get(FLOAT32_DECIMALS_ATTR, {}):
+        if key in current.columns:
+            current[key] = column_as_float(current, key)
+    for key in base.attrs.get(COMPACT_INT_ATTR, ()):
+        if key in current.columns:
+            current[key] = current[key].astype(float)
+    current.index = users[codes[last_mask]]
+    current = current.reindex(users)
+
+    # Ventanas (usuarios, MAX_WINDOW) alineadas a la derecha, como `tail_window` por usuario
+    in_window = rev < MAX_WINDOW
+    rows, slots = codes[in_window], MAX_WINDOW - 1 - rev[in_window]
+    counts = np.minimum(np.bincount(codes, minlength=len(users)), MAX_WINDOW)
+    aggs: dict[str, dict[str, np.ndarray]] = {}
+    for key in num.columns:
+        window = np.zeros((len(users), MAX_WINDOW))
+        window[rows, slots] = num[key].to_numpy()[in_window]
+        aggs[key] = window_aggregates(window, counts)
+
+    columns: dict[tuple[str, str], pd.Series] = {}
+    for key in value_cols:
+        columns[(key, "current")] = current[key]
+        if key in num.columns:
+            for agg in WINDOW_AGGREGATORS:
+                columns[(key, agg)] = pd.Series(aggs[key][agg], index=users)
+
+    if "max_heart_rate_bpm" in num.columns and "user_max_heart_rate_bpm" in num.columns:
+        last_num = current[list(num.columns)].astype(float)
+        user_max = last_num["user_max_heart_rate_bpm"]
+        columns[("max_hr_pct_user_max", "current")] = last_num["max_heart_rate_bpm"] / user_max.where(user_max != 0)
+
+    matrix = pd.DataFrame(columns, index=users)
+    matrix.columns = pd.MultiIndex.from_tuples(list(columns), names=["var", "agg"])
+    return matrix
+
+
+def features_from_matrix(matrix: pd.DataFrame, user_id: str) -> Dict[str, Dict[str, Any]]:
+    """Fila de `build_features_all` en el formato dict de `build_features`."""
+    if user_id not in matrix.index:
+        return {}
+    features: Dict[str, Dict[str, Any]] = {}
+    for (key, agg), value in matrix.loc[user_id].items():
+        if isinstance(value, np.generic):
+            value = value.item()
+        features.setdefault(key, {})[agg] = None if pd.isna(value) else value
+    return features
@@ -18,6 +18,11 @@ def select_weighted_random(candidates: list[dict[str, Any]]) -> dict[str, Any] |
     return random.choices(candidates, weights=weights, k=1)[0]
 
 
+def placeholder_refs(template: str) -> list[tuple[str, str]]:
+    """Pares (var, agg) referenciados por los placeholders `{{var:agg}}` de una plantilla."""
+    return [(m.group(1), m.group(2) or "current") for m in PLACEHOLDER_RE.finditer(template or "")]
+
+
 def render_message(template: str, features: Dict[str, Dict[str, Any]]) -> tuple[str, list[str]]:
     warnings: list[str] = []
 
@@ -1,23 +1,38 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import os
 from datetime import datetime, date as _Date
 from typing import Any, Optional
 
+from alembic import command
+from alembic.config import Config
 from sqlalchemy import (
     JSON,
     Boolean,
+    case,
     Column,
     Date,
     DateTime,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     MetaData,
     String,
+    UniqueConstraint,
     create_engine,
+    delete,
+    distinct,
+    inspect,
     select,
     func,
+    insert,
+    text,
+    update,
 )
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, Session, selectinload
 
 from backend.config import settings
@@ -97,21 +112,108 @@ class RuleMessage(Base):
     rule: Mapped[Rule] = relationship("Rule", back_populates="messages")
 
 
+class FeatureSnapshot(Base):
+    """Features de una evaluación, guardadas una vez por (tenant, usuario, día, versión del dataset).
+
+    Las auditorías de esa evaluación apuntan aquí en lugar de copiar el dict
+    completo en cada fila. `data_version` es la huella de los ficheros fuente
+    (`features.dataset_version`).
+    """
+
+    __tablename__ = "feature_snapshots"
+    __table_args__ = (UniqueConstraint("tenant_id", "user_id", "date", "data_version"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tenant_id: Mapped[str] = mapped_column(String(50), default="default")
+    user_id: Mapped[str] = mapped_column(String(100))
+    date: Mapped[_Date] = mapped_column(Date)
+    data_version: Mapped[str] = mapped_column(String(64))
+    values: Mapped[dict[str, Any]] = mapped_column(JSON)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+
+
+_DELIVERED = {
+    "sqlite_where": text("fired = 1 AND discarded_reason IS NULL"),
+    "postgresql_where": text("fired = true AND discarded_reason IS NULL"),
+}
+
+
 class Audit(Base):
     __tablename__ = "audits"
+    # Índices por ruta de acceso (migraciones 0003 y 0004); el parcial solo en SQLite/PostgreSQL.
+    # La analítica lee `rule_daily_stats`, así que no hay índices para ella aquí.
+    __table_args__ = (
+        Index("ix_audits_delivered", "tenant_id", "user_id", "rule_id", "date", **_DELIVERED),
+        Index("ix_audits_user_date", "user_id", "date"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     tenant_id: Mapped[str] = mapped_column(String(50), default="default", index=True)
-    user_id: Mapped[str] = mapped_column(String(100), index=True)
+    user_id: Mapped[str] = mapped_column(String(100))
     date: Mapped[_Date] = mapped_column(Date)
     rule_id: Mapped[Optional[str]]
     fired: Mapped[bool] = mapped_column(Boolean, default=False)
     discarded_reason: Mapped[Optional[str]]
     why: Mapped[Optional[dict[str, Any]]] = mapped_column(JSON)
+    # Solo auditorías antiguas: las nuevas referencian `feature_snapshots`
     values: Mapped[Optional[dict[str, Any]]] = mapped_column(JSON)
+    feature_snapshot_id: Mapped[Optional[int]] = mapped_column(ForeignKey("feature_snapshots.id", ondelete="SET NULL"))
     message_id: Mapped[Optional[int]]
+    # Evaluaciones que representa la fila: 1/tasa en las no disparadas muestreadas (`audit_policy`)
+    sample_weight: Mapped[float] = mapped_column(Float, default=1.0, server_default=text("1"))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
 
+    feature_snapshot: Mapped[Optional[FeatureSnapshot]] = relationship("FeatureSnapshot")
+
+
+class RuleFireState(Base):
+    """Último disparo entregado por (tenant, usuario, regla): cooldowns por clave primaria."""
+
+    __tablename__ = "rule_fire_state"
+
+    tenant_id: Mapped[str] = mapped_column(String(50), primary_key=True)
+    user_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    rule_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    last_fired_date: Mapped[_Date] = mapped_column(Date)
+    last_message_id: Mapped[Optional[int]]
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+
+
+class RuleDailyStats(Base):
+    """Resumen diario por regla, mantenido al escribir auditorías (`bulk_insert_audits`).
+
+    Las consultas de analítica leen de aquí: su coste depende de reglas × días,
+    no del volumen de `audits`.
+    """
+
+    __tablename__ = "rule_daily_stats"
+    __table_args__ = (
+        Index("ix_rule_daily_stats_tenant_date", "tenant_id", "date"),
+        Index("ix_rule_daily_stats_rule_date", "rule_id", "date"),
+    )
+
+    tenant_id: Mapped[str] = mapped_column(String(50), primary_key=True)
+    rule_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    date: Mapped[_Date] = mapped_column(Date, primary_key=True)
+    # Auditorías con fired=true (incluye las descartadas por límites)
+    fired_count: Mapped[int] = mapped_column(Integer, default=0)
+    evaluated_count: Mapped[int] = mapped_column(Integer, default=0)
+    # Usuarios distintos a los que se entregó la regla ese día
+    distinct_users: Mapped[int] = mapped_column(Integer, default=0)
+    # {message_id: disparos con esa variante}
+    per_message_counts: Mapped[dict[str, int]] = mapped_column(JSON, default=dict)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+
+
+class RuleSetVersion(Base):
+    """Contador por tenant que se incrementa en cada cambio de reglas o mensajes."""
+
+    __tablename__ = "rule_set_versions"
+
+    tenant_id: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+
 
 class ChangeLog(Base):
     __tablename__ = "change_logs"
@@ -127,14 +229,527 @@ class ChangeLog(Base):
     after: Mapped[Optional[dict[str, Any]]] = mapped_column(JSON)
 
 
-def create_all_tables() -> None:
-    Base.metadata.create_all(engine)
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+# Esquema que creaba `create_all` antes de las migraciones
+BASELINE_REVISION = "0001"
+
+
+def alembic_config() -> Config:
+    cfg = Config()
+    cfg.set_main_option("script_location", MIGRATIONS_DIR)
+    return cfg
+
+
+def create_all_tables(bind: Engine | None = None) -> None:
+    """Crea o actualiza el esquema aplicando las migraciones de `backend/migrations`.
+
+    Una base de datos creada con `create_all` (sin `alembic_version`) se marca
+    como la revisión base y después se actualiza; las migraciones posteriores
+    comprueban lo que ya existe.
+    """
+    cfg = alembic_config()
+    with (bind or engine).begin() as conn:
+        cfg.attributes["connection"] = conn
+        inspector = inspect(conn)
+        if not inspector.has_table("alembic_version") and inspector.has_table("rules"):
+            command.stamp(cfg, BASELINE_REVISION)
+        command.upgrade(cfg, "head")
 
 
 def get_session() -> Session:
     return Session(engine, expire_on_commit=False)
 
 
+def bulk_insert_audits(rows: list[dict[str, Any]], commit_rows: int | None = None) -> int:
+    """Inserta auditorías con un único INSERT executemany por bloque.
+
+    `commit_rows` filas por transacción (por defecto `settings.audit_commit_rows`;
+    0 = todo en una sola transacción).
+    """
+    if not rows:
+        return 0
+    size = settings.audit_commit_rows if commit_rows is None else commit_rows
+    size = len(rows) if not size or size <= 0 else int(size)
+    with get_session() as session:
+        for i in range(0, len(rows), size):
+            block = rows[i : i + size]
+            # Antes del INSERT y con todas las filas: `distinct_users` compara con las
+            # entregas ya guardadas y `evaluated_count` no depende de la política de auditoría
+            update_rule_daily_stats(session, block)
+            kept = apply_audit_policy(block)
+            if kept:
+                session.execute(insert(Audit), _attach_feature_snapshots(session, kept))
+            upsert_fire_state(session, block)
+            session.commit()
+    return len(rows)
+
+
+# Regla no trazada por terminación temprana: el presupuesto del día o de su categoría ya estaba cubierto
+BUDGET_EXHAUSTED = "budget_exhausted"
+
+
+def audit_policy(tenant_id: str) -> tuple[str, float]:
+    """(política, tasa de muestreo) del tenant: `audit_policy_by_tenant` o los valores generales."""
+    policy = settings.audit_policy_by_tenant.get(tenant_id, settings.audit_policy)
+    rate = settings.audit_sample_rate_by_tenant.get(tenant_id, settings.audit_sample_rate)
+    return policy, min(max(float(rate), 0.0), 1.0)
+
+
+def sample_fraction(tenant_id: str, user_id: str) -> float:
+    """Posición estable del usuario en [0, 1): el mismo usuario entra o no en la muestra siempre."""
+    digest = hashlib.sha1(f"{tenant_id}:{user_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+def _keeps_unfired(policy: str, rate: float, tenant_id: str, user_id: str) -> bool:
+    if policy == "full":
+        return True
+    return policy == "sampled" and rate > 0 and sample_fraction(tenant_id, user_id) < rate
+
+
+def keeps_unfired_audits(tenant_id: str, user_id: str) -> bool:
+    """Si la política del tenant guarda las auditorías no disparadas de este usuario."""
+    policy, rate = audit_policy(tenant_id)
+    return _keeps_unfired(policy, rate, tenant_id, user_id)
+
+
+def apply_audit_policy(rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Filas de `rows` que se guardan según la política de su tenant, con `sample_weight`.
+
+    Las disparadas y las descartadas (límites, cooldown) se guardan siempre con
+    peso 1. Las no disparadas, incluidas las no trazadas por presupuesto
+    (`BUDGET_EXHAUSTED`) que no cumplen condiciones: todas (`full`), ninguna (`fired_only`) o las de los
+    usuarios con `sample_fraction` < tasa, con peso 1/tasa (`sampled`).
+    """
+    policies: dict[str, tuple[str, float]] = {}
+    out: list[dict[str, Any]] = []
+    for row in rows:
+        if row.get("fired") or row.get("discarded_reason") not in (None, BUDGET_EXHAUSTED):
+            out.append({**row, "sample_weight": 1.0})
+            continue
+        tenant_id = row.get("tenant_id") or "default"
+        if tenant_id not in policies:
+            policies[tenant_id] = audit_policy(tenant_id)
+        policy, rate = policies[tenant_id]
+        if _keeps_unfired(policy, rate, tenant_id, str(row["user_id"])):
+            out.append({**row, "sample_weight": 1.0 if policy == "full" else 1.0 / rate})
+    return out
+
+
+SnapshotKey = tuple[str, str, _Date, str]
+
+
+def _snapshot_key(snapshot: dict[str, Any]) -> SnapshotKey:
+    return (snapshot.get("tenant_id") or "default", str(snapshot["user_id"]), snapshot["date"], str(snapshot["data_version"]))
+
+
+def _attach_feature_snapshots(session: Session, rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Sustituye la clave `feature_snapshot` (dict) de cada fila por `feature_snapshot_id`."""
+    snapshots: dict[SnapshotKey, dict[str, Any]] = {}
+    for row in rows:
+        snapshot = row.get("feature_snapshot")
+        if snapshot:
+            snapshots.setdefault(_snapshot_key(snapshot), snapshot)
+    ids = store_feature_snapshots(session, list(snapshots.values())) if snapshots else {}
+    out: list[dict[str, Any]] = []
+    for row in rows:
+        snapshot = row.get("feature_snapshot")
+        values = {k: v for k, v in row.items() if k != "feature_snapshot"}
+        values["feature_snapshot_id"] = ids.get(_snapshot_key(snapshot)) if snapshot else row.get("feature_snapshot_id")
+        out.append(values)
+    return out
+
+
+def _merge_features(stored: dict[str, Any], new: dict[str, Any]) -> dict[str, Any] | None:
+    """`stored` ampliado con las features de `new` que no tenía; None si no falta ninguna."""
+    merged = {var: dict(aggs) if isinstance(aggs, dict) else aggs for var, aggs in stored.items()}
+    added = False
+    for var, aggs in new.items():
+        current = merged.get(var)
+        if isinstance(aggs, dict) and isinstance(current, dict):
+            for agg, value in aggs.items():
+                if agg not in current:
+                    current[agg] = value
+                    added = True
+        elif var not in merged:
+            merged[var] = aggs
+            added = True
+    return merged if added else None
+
+
+def store_feature_snapshots(session: Session, snapshots: list[dict[str, Any]], chunk: int = 500) -> dict[SnapshotKey, int]:
+    """Guarda snapshots de features dentro de la transacción del llamador y devuelve sus ids.
+
+    Cada snapshot es un dict con tenant_id, user_id, date, data_version y
+    values. Si ya existe uno con la misma clave se reutiliza; las features que
+    le falten (una evaluación normal solo calcula las que usan las reglas) se
+    añaden al existente.
+    """
+    groups: dict[tuple[str, _Date, str], dict[str, dict[str, Any]]] = {}
+    for snapshot in snapshots:
+        tenant_id, user_id, day, version = _snapshot_key(snapshot)
+        groups.setdefault((tenant_id, day, version), {}).setdefault(user_id, snapshot)
+
+    dialect_insert = _dialect_insert(session)
+    ids: dict[SnapshotKey, int] = {}
+    for (tenant_id, day, version), by_user in groups.items():
+        users = list(by_user)
+        for i in range(0, len(users), chunk):
+            part = users[i : i + chunk]
+            scope = (
+                FeatureSnapshot.tenant_id == tenant_id,
+                FeatureSnapshot.date == day,
+                FeatureSnapshot.data_version == version,
+            )
+            existing = {
+                uid: (sid, stored)
+                for sid, uid, stored in session.execute(
+                    select(FeatureSnapshot.id, FeatureSnapshot.user_id, FeatureSnapshot.values).where(
+                        *scope, FeatureSnapshot.user_id.in_(part)
+                    )
+                )
+            }
+            missing: list[dict[str, Any]] = []
+            for uid in part:
+                values = by_user[uid].get("values") or {}
+                if uid not in existing:
+                    missing.append(
+                        {"tenant_id": tenant_id, "user_id": uid, "date": day, "data_version": version, "values": values}
+                    )
+                    continue
+                sid, stored = existing[uid]
+                ids[(tenant_id, uid, day, version)] = sid
+                merged = _merge_features(stored or {}, values)
+                if merged is not None:
+                    session.execute(update(FeatureSnapshot).where(FeatureSnapshot.id == sid).values(values=merged))
+            if not missing:
+                continue
+            if dialect_insert is not None:
+                # Otro proceso puede haberlo insertado entre medias: se conserva el suyo
+                session.execute(dialect_insert(FeatureSnapshot).on_conflict_do_nothing(), missing)
+            else:
+                session.execute(insert(FeatureSnapshot), missing)
+            for sid, uid in session.execute(
+                select(FeatureSnapshot.id, FeatureSnapshot.user_id).where(
+                    *scope, FeatureSnapshot.user_id.in_([m["user_id"] for m in missing])
+                )
+            ):
+                ids[(tenant_id, uid, day, version)] = sid
+    return ids
+
+
+def _dialect_insert(session: Session) -> Any:
+    """`insert` con soporte de ON CONFLICT para el motor actual (sqlite/postgresql) o None."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def _is_delivered(row: dict[str, Any]) -> bool:
+    return bool(row.get("fired")) and row.get("discarded_reason") is None
+
+
+def upsert_fire_state(session: Session, rows: list[dict[str, Any]]) -> int:
+    """Actualiza `rule_fire_state` con los disparos entregados de `rows` (filas de `Audit`).
+
+    Solo avanza `last_fired_date`: evaluar un día anterior (backfill) no
+    sobrescribe un disparo más reciente.
+    """
+    latest: dict[tuple[str, str, str], tuple[_Date, Optional[int]]] = {}
+    for row in rows:
+        if not _is_delivered(row):
+            continue
+        key = (row.get("tenant_id") or "default", str(row["user_id"]), str(row["rule_id"]))
+        if key not in latest or row["date"] >= latest[key][0]:
+            latest[key] = (row["date"], row.get("message_id"))
+    if not latest:
+        return 0
+    values = [
+        {"tenant_id": t, "user_id": u, "rule_id": r, "last_fired_date": d, "last_message_id": m}
+        for (t, u, r), (d, m) in latest.items()
+    ]
+
+    table = RuleFireState.__table__
+    dialect_insert = _dialect_insert(session)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table)
+        newer = stmt.excluded.last_fired_date >= table.c.last_fired_date
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.tenant_id, table.c.user_id, table.c.rule_id],
+            set_={
+                "last_fired_date": case((newer, stmt.excluded.last_fired_date), else_=table.c.last_fired_date),
+                "last_message_id": case((newer, stmt.excluded.last_message_id), else_=table.c.last_message_id),
+                "updated_at": func.now(),
+            },
+        )
+        session.execute(stmt, values)
+        return len(values)
+
+    # Otros motores: lectura + escritura por clave
+    for v in values:
+        state = session.get(RuleFireState, (v["tenant_id"], v["user_id"], v["rule_id"]))
+        if state is None:
+            session.add(RuleFireState(**v))
+        elif v["last_fired_date"] >= state.last_fired_date:
+            state.last_fired_date = v["last_fired_date"]
+            state.last_message_id = v["last_message_id"]
+    session.flush()
+    return len(values)
+
+
+StatsKey = tuple[str, str, _Date]
+
+
+def _delivered_before(session: Session, keys: dict[StatsKey, set[str]], chunk: int = 500) -> set[tuple[str, str, _Date, str]]:
+    """(tenant, regla, día, usuario) de `keys` que ya tienen una entrega en `audits`."""
+    by_tenant: dict[str, list[StatsKey]] = {}
+    for key in keys:
+        by_tenant.setdefault(key[0], []).append(key)
+    found: set[tuple[str, str, _Date, str]] = set()
+    for tenant_id, tenant_keys in by_tenant.items():
+        users = sorted({u for key in tenant_keys for u in keys[key]})
+        rule_ids = sorted({key[1] for key in tenant_keys})
+        days = sorted({key[2] for key in tenant_keys})
+        for i in range(0, len(users), chunk):
+            rows = session.execute(
+                select(Audit.rule_id, Audit.date, Audit.user_id).where(
+                    Audit.tenant_id == tenant_id,
+                    Audit.user_id.in_(users[i : i + chunk]),
+                    Audit.rule_id.in_(rule_ids),
+                    Audit.date.in_(days),
+                    Audit.fired == True,  # noqa: E712
+                    Audit.discarded_reason.is_(None),
+                )
+            ).all()
+            found.update((tenant_id, rid, day, uid) for rid, day, uid in rows)
+    return found
+
+
+def update_rule_daily_stats(session: Session, rows: list[dict[str, Any]]) -> int:
+    """Suma las filas de `Audit` de `rows` a `rule_daily_stats` en la transacción del llamador.
+
+    Llamar antes de insertar las filas: un usuario que ya recibió la regla ese
+    día (re-evaluación) no vuelve a sumar en `distinct_users`.
+    """
+    deltas: dict[StatsKey, dict[str, Any]] = {}
+    delivered: dict[StatsKey, set[str]] = {}
+    for row in rows:
+        if row.get("rule_id") is None:
+            continue
+        key = (row.get("tenant_id") or "default", str(row["rule_id"]), row["date"])
+        delta = deltas.setdefault(key, {"fired_count": 0, "evaluated_count": 0, "messages": {}})
+        delta["evaluated_count"] += 1
+        if row.get("fired"):
+            delta["fired_count"] += 1
+            if row.get("message_id") is not None:
+                mid = str(row["message_id"])
+                delta["messages"][mid] = delta["messages"].get(mid, 0) + 1
+        if _is_delivered(row):
+            delivered.setdefault(key, set()).add(str(row["user_id"]))
+    if not deltas:
+        return 0
+
+    seen = _delivered_before(session, delivered) if delivered else set()
+    values = [
+        {
+            "tenant_id": t,
+            "rule_id": r,
+            "date": d,
+            "fired_count": delta["fired_count"],
+            "evaluated_count": delta["evaluated_count"],
+            "distinct_users": sum(1 for u in delivered.get((t, r, d), ()) if (t, r, d, u) not in seen),
+            "per_message_counts": {},
+        }
+        for (t, r, d), delta in deltas.items()
+    ]
+
+    table = RuleDailyStats.__table__
+    dialect_insert = _dialect_insert(session)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table)
+        increments = {
+            name: table.c[name] + stmt.excluded[name] for name in ("fired_count", "evaluated_count", "distinct_users")
+        }
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.tenant_id, table.c.rule_id, table.c.date],
+            set_={**increments, "updated_at": func.now()},
+        )
+        session.execute(stmt, values)
+    else:
+        for v in values:
+            stats = session.get(RuleDailyStats, (v["tenant_id"], v["rule_id"], v["date"]))
+            if stats is None:
+                session.add(RuleDailyStats(**v))
+            else:
+                stats.fired_count += v["fired_count"]
+                stats.evaluated_count += v["evaluated_count"]
+                stats.distinct_users += v["distinct_users"]
+        session.flush()
+
+    # Contadores por variante: JSON, se combinan en Python (la fila ya está bloqueada por el upsert)
+    for key, delta in deltas.items():
+        if not delta["messages"]:
+            continue
+        pk = (
+            RuleDailyStats.tenant_id == key[0],
+            RuleDailyStats.rule_id == key[1],
+            RuleDailyStats.date == key[2],
+        )
+        counts = dict(session.scalar(select(RuleDailyStats.per_message_counts).where(*pk)) or {})
+        for mid, n in delta["messages"].items():
+            counts[mid] = int(counts.get(mid, 0)) + n
+        session.execute(update(RuleDailyStats).where(*pk).values(per_message_counts=counts))
+    return len(values)
+
+
+def rebuild_rule_daily_stats(
+    tenant_id: str | None = None,
+    start: _Date | None = None,
+    end: _Date | None = None,
+    batch_size: int = 5000,
+) -> int:
+    """Recalcula `rule_daily_stats` desde `audits` para el tenant y rango dados (todo por defecto).
+
+    Solo para backfill o correcciones: los días cuyas auditorías ya se han
+    borrado o archivado perderían su resumen, así que conviene acotar el rango.
+    Con `audit_policy` distinta de `full`, `evaluated_count` es la suma de
+    `sample_weight` (estimación) en lugar del conteo exacto del incremental.
+    """
+    audit_scope = [Audit.rule_id.isnot(None)]
+    stats_scope = []
+    if tenant_id is not None:
+        audit_scope.append(Audit.tenant_id == tenant_id)
+        stats_scope.append(RuleDailyStats.tenant_id == tenant_id)
+    if start is not None:
+        audit_scope.append(Audit.date >= start)
+        stats_scope.append(RuleDailyStats.date >= start)
+    if end is not None:
+        audit_scope.append(Audit.date <= end)
+        stats_scope.append(RuleDailyStats.date <= end)
+
+    delivered = (Audit.fired == True) & Audit.discarded_reason.is_(None)  # noqa: E712
+    group = (Audit.tenant_id, Audit.rule_id, Audit.date)
+    with get_session() as session:
+        totals = session.execute(
+            select(
+                *group,
+                func.sum(case((Audit.fired == True, 1), else_=0)),  # noqa: E712
+                func.sum(Audit.sample_weight),
+                func.count(distinct(case((delivered, Audit.user_id)))),
+            )
+            .where(*audit_scope)
+            .group_by(*group)
+        ).all()
+        messages: dict[StatsKey, dict[str, int]] = {}
+        for t, r, d, mid, n in session.execute(
+            select(*group, Audit.message_id, func.count(Audit.id))
+            .where(*audit_scope, Audit.fired == True, Audit.message_id.isnot(None))  # noqa: E712
+            .group_by(*group, Audit.message_id)
+        ):
+            messages.setdefault((t, r, d), {})[str(mid)] = int(n)
+        values = [
+            {
+                "tenant_id": t,
+                "rule_id": r,
+                "date": d,
+                "fired_count": int(fired or 0),
+                "evaluated_count": int(round(evaluated or 0)),
+                "distinct_users": int(users),
+                "per_message_counts": messages.get((t, r, d), {}),
+            }
+            for t, r, d, fired, evaluated, users in totals
+        ]
+        session.execute(delete(RuleDailyStats).where(*stats_scope))
+        for i in range(0, len(values), batch_size):
+            session.execute(insert(RuleDailyStats), values[i : i + batch_size])
+        session.commit()
+        return len(values)
+
+
+def backfill_rule_daily_stats() -> int:
+    """Construye `rule_daily_stats` desde `audits` si está vacía (idempotente)."""
+    with get_session() as session:
+        if session.scalar(select(RuleDailyStats.rule_id).limit(1)) is not None:
+            return 0
+        if session.scalar(select(Audit.id).limit(1)) is None:
+            return 0
+    return rebuild_rule_daily_stats()
+
+
+def load_fire_state(tenant_id: str, user_ids: list[str], chunk: int = 500) -> dict[tuple[str, str], _Date]:
+    """`{(user_id, rule_id): last_fired_date}` para los usuarios dados (prefijo de la PK)."""
+    out: dict[tuple[str, str], _Date] = {}
+    with get_session() as session:
+        for i in range(0, len(user_ids), chunk):
+            rows = session.execute(
+                select(RuleFireState.user_id, RuleFireState.rule_id, RuleFireState.last_fired_date).where(
+                    RuleFireState.tenant_id == tenant_id,
+                    RuleFireState.user_id.in_(user_ids[i : i + chunk]),
+                )
+            ).all()
+            for uid, rid, day in rows:
+                out[(uid, rid)] = day
+    return out
+
+
+def backfill_rule_fire_state(batch_size: int = 5000) -> int:
+    """Rellena `rule_fire_state` desde `audits` si está vacía (idempotente)."""
+    with get_session() as session:
+        if session.scalar(select(RuleFireState.rule_id).limit(1)) is not None:
+            return 0
+        delivered = (Audit.fired == True, Audit.discarded_reason.is_(None), Audit.rule_id.isnot(None))
+        last = (
+            select(Audit.tenant_id, Audit.user_id, Audit.rule_id, func.max(Audit.date).label("last_date"))
+            .where(*delivered)
+            .group_by(Audit.tenant_id, Audit.user_id, Audit.rule_id)
+            .subquery()
+        )
+        rows = session.execute(
+            select(last.c.tenant_id, last.c.user_id, last.c.rule_id, last.c.last_date, func.max(Audit.message_id))
+            .join(
+                Audit,
+                (Audit.tenant_id == last.c.tenant_id)
+                & (Audit.user_id == last.c.user_id)
+                & (Audit.rule_id == last.c.rule_id)
+                & (Audit.date == last.c.last_date),
+            )
+            .where(*delivered)
+            .group_by(last.c.tenant_id, last.c.user_id, last.c.rule_id, last.c.last_date)
+        ).all()
+        values = [
+            {"tenant_id": t, "user_id": u, "rule_id": r, "last_fired_date": d, "last_message_id": m}
+            for t, u, r, d, m in rows
+        ]
+        for i in range(0, len(values), batch_size):
+            session.execute(insert(RuleFireState), values[i : i + batch_size])
+        session.commit()
+        return len(values)
+
+
+def bump_rule_set_version(session: Session, *tenant_ids: str | None) -> None:
+    """Incrementa el contador de los tenants afectados dentro de la transacción del llamador."""
+    for tenant_id in sorted({t or "default" for t in tenant_ids}):
+        result = session.execute(
+            update(RuleSetVersion)
+            .where(RuleSetVersion.tenant_id == tenant_id)
+            .values(version=RuleSetVersion.version + 1, updated_at=func.now())
+        )
+        if result.rowcount == 0:
+            session.add(RuleSetVersion(tenant_id=tenant_id, version=1))
+            session.flush()
+
+
+def get_rule_set_version(tenant_id: str = "default") -> int:
+    with get_session() as session:
+        version = session.scalar(select(RuleSetVersion.version).where(RuleSetVersion.tenant_id == tenant_id))
+        return int(version or 0)
+
+
 def seed_variables_from_json(path: str) -> None:
     try:
         with open(path, "r", encoding="utf-8") as f:
@@ -180,6 +795,7 @@ def seed_rules_from_json(path: str) -> None:
     if not isinstance(data, list):
         return
     with get_session() as session:
+        tenants: set[str] = set()
         for item in data:
             rid = item.get("id")
             if not rid:
@@ -187,6 +803,7 @@ def seed_rules_from_json(path: str) -> None:
             exists = session.get(Rule, rid)
             if exists:
                 continue
+            tenants.add(item.get("tenant_id", "default"))
             messages = item.get("messages", {}).get("candidates", [])
             rule = Rule(
                 id=rid,
@@ -214,6 +831,8 @@ def seed_rules_from_json(path: str) -> None:
                         active=True,
                     )
                 )
+        if tenants:
+            bump_rule_set_version(session, *tenants)
         session.commit()
 
 
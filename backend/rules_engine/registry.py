@@ -40,6 +40,20 @@ def seed_variables_from_json(path: str) -> None:
     _seed(path)
 
 
+def variable_precision() -> Dict[str, Dict[str, Any]]:
+    """decimals/valid_min/valid_max por clave de variable, desde la tabla `variables`."""
+    from sqlalchemy import select
+
+    from backend.rules_engine.persistence import Variable, get_session
+
+    with get_session() as session:
+        rows = session.scalars(select(Variable)).all()
+        return {
+            v.key: {"decimals": v.decimals, "valid_min": v.valid_min, "valid_max": v.valid_max}
+            for v in rows
+        }
+
+
 def load_registry_seed() -> list[Dict[str, Any]]:
     with open("backend/seeds/variables_seed.json", "r", encoding="utf-8") as f:
         return json.load(f)
@@ -0,0 +1,146 @@
+"""Snapshot inmutable en memoria de las reglas activas de cada tenant.
+
+`get_enabled_rules` hace un SELECT con `selectinload(Rule.messages)` en cada
+evaluación aunque las reglas cambian pocas veces al día. Aquí se guarda, por
+tenant, un `RuleSet` congelado con las reglas activas, sus mensajes y su
+lógica ya compilada. Solo se reconstruye cuando cambia el contador de
+`rule_set_versions` (lo incrementan los endpoints de `backend/api/rules.py`);
+comprobarlo es una lectura por clave primaria.
+
+La reconstrucción crea un `RuleSet` nuevo y lo publica con una única
+asignación: una evaluación en curso sigue usando el que obtuvo al empezar y
+nunca ve un conjunto a medias.
+"""
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Optional
+
+from backend.rules_engine.compiler import CompiledRule, compiled_rules
+from backend.rules_engine.messages import placeholder_refs
+from backend.rules_engine.persistence import Rule, get_enabled_rules, get_rule_set_version
+
+
+@dataclass(frozen=True)
+class MessageSnapshot:
+    id: int
+    text: str
+    weight: int
+    active: bool
+    locale: str
+
+
+@dataclass(frozen=True)
+class RuleSnapshot:
+    """Copia de una `Rule` con los atributos que usa el motor (compatible por duck typing)."""
+
+    id: str
+    version: int
+    enabled: bool
+    tenant_id: str
+    category: Optional[str]
+    priority: int
+    severity: int
+    cooldown_days: int
+    max_per_day: int
+    tags: tuple[str, ...]
+    logic: Any
+    locale: str
+    updated_at: Optional[datetime]
+    messages: tuple[MessageSnapshot, ...]
+    compiled: CompiledRule
+
+    @classmethod
+    def from_rule(cls, r: Rule) -> "RuleSnapshot":
+        return cls(
+            id=r.id,
+            version=r.version,
+            enabled=r.enabled,
+            tenant_id=r.tenant_id,
+            category=r.category,
+            priority=r.priority,
+            severity=r.severity,
+            cooldown_days=r.cooldown_days,
+            max_per_day=r.max_per_day,
+            tags=tuple(r.tags or []),
+            logic=r.logic,
+            locale=r.locale,
+            updated_at=r.updated_at,
+            messages=tuple(
+                MessageSnapshot(id=m.id, text=m.text, weight=m.weight, active=m.active, locale=m.locale)
+                for m in r.messages
+            ),
+            compiled=compiled_rules.get(r),
+        )
+
+    @property
+    def required(self) -> frozenset[tuple[str, str]]:
+        refs = set(self.compiled.required)
+        for m in self.messages:
+            if m.active:
+                refs.update(placeholder_refs(m.text))
+        return frozenset(refs)
+
+
+@dataclass(frozen=True)
+class RuleSet:
+    tenant_id: str
+    version: int
+    rules: tuple[RuleSnapshot, ...]
+    # Features que leen las reglas válidas (lógica + placeholders de mensajes)
+    required: frozenset[tuple[str, str]] = field(default_factory=frozenset)
+    built_at: datetime = field(default_factory=datetime.utcnow)
+
+
+def build_rule_set(tenant_id: str, version: int) -> RuleSet:
+    # Prioridad desc, severidad desc (orden estable): el mismo que usa `resolve_conflicts`,
+    # del que depende la terminación temprana del motor
+    ordered = sorted(get_enabled_rules(tenant_id), key=lambda r: (r.priority, r.severity), reverse=True)
+    rules = tuple(RuleSnapshot.from_rule(r) for r in ordered)
+    required: set[tuple[str, str]] = set()
+    for r in rules:
+        if r.compiled.ok:
+            required.update(r.required)
+    return RuleSet(tenant_id=tenant_id, version=version, rules=rules, required=frozenset(required))
+
+
+class RuleSetRegistry:
+    def __init__(self) -> None:
+        self._sets: dict[str, RuleSet] = {}
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+
+    def get(self, tenant_id: str = "default") -> RuleSet:
+        """Snapshot vigente del tenant; se reconstruye si el contador ha cambiado."""
+        version = get_rule_set_version(tenant_id)
+        current = self._sets.get(tenant_id)
+        if current is not None and current.version == version:
+            return current
+        with self._lock:
+            current = self._sets.get(tenant_id)
+            if current is not None and current.version == version:
+                return current
+            # La versión se lee antes que las reglas: si cambian entre medias,
+            # la siguiente llamada verá un contador mayor y reconstruirá.
+            rebuilt = build_rule_set(tenant_id, version)
+            self._sets[tenant_id] = rebuilt
+            self.rebuilds += 1
+            return rebuilt
+
+    def invalidate(self, tenant_id: str | None = None) -> None:
+        with self._lock:
+            if tenant_id is None:
+                self._sets.clear()
+            else:
+                self._sets.pop(tenant_id, None)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "rebuilds": self.rebuilds,
+            "tenants": {t: {"version": s.version, "rules": len(s.rules)} for t, s in self._sets.items()},
+        }
+
+
+rule_sets = RuleSetRegistry()
@@ -0,0 +1,170 @@
+"""Evaluación vectorizada de reglas sobre la matriz de `build_features_all`.
+
+Cada hoja del árbol `logic` se evalúa como una máscara booleana de NumPy
+sobre todos los usuarios a la vez y los grupos se combinan con `&`, `|` y
+`~`. El resultado por usuario es el mismo que `eval_node` sobre sus features:
+un valor ausente (NaN en la matriz, None en el dict) nunca dispara una hoja.
+
+Las columnas numéricas se comparan como arrays float; las de texto (objeto)
+se comparan elemento a elemento con las mismas reglas que `engine.compare`.
+"""
+from __future__ import annotations
+
+import numbers
+import operator
+from typing import Any, Callable, Iterable
+
+import numpy as np
+import pandas as pd
+
+from backend.rules_engine.compiler import CompiledRule
+from backend.rules_engine.dsl import GroupAll, GroupAny, GroupNone, NumericLeaf, RelativeLeaf
+
+
+_ORDER_OPS: dict[str, Callable[[Any, Any], Any]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+}
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (numbers.Real, np.bool_))
+
+
+class _Columns:
+    """Acceso a columnas (var, agg) de la matriz como arrays, con caché por evaluación."""
+
+    def __init__(self, matrix: pd.DataFrame) -> None:
+        self.matrix = matrix
+        self.size = len(matrix.index)
+        self._cache: dict[tuple[str, str], tuple[np.ndarray, np.ndarray]] = {}
+
+    def get(self, var: str, agg: str) -> tuple[np.ndarray, np.ndarray]:
+        """(valores, ausentes): float si la columna es numérica, objeto si no."""
+        key = (var, agg)
+        if key not in self._cache:
+            if key not in self.matrix.columns:
+                values = np.full(self.size, np.nan)
+            else:
+                col = self.matrix[key]
+                if pd.api.types.is_bool_dtype(col.dtype) or pd.api.types.is_numeric_dtype(col.dtype):
+                    values = col.to_numpy(dtype=float, na_value=np.nan)
+                else:
+                    values = col.to_numpy(dtype=object)
+            self._cache[key] = (values, np.asarray(pd.isna(values), dtype=bool))
+        return self._cache[key]
+
+
+def _elementwise(values: np.ndarray, missing: np.ndarray, check: Callable[[Any], bool]) -> np.ndarray:
+    out = np.zeros(len(values), dtype=bool)
+    for i in np.flatnonzero(~missing):
+        try:
+            out[i] = bool(check(values[i]))
+        except Exception:  # noqa: BLE001
+            out[i] = False
+    return out
+
+
+def _scalar_mask(op: str, values: np.ndarray, missing: np.ndarray, threshold: Any) -> np.ndarray:
+    """Máscara de `valor <op> umbral` para una columna frente a una constante."""
+    numeric = values.dtype != object
+    if op in _ORDER_OPS:
+        if threshold is None:
+            return np.zeros(len(values), dtype=bool)
+        fn = _ORDER_OPS[op]
+        if numeric and _is_number(threshold):
+            with np.errstate(invalid="ignore"):
+                return fn(values, threshold) & ~missing
+        return _elementwise(values, missing, lambda v: fn(v, threshold))
+    if op == "between":
+        if not isinstance(threshold, (list, tuple)) or len(threshold) != 2:
+            return np.zeros(len(values), dtype=bool)
+        low, high = threshold
+        if low is None or high is None:
+            return np.zeros(len(values), dtype=bool)
+        if numeric and _is_number(low) and _is_number(high):
+            with np.errstate(invalid="ignore"):
+                return (values >= low) & (values <= high) & ~missing
+        return _elementwise(values, missing, lambda v: low <= v <= high)
+    if op == "in":
+        if isinstance(threshold, (list, tuple, set, frozenset)):
+            members = list(threshold)
+            if numeric and all(_is_number(m) for m in members):
+                return np.isin(values, np.asarray(members, dtype=float)) & ~missing
+        else:
+            members = threshold
+        return _elementwise(values, missing, lambda v: v in members)
+    return np.zeros(len(values), dtype=bool)
+
+
+def _numeric_leaf_mask(node: NumericLeaf, cols: _Columns) -> np.ndarray:
+    values, missing = cols.get(node.var, node.agg)
+    mask = _scalar_mask(node.op, values, missing, node.value)
+    if node.required:
+        mask &= ~missing
+    return mask
+
+
+def _relative_leaf_mask(node: RelativeLeaf, cols: _Columns) -> np.ndarray:
+    left, left_missing = cols.get(node.left.var, node.left.agg)
+    right, right_missing = cols.get(node.right.var, node.right.agg)
+    missing = left_missing | right_missing
+    fn = _ORDER_OPS.get(node.op)
+    if fn is None:
+        # between/in con una feature escalar a la derecha no tienen sentido: no dispara
+        return np.zeros(cols.size, dtype=bool)
+    if left.dtype != object and right.dtype != object:
+        if node.right.scale is not None:
+            right = right * node.right.scale
+        with np.errstate(invalid="ignore"):
+            return fn(left, right) & ~missing
+    scale = node.right.scale
+    out = np.zeros(cols.size, dtype=bool)
+    for i in np.flatnonzero(~missing):
+        try:
+            r = right[i] * scale if scale is not None else right[i]
+            out[i] = bool(fn(left[i], r))
+        except Exception:  # noqa: BLE001
+            out[i] = False
+    return out
+
+
+def eval_node_mask(node: Any, cols: _Columns) -> np.ndarray:
+    if isinstance(node, NumericLeaf):
+        return _numeric_leaf_mask(node, cols)
+    if isinstance(node, RelativeLeaf):
+        return _relative_leaf_mask(node, cols)
+    if isinstance(node, GroupAll):
+        mask = np.ones(cols.size, dtype=bool)
+        for child in node.all:
+            mask &= eval_node_mask(child, cols)
+        return mask
+    if isinstance(node, GroupAny):
+        mask = np.zeros(cols.size, dtype=bool)
+        for child in node.any:
+            mask |= eval_node_mask(child, cols)
+        return mask
+    if isinstance(node, GroupNone):
+        mask = np.zeros(cols.size, dtype=bool)
+        for child in node.none:
+            mask |= eval_node_mask(child, cols)
+        return ~mask
+    return np.zeros(cols.size, dtype=bool)
+
+
+def evaluate_matrix(matrix: pd.DataFrame, rules: Iterable[CompiledRule]) -> pd.DataFrame:
+    """Matriz booleana usuarios × reglas (`fired`) para reglas compiladas válidas.
+
+    `matrix` es la salida de `build_features_all`; las reglas con error de
+    validación se omiten, igual que en `evaluate_user`.
+    """
+    cols = _Columns(matrix)
+    fired: dict[str, np.ndarray] = {}
+    for rule in rules:
+        if rule.model is None:
+            continue
+        fired[rule.rule_id] = eval_node_mask(rule.model.logic, cols)
+    return pd.DataFrame(fired, index=matrix.index, dtype=bool)
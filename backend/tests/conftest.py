@@ -0,0 +1,23 @@
+import pytest
+from sqlalchemy import create_engine
+
+from backend.config import settings
+from backend.rules_engine import persistence
+
+
+@pytest.fixture(scope="session", autouse=True)
+def test_database(tmp_path_factory):
+    """Base de datos SQLite temporal para toda la sesión, en lugar de `./rules.db`.
+
+    `persistence.engine` se crea al importar con `settings.database_url`, pero
+    no abre conexiones hasta usarse: basta con sustituirlo antes del primer test.
+    """
+    url = f"sqlite:///{tmp_path_factory.mktemp('db') / 'rules.db'}"
+    engine = create_engine(url, future=True)
+    patch = pytest.MonkeyPatch()
+    patch.setattr(settings, "database_url", url)
+    patch.setattr(persistence, "engine", engine)
+    persistence.create_all_tables()
+    yield engine
+    patch.undo()
+    engine.dispose()
@@ -0,0 +1,146 @@
+import os
+import uuid
+from datetime import date, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+pytest.importorskip("pyarrow")
+
+from backend.app import app
+from backend.config import settings
+from backend.rules_engine.audit_archive import archive_audits, archive_cutoff, hot_days, read_archived_audits
+from backend.rules_engine.persistence import Audit, FeatureSnapshot, bulk_insert_audits, get_session
+from backend.tests.test_engine_batch import _daily_stats
+
+
+def test_hot_window_never_drops_below_cooldown(monkeypatch):
+    monkeypatch.setattr(settings, "audit_hot_days", 10)
+    monkeypatch.setattr(settings, "audit_hot_days_by_tenant", {"largo": 120})
+    assert hot_days("otro") == 30
+    assert hot_days("largo") == 120
+    assert archive_cutoff("otro", date(2025, 3, 31)) == date(2025, 3, 2)
+
+
+def test_archive_exports_deletes_and_keeps_rollup(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "audit_archive_dir", str(tmp_path / "archive"))
+    monkeypatch.setattr(settings, "audit_hot_days", 30)
+    today = date(2025, 6, 30)
+    cutoff = archive_cutoff("x", today)
+    with TestClient(app) as client:
+        tenant = f"t_{uuid.uuid4().hex[:8]}"
+        days = [cutoff - timedelta(days=2), cutoff - timedelta(days=1), cutoff]
+        rows = []
+        for day in days:
+            snapshot = {"tenant_id": tenant, "user_id": "u1", "date": day, "data_version": "v1",
+                        "values": {"steps": {"mean_7d": 4000.0}}}
+            for rid, fired in (("r1", True), ("r2", False)):
+                rows.append({"tenant_id": tenant, "user_id": "u1", "date": day, "rule_id": rid, "fired": fired,
+                             "discarded_reason": None, "why": {"conditions": []}, "feature_snapshot": snapshot,
+                             "message_id": 7 if fired else None})
+        bulk_insert_audits(rows)
+        stats_before = _daily_stats(tenant)
+
+        report = archive_audits(tenant, today=today, batch_rows=3)[tenant]
+        assert report["archived"] == 4
+        assert report["snapshots_deleted"] == 2
+        assert all(os.path.exists(p) for p in report["files"])
+
+        with get_session() as session:
+            hot = session.query(Audit).filter(Audit.tenant_id == tenant).all()
+            assert {a.date for a in hot} == {cutoff}
+            assert session.query(FeatureSnapshot).filter(FeatureSnapshot.tenant_id == tenant).count() == 1
+        assert _daily_stats(tenant) == stats_before
+
+        cold = read_archived_audits(tenant, end=cutoff - timedelta(days=1), fired=True)
+        assert list(cold["date"]) == days[:2]
+        assert list(cold["rule_id"]) == ["r1", "r1"]
+        assert cold["values"].iloc[0] == '{"steps": {"mean_7d": 4000.0}}'
+
+        # Una segunda ejecución no encuentra nada que archivar
+        assert archive_audits(tenant, today=today)[tenant]["archived"] == 0
+
+        res = client.get("/analytics/audits", params={
+            "start": days[0].isoformat(), "end": cutoff.isoformat(), "tenant_id": tenant, "rule_id": "r1",
+        })
+        body = res.json()
+        assert res.status_code == 200
+        assert [(a["date"], a["archived"]) for a in body["audits"]] == [
+            (cutoff.isoformat(), False), (days[1].isoformat(), True), (days[0].isoformat(), True),
+        ]
+        assert body["audits"][1]["values"] == {"steps": {"mean_7d": 4000.0}}
+        assert body["audits"][1]["message_id"] == 7
+
+
+def test_archive_deletes_only_the_exported_ids(monkeypatch, tmp_path):
+    from backend.rules_engine import audit_archive
+
+    monkeypatch.setattr(settings, "audit_archive_dir", str(tmp_path / "archive"))
+    today = date(2025, 6, 30)
+    old_day = archive_cutoff("x", today) - timedelta(days=1)
+    with TestClient(app):
+        tenant = f"t_{uuid.uuid4().hex[:8]}"
+        row = {"tenant_id": tenant, "date": old_day, "rule_id": "r1", "fired": False, "discarded_reason": None,
+               "why": {"conditions": []}, "message_id": None}
+        bulk_insert_audits([{**row, "user_id": f"u{i}"} for i in range(3)])
+        with get_session() as session:
+            ids = [a.id for a in session.query(Audit).filter(Audit.tenant_id == tenant).order_by(Audit.id)]
+            # Hueco en medio del rango, como el de una transacción concurrente aún sin confirmar
+            session.query(Audit).filter(Audit.id == ids[1]).delete()
+            session.commit()
+
+        real = audit_archive._write_partition
+
+        def write_then_late_insert(root, tenant_id, day, rows):
+            path = real(root, tenant_id, day, rows)
+            with get_session() as session:
+                session.add(Audit(id=ids[1], user_id="late", **row))
+                session.commit()
+            return path
+
+        monkeypatch.setattr(audit_archive, "_write_partition", write_then_late_insert)
+        assert archive_audits(tenant, today=today)[tenant]["archived"] == 2
+        with get_session() as session:
+            assert [a.user_id for a in session.query(Audit).filter(Audit.tenant_id == tenant)] == ["late"]
+
+
+def test_rerun_after_a_crash_with_other_batch_limits_keeps_one_copy_per_id(monkeypatch, tmp_path):
+    import pyarrow.parquet as pq
+
+    from backend.rules_engine import audit_archive
+    from backend.rules_engine.audit_archive import query_audits
+
+    root = tmp_path / "archive"
+    monkeypatch.setattr(settings, "audit_archive_dir", str(root))
+    today = date(2025, 6, 30)
+    old_day = archive_cutoff("x", today) - timedelta(days=1)
+    with TestClient(app):
+        tenant = f"t_{uuid.uuid4().hex[:8]}"
+        row = {"tenant_id": tenant, "date": old_day, "rule_id": "r1", "fired": False, "discarded_reason": None,
+               "why": {"conditions": []}, "message_id": None}
+        bulk_insert_audits([{**row, "user_id": f"u{i}"} for i in range(3)])
+
+        # Caída después de escribir el fichero y antes de borrar de `audits`
+        def crash(*args, **kwargs):
+            raise RuntimeError("caída")
+
+        with monkeypatch.context() as m:
+            m.setattr(audit_archive, "delete", crash)
+            with pytest.raises(RuntimeError):
+                archive_audits(tenant, today=today, batch_rows=3)
+
+        # Filas nuevas del mismo día antes de reejecutar, con otro tamaño de lote
+        bulk_insert_audits([{**row, "user_id": f"u{i}"} for i in range(3, 5)])
+        assert archive_audits(tenant, today=today, batch_rows=2)[tenant]["archived"] == 5
+
+        partition = next(root.glob(f"tenant_id={tenant}/date={old_day.isoformat()}"))
+        on_disk = [i for f in sorted(partition.glob("*.parquet")) for i in pq.read_table(f, columns=["id"])["id"].to_pylist()]
+        assert len(on_disk) == len(set(on_disk)) == 5
+        cold = read_archived_audits(tenant)
+        assert sorted(cold["user_id"]) == [f"u{i}" for i in range(5)]
+
+        # `limit` y los ids ya devueltos por la tabla caliente se aplican en el escaneo
+        newest = read_archived_audits(tenant, limit=2)
+        assert list(newest["id"]) == sorted(on_disk)[-2:]
+        assert list(read_archived_audits(tenant, exclude_ids=sorted(on_disk)[1:])["id"]) == sorted(on_disk)[:1]
+        assert [a["id"] for a in query_audits(tenant, old_day, old_day, limit=3)] == sorted(on_disk, reverse=True)[:3]
@@ -0,0 +1,99 @@
+import uuid
+from datetime import date
+
+from fastapi.testclient import TestClient
+
+from backend.app import app
+from backend.rules_engine.audit_writer import AuditWriter
+from backend.rules_engine.persistence import Audit, get_session
+
+
+def _row(tenant, user_id, fired=True, reason=None):
+    return {"tenant_id": tenant, "user_id": user_id, "date": date(2025, 2, 5), "rule_id": "r", "fired": fired,
+            "discarded_reason": reason, "why": {"conditions": []}, "values": {}, "message_id": 7}
+
+
+def _stored(tenant):
+    with get_session() as session:
+        return session.query(Audit).filter(Audit.tenant_id == tenant).count()
+
+
+def test_audit_writer_pending_rows_backpressure_and_shutdown_flush():
+    with TestClient(app):
+        tenant = f"t_{uuid.uuid4().hex[:8]}"
+        # Intervalo largo: las filas se quedan en cola hasta flush/stop
+        writer = AuditWriter(max_rows=2, flush_rows=100, flush_interval=60.0, enqueue_timeout=0.01)
+        writer.start()
+        try:
+            assert writer.submit([_row(tenant, "u1"), _row(tenant, "u2", reason="cooldown")])
+            assert writer.pending_fires(tenant, ["u1", "u2"], ["r"], date(2025, 2, 1)) == [("u1", "r", date(2025, 2, 5), 7)]
+            assert writer.pending_fires("otro", ["u1"], ["r"], date(2025, 2, 1)) == []
+            # Cola llena: se escribe en el hilo del llamador en lugar de descartarse
+            assert not writer.submit([_row(tenant, "u3")])
+            assert _stored(tenant) == 1
+            assert writer.stats()["sync_writes"] == 1 and writer.stats()["queue_depth"] == 2
+
+            assert writer.flush(timeout=5)
+            assert _stored(tenant) == 3
+            assert writer.pending_fires(tenant, ["u1"], ["r"], date(2025, 2, 1)) == []
+
+            assert writer.submit([_row(tenant, "u4")])
+        finally:
+            writer.stop()
+        assert _stored(tenant) == 4
+        stats = writer.stats()
+        assert not stats["running"] and stats["written"] == 4 and stats["queue_depth"] == 0
+
+
+def test_audit_writer_retries_and_never_gives_up_on_delivered_fires(monkeypatch):
+    from backend.config import settings
+    from backend.rules_engine import audit_writer as audit_writer_module
+
+    with TestClient(app):
+        tenant = f"t_{uuid.uuid4().hex[:8]}"
+        real = audit_writer_module.bulk_insert_audits
+        failures = {"left": 4}
+
+        def flaky(rows, commit_rows=None):
+            if failures["left"] > 0:
+                failures["left"] -= 1
+                raise RuntimeError("database is locked")
+            return real(rows, commit_rows=commit_rows)
+
+        monkeypatch.setattr(audit_writer_module, "bulk_insert_audits", flaky)
+        monkeypatch.setattr(settings, "audit_write_retries", 2)
+        writer = AuditWriter(max_rows=10, flush_rows=10, flush_interval=0.0)
+        writer.start()
+        try:
+            assert writer.submit([_row(tenant, "u1"), _row(tenant, "u2", fired=False)])
+            assert writer.flush(timeout=10)
+        finally:
+            writer.stop()
+        # Tras 3 intentos se abandona la fila no disparada; el disparo se reintenta hasta escribirse
+        stats = writer.stats()
+        assert stats["retries"] == 4 and stats["failed"] == 1 and stats["written"] == 1
+        assert _stored(tenant) == 1
+        assert writer.pending_fires(tenant, ["u1"], ["r"], date(2025, 2, 1)) == []
+
+
+def test_fire_history_reads_the_queue_before_the_database(monkeypatch):
+    from backend.rules_engine import engine
+
+    calls = []
+    fire = ("u1", "r", date(2025, 2, 5), 7)
+
+    def pending_fires(tenant_id, user_ids, rule_ids, since):
+        calls.append("queue")
+        return [fire]
+
+    def load_fire_state(tenant_id, user_ids, chunk=500):
+        # El escritor confirmó el bloque entre las dos lecturas: también está en la base de datos
+        calls.append("db")
+        return {("u1", "r"): date(2025, 2, 5)}
+
+    monkeypatch.setattr(engine.audit_writer, "pending_fires", pending_fires)
+    monkeypatch.setattr(engine, "load_fire_state", load_fire_state)
+    history = engine.FireHistory.load("t", ["u1"], ["r"])
+    assert calls == ["queue", "db"]
+    assert history.fired_since("u1", "r", date(2025, 2, 5))
+    assert history._messages[("u1", "r")] == [(date(2025, 2, 5), 7)]
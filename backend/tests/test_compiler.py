@@ -0,0 +1,63 @@
+import random
+
+from backend.rules_engine.compiler import CompiledRuleCache, compile_node
+from backend.rules_engine.dsl import RuleModel
+from backend.rules_engine.engine import eval_node
+from backend.rules_engine.persistence import Rule
+
+
+LOGIC = {
+    "any": [
+        {"all": [
+            {"var": "steps", "agg": "mean_7d", "op": "<", "value": 5000},
+            {"var": "sleep", "agg": "current", "op": "between", "value": [5, 7], "required": True},
+        ]},
+        {"none": [{"var": "device", "op": "in", "value": ["garmin", "fitbit"]}]},
+        {"left": {"var": "steps", "agg": "current"}, "op": ">=", "right": {"var": "steps", "agg": "mean_14d", "scale": 1.2}},
+        {"var": "hr", "op": "in", "value": [[1], [2]]},
+    ]
+}
+
+
+def _model(logic):
+    return RuleModel(id="r", category="c", logic=logic, messages={"candidates": [{"text": "x"}]})
+
+
+def test_compiled_predicate_matches_eval_node():
+    model = _model(LOGIC)
+    predicate = compile_node(model.logic)
+    rng = random.Random(7)
+    for _ in range(300):
+        feats = {
+            "steps": {
+                "mean_7d": rng.choice([None, 3000.0, 8000.0]),
+                "current": rng.choice([None, 4000, 9000.5]),
+                "mean_14d": rng.choice([None, 4000.0, 7000.0]),
+            },
+            "sleep": {"current": rng.choice([None, 4.0, 6.0, 7.0])},
+            "device": {"current": rng.choice([None, "garmin", "apple"])},
+            "hr": {"current": rng.choice([None, [1], 3])},
+        }
+        expected_why, got_why = [], []
+        assert predicate(feats, got_why) == eval_node(model.logic, feats, expected_why)
+        assert got_why == expected_why
+
+
+def test_compiled_rule_cache_by_version():
+    cache = CompiledRuleCache()
+    rule = Rule(id="r1", version=1, category="c", priority=50, severity=1, cooldown_days=0, max_per_day=0,
+                enabled=True, tenant_id="default", logic={"var": "steps", "op": "<", "value": 10}, locale="es-ES")
+    first = cache.get(rule)
+    assert first.ok and first.required == {("steps", "current")}
+    assert cache.get(rule) is first
+
+    rule.logic = {"var": "steps", "op": ">", "value": 10}
+    rule.version = 2
+    second = cache.get(rule)
+    assert second is not first
+    assert second.evaluate({"steps": {"current": 20}}, [])
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2}
+
+    rule.logic = {"var": "steps", "op": "~", "value": 1}
+    rule.version = 3
+    assert cache.get(rule).error
@@ -0,0 +1,33 @@
+import os
+
+from backend.rules_engine.features import dataset_cache, load_base_dataframe
+
+
+def _write_processed(path, rows):
+    lines = ["user_id,date,steps"] + [f"{u},{d},{s}" for u, d, s in rows]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_dataset_cache_reloads_only_on_file_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    csv_path = tmp_path / "data" / "daily_processed.csv"
+    _write_processed(csv_path, [("u1", "2025-01-01", 100)])
+    dataset_cache.invalidate()
+    before = dataset_cache.stats()
+
+    first = load_base_dataframe()
+    second = load_base_dataframe()
+    assert first is second
+    stats = dataset_cache.stats()
+    assert stats["misses"] == before["misses"] + 1
+    assert stats["hits"] == before["hits"] + 1
+
+    _write_processed(csv_path, [("u1", "2025-01-01", 100), ("u1", "2025-01-02", 200)])
+    third = load_base_dataframe()
+    assert third is not first
+    assert len(third) == 2
+
+    dataset_cache.invalidate()
+    assert load_base_dataframe() is not third
+    assert dataset_cache.stats()["misses"] == before["misses"] + 3
@@ -0,0 +1,381 @@
+import random
+import uuid
+from datetime import date
+
+from fastapi.testclient import TestClient
+
+from backend.app import app
+from backend.config import settings
+from backend.rules_engine import engine
+from backend.rules_engine.audit_writer import audit_writer
+from backend.rules_engine.engine import evaluate_user, evaluate_users
+from backend.rules_engine.persistence import (
+    Audit,
+    FeatureSnapshot,
+    RuleDailyStats,
+    RuleFireState,
+    bulk_insert_audits,
+    get_session,
+    rebuild_rule_daily_stats,
+    sample_fraction,
+)
+from backend.tests.test_features import _sample_frame
+
+
+def _rules(tenant):
+    return [
+        {
+            "id": f"steps_{tenant}",
+            "tenant_id": tenant,
+            "category": "actividad",
+            "priority": 70,
+            "logic": {"var": "steps", "agg": "mean_7d", "op": "<", "value": 9000},
+            "messages": {"candidates": [
+                {"text": "Media de {{steps:mean_7d:.0f}} pasos", "weight": 2},
+                {"text": "Muévete un poco más"},
+            ]},
+        },
+        {
+            "id": f"acwr_{tenant}",
+            "tenant_id": tenant,
+            "category": "actividad",
+            "priority": 60,
+            "logic": {"var": "acwr", "op": ">", "value": 0.9},
+            "messages": {"candidates": [{"text": "Carga {{acwr:current:.2f}}"}]},
+        },
+        {
+            "id": f"hr_{tenant}",
+            "tenant_id": tenant,
+            "category": "cardio",
+            "cooldown_days": 3,
+            "logic": {"var": "max_hr_pct_user_max", "op": ">=", "value": 0.8},
+            "messages": {"candidates": [{"text": "Pulso alto"}]},
+        },
+    ]
+
+
+def _audits(tenant):
+    audit_writer.flush()
+    with get_session() as session:
+        return session.query(Audit).filter(Audit.tenant_id == tenant).order_by(Audit.id).all()
+
+
+def _clear_audits(tenant):
+    audit_writer.flush()
+    with get_session() as session:
+        session.query(Audit).filter(Audit.tenant_id == tenant).delete()
+        session.query(RuleFireState).filter(RuleFireState.tenant_id == tenant).delete()
+        session.commit()
+
+
+def _setup(client, monkeypatch):
+    tenant = f"t_{uuid.uuid4().hex[:8]}"
+    for rule in _rules(tenant):
+        assert client.post("/rules", json={"rule": rule}).status_code == 200
+    df = _sample_frame(n_users=6, n_days=40)
+    df["max_heart_rate_bpm"] = 180.0
+    monkeypatch.setattr(engine, "load_base_dataframe", lambda **_: df)
+    return tenant, sorted(df["user_id"].unique())
+
+
+def _summary(events):
+    return [(e.rule_id, e.message_id, e.message_text) for e in events]
+
+
+def test_evaluate_users_matches_per_user_calls(monkeypatch):
+    with TestClient(app) as client:
+        tenant, users = _setup(client, monkeypatch)
+        monkeypatch.setattr(settings, "engine_early_termination", False)
+        day = date(2025, 2, 5)
+
+        random.seed(11)
+        batch = evaluate_users(users, day, tenant_id=tenant)
+        batch_audits = [(a.user_id, a.rule_id, a.fired, a.discarded_reason, a.message_id) for a in _audits(tenant)]
+        _clear_audits(tenant)
+
+        random.seed(11)
+        single = {uid: evaluate_user(uid, day, tenant_id=tenant) for uid in users}
+        single_audits = [(a.user_id, a.rule_id, a.fired, a.discarded_reason, a.message_id) for a in _audits(tenant)]
+
+        assert list(batch) == users
+        assert {u: _summary(e) for u, e in batch.items()} == {u: _summary(e) for u, e in single.items()}
+        assert batch_audits == single_audits
+        assert len(batch_audits) == len(users) * 3
+        assert any(reason == "category_cap" for *_, reason, _ in batch_audits)
+        # Solo los eventos entregados tienen mensaje
+        assert all((mid is not None) == (fired and reason is None) for _, _, fired, reason, mid in batch_audits)
+
+        resp = client.post("/simulate/batch", json={"user_ids": users[:2], "date": "2025-02-05", "tenant_id": tenant})
+        assert resp.status_code == 200
+        assert [u["user_id"] for u in resp.json()["users"]] == users[:2]
+
+
+def test_early_termination_delivers_the_same_events(monkeypatch):
+    with TestClient(app) as client:
+        tenant, users = _setup(client, monkeypatch)
+        day = date(2025, 2, 5)
+
+        monkeypatch.setattr(settings, "engine_early_termination", False)
+        random.seed(5)
+        full = evaluate_users(users, day, tenant_id=tenant)
+        full_audits = _audits(tenant)
+        _clear_audits(tenant)
+
+        monkeypatch.setattr(settings, "engine_early_termination", True)
+        random.seed(5)
+        early = evaluate_users(users, day, tenant_id=tenant)
+        early_audits = _audits(tenant)
+
+        ids = lambda res: {u: [e.rule_id for e in events] for u, events in res.items()}
+        # El mensaje se elige después de resolver: mismo consumo de aleatoriedad en ambos modos
+        assert {u: _summary(e) for u, e in early.items()} == {u: _summary(e) for u, e in full.items()}
+        # La categoría ya cubierta no se traza: deja una auditoría mínima con el resultado real,
+        # así que los conteos de auditorías y de disparos cuadran
+        assert len(early_audits) == len(full_audits)
+        skipped = [a for a in early_audits if a.discarded_reason == "budget_exhausted"]
+        assert skipped and all(a.why is None and a.feature_snapshot_id is None for a in skipped)
+        assert all(a.discarded_reason in (None, "budget_exhausted") for a in early_audits)
+        fired = lambda audits: {(a.user_id, a.rule_id) for a in audits if a.fired}
+        assert fired(early_audits) == fired(full_audits)
+        assert {(a.user_id, a.rule_id) for a in early_audits if a.fired and a.discarded_reason is None} == {
+            (u, r) for u, rules in ids(full).items() for r in rules
+        }
+
+        # Con el presupuesto diario cubierto se deja de evaluar
+        _clear_audits(tenant)
+        monkeypatch.setattr(settings, "max_recs_per_day", 1)
+        capped = evaluate_users(users, day, tenant_id=tenant)
+        assert all(len(events) <= 1 for events in capped.values())
+        per_user = {}
+        for a in _audits(tenant):
+            if a.discarded_reason != "budget_exhausted":
+                per_user.setdefault(a.user_id, []).append(a.rule_id)
+        for uid, rules in ids(capped).items():
+            if rules:
+                assert per_user[uid][-1] == rules[0]
+
+
+def test_early_termination_checks_cooldown_before_the_budget(monkeypatch):
+    with TestClient(app) as client:
+        tenant, users = _setup(client, monkeypatch)
+        hr_rule = f"hr_{tenant}"
+        monkeypatch.setattr(settings, "engine_early_termination", False)
+        evaluate_users(users, date(2025, 2, 4), tenant_id=tenant)
+
+        # Con un solo evento al día, la regla de pulso (menor prioridad) llega con el presupuesto cubierto
+        monkeypatch.setattr(settings, "max_recs_per_day", 1)
+        runs = {}
+        for early_stop in (False, True):
+            monkeypatch.setattr(settings, "engine_early_termination", early_stop)
+            before = len(_audits(tenant))
+            evaluate_users(users, date(2025, 2, 5), tenant_id=tenant)
+            runs[early_stop] = {(a.user_id, a.rule_id): (a.fired, a.discarded_reason) for a in _audits(tenant)[before:]}
+
+        in_cooldown = {key for key, (_, reason) in runs[False].items() if reason == "cooldown"}
+        assert in_cooldown and all(key[1] == hr_rule for key in in_cooldown)
+        assert {key for key, (_, reason) in runs[True].items() if reason == "cooldown"} == in_cooldown
+        assert any(runs[True][(uid, rule)][1] == "budget_exhausted" for uid, rule in runs[True] if rule != hr_rule)
+        assert {key: fired for key, (fired, _) in runs[True].items()} == {key: fired for key, (fired, _) in runs[False].items()}
+
+
+def test_cooldown_uses_history_before_the_evaluation(monkeypatch):
+    with TestClient(app) as client:
+        tenant, users = _setup(client, monkeypatch)
+        uid = users[0]
+        hr_rule = f"hr_{tenant}"
+
+        first = evaluate_user(uid, date(2025, 2, 5), tenant_id=tenant)
+        assert hr_rule in [e.rule_id for e in first]
+
+        second = evaluate_user(uid, date(2025, 2, 6), tenant_id=tenant)
+        assert hr_rule not in [e.rule_id for e in second]
+        last = [a for a in _audits(tenant) if a.rule_id == hr_rule][-1]
+        # Descartada antes de evaluar: sin predicado ni mensaje
+        assert not last.fired and last.discarded_reason == "cooldown"
+        assert last.message_id is None and last.why == {"conditions": []}
+        with get_session() as session:
+            state = session.get(RuleFireState, (tenant, uid, hr_rule))
+        assert state.last_fired_date == date(2025, 2, 5)
+
+        # Un disparo de un día anterior (backfill) no retrasa el último disparo
+        bulk_insert_audits([{"tenant_id": tenant, "user_id": uid, "date": date(2025, 1, 20), "rule_id": hr_rule,
+                             "fired": True, "discarded_reason": None, "why": {}, "values": {}, "message_id": None}])
+        with get_session() as session:
+            assert session.get(RuleFireState, (tenant, uid, hr_rule)).last_fired_date == date(2025, 2, 5)
+
+
+def test_audits_share_one_feature_snapshot_per_evaluation(monkeypatch):
+    with TestClient(app) as client:
+        tenant, users = _setup(client, monkeypatch)
+        uid = users[0]
+        day = date(2025, 2, 5)
+        monkeypatch.setattr(settings, "engine_early_termination", False)
+
+        evaluate_user(uid, day, tenant_id=tenant)
+        audits = _audits(tenant)
+        assert len(audits) == 3
+        assert all(a.values is None for a in audits)
+        assert len({a.feature_snapshot_id for a in audits}) == 1
+        with get_session() as session:
+            snapshot = session.get(FeatureSnapshot, audits[0].feature_snapshot_id)
+        # Fuera de debug solo las features que usan las reglas
+        assert {"steps", "acwr", "max_hr_pct_user_max"} <= set(snapshot.values)
+
+        # Debug: `values` una vez para toda la evaluación y el snapshot existente se completa
+        events, debug = evaluate_user(uid, day, tenant_id=tenant, debug=True)
+        assert all("values" not in entry for entry in debug["rules"])
+        assert {a.feature_snapshot_id for a in _audits(tenant)} == {snapshot.id}
+        with get_session() as session:
+            stored = session.get(FeatureSnapshot, snapshot.id).values
+        assert stored == debug["values"] and stored != snapshot.values
+
+
+def _daily_stats(tenant):
+    with get_session() as session:
+        rows = session.query(RuleDailyStats).filter(RuleDailyStats.tenant_id == tenant).all()
+        return {
+            (r.rule_id, r.date): (r.fired_count, r.evaluated_count, r.distinct_users, r.per_message_counts)
+            for r in rows
+        }
+
+
+def test_rule_daily_stats_follow_audit_writes(monkeypatch):
+    with TestClient(app) as client:
+        tenant, users = _setup(client, monkeypatch)
+        day = date(2025, 2, 5)
+        monkeypatch.setattr(settings, "engine_early_termination", False)
+
+        evaluate_users(users, day, tenant_id=tenant)
+        audits = _audits(tenant)
+        first = _daily_stats(tenant)
+        steps = f"steps_{tenant}"
+        fired = [a for a in audits if a.rule_id == steps and a.fired]
+        assert first[(steps, day)][:3] == (len(fired), len(users), len(fired))
+        assert sum(first[(steps, day)][3].values()) == len(fired)
+
+        # Re-evaluar el mismo día suma evaluaciones pero no usuarios distintos
+        evaluate_users(users, day, tenant_id=tenant)
+        audit_writer.flush()
+        second = _daily_stats(tenant)
+        assert second[(steps, day)][1] == 2 * len(users)
+        assert {k: v[2] for k, v in second.items()} == {k: v[2] for k, v in first.items()}
+
+        # El incremental coincide con recalcular desde audits
+        rebuild_rule_daily_stats(tenant_id=tenant)
+        assert _daily_stats(tenant) == second
+
+        series = client.get("/analytics/triggers", params={"start": "2025-02-04", "end": "2025-02-05", "tenant_id": tenant})
+        points = {s["rule_id"]: [p["count"] for p in s["points"]] for s in series.json()["series"]}
+        assert points[steps] == [0, second[(steps, day)][0]]
+        stats = client.get(f"/rules/{steps}/stats").json()
+        assert stats["fires"] == second[(steps, day)][0]
+        assert stats["by_message"] == second[(steps, day)][3]
+
+
+def test_bulk_insert_audits_commits_in_blocks():
+    with TestClient(app):
+        tenant = f"t_{uuid.uuid4().hex[:8]}"
+        rows = [
+            {"tenant_id": tenant, "user_id": f"u{i}", "date": date(2025, 2, 5), "rule_id": "r", "fired": i % 2 == 0,
+             "discarded_reason": None, "why": {"conditions": []}, "values": {}, "message_id": None}
+            for i in range(5)
+        ]
+        assert bulk_insert_audits(rows, commit_rows=2) == 5
+        stored = _audits(tenant)
+        assert [a.user_id for a in stored] == [f"u{i}" for i in range(5)]
+        assert all(a.created_at is not None for a in stored)
+
+
+def test_audit_policy_keeps_fires_and_samples_by_user(monkeypatch):
+    with TestClient(app) as client:
+        tenant = f"t_{uuid.uuid4().hex[:8]}"
+        day = date(2025, 2, 5)
+        users = [f"u{i}" for i in range(200)]
+        rows = [
+            {"tenant_id": tenant, "user_id": u, "date": day, "rule_id": "r", "fired": i % 10 == 0,
+             "discarded_reason": "cooldown" if i % 10 == 1 else None, "why": {"conditions": []}, "message_id": None}
+            for i, u in enumerate(users)
+        ]
+        monkeypatch.setattr(settings, "audit_policy_by_tenant", {tenant: "sampled"})
+        monkeypatch.setattr(settings, "audit_sample_rate", 0.25)
+        bulk_insert_audits(rows)
+
+        stored = _audits(tenant)
+        sampled = {u for u in users if sample_fraction(tenant, u) < 0.25}
+        kept = [r for r in rows if r["fired"] or r["discarded_reason"] or r["user_id"] in sampled]
+        assert [a.user_id for a in stored] == [r["user_id"] for r in kept]
+        assert {a.sample_weight for a in stored if not a.fired and not a.discarded_reason} == {4.0}
+        assert 0 < len(stored) < len(rows)
+
+        # El resumen cuenta todas las evaluaciones; recalcularlo desde audits las estima con los pesos
+        assert _daily_stats(tenant)[("r", day)][1] == len(rows)
+        assert client.get("/rules/r/stats").json()["evaluations"] >= len(rows)
+        rebuild_rule_daily_stats(tenant_id=tenant)
+        estimate = _daily_stats(tenant)[("r", day)][1]
+        assert estimate == round(sum(a.sample_weight for a in stored))
+        assert abs(estimate - len(rows)) < 0.25 * len(rows)
+
+        # fired_only: solo disparos y descartes, también para días siguientes
+        monkeypatch.setattr(settings, "audit_policy_by_tenant", {tenant: "fired_only"})
+        bulk_insert_audits([{**r, "date": date(2025, 2, 6)} for r in rows])
+        next_day = [a for a in _audits(tenant) if a.date == date(2025, 2, 6)]
+        assert len(next_day) == sum(1 for r in rows if r["fired"] or r["discarded_reason"])
+
+
+
+def test_fired_only_batch_skips_tracing_rules_that_do_not_fire(monkeypatch):
+    with TestClient(app) as client:
+        tenant, users = _setup(client, monkeypatch)
+        day = date(2025, 2, 5)
+        monkeypatch.setattr(settings, "engine_early_termination", False)
+        key = lambda a: (a.user_id, a.rule_id, a.fired, a.discarded_reason, a.message_id)
+
+        random.seed(3)
+        full = evaluate_users(users, day, tenant_id=tenant)
+        kept = [key(a) for a in _audits(tenant) if a.fired or a.discarded_reason]
+        _clear_audits(tenant)
+
+        masks = []
+        real = engine.evaluate_matrix
+        monkeypatch.setattr(engine, "evaluate_matrix", lambda *a: masks.append(real(*a)) or masks[-1])
+        monkeypatch.setattr(settings, "audit_policy_by_tenant", {tenant: "fired_only"})
+        random.seed(3)
+        fired_only = evaluate_users(users, day, tenant_id=tenant)
+
+        assert len(masks) == 1 and not masks[0].all(axis=None)
+        assert {u: _summary(e) for u, e in fired_only.items()} == {u: _summary(e) for u, e in full.items()}
+        assert [key(a) for a in _audits(tenant)] == kept
+        # Las no trazadas no se guardan, pero cuentan como evaluaciones en el resumen diario (dos pasadas)
+        assert sum(v[1] for v in _daily_stats(tenant).values()) == 2 * len(users) * 3
+
+
+def test_batch_matches_single_user_on_constant_and_nan_windows(monkeypatch):
+    from backend.tests.test_features import _constant_frame
+
+    with TestClient(app) as client:
+        tenant = f"t_{uuid.uuid4().hex[:8]}"
+        rules = [
+            ("z", {"var": "steps", "agg": "zscore_28d", "op": ">=", "value": 0.5}),
+            ("z_neg", {"var": "acwr", "agg": "zscore_28d", "op": "<=", "value": -0.5}),
+            ("flat", {"var": "steps", "agg": "zscore_28d", "op": "==", "value": 0}),
+            ("delta", {"var": "steps", "agg": "delta_pct_3v14", "op": "<", "value": 0}),
+        ]
+        for rid, logic in rules:
+            rule = {"id": f"{rid}_{tenant}", "tenant_id": tenant, "category": rid, "logic": logic,
+                    "messages": {"candidates": [{"text": rid}]}}
+            assert client.post("/rules", json={"rule": rule}).status_code == 200
+        df = _constant_frame()
+        monkeypatch.setattr(engine, "load_base_dataframe", lambda **_: df)
+        monkeypatch.setattr(settings, "engine_early_termination", False)
+        users = sorted(df["user_id"].unique())
+        day = date(2025, 2, 4)
+        key = lambda a: (a.user_id, a.rule_id, a.fired, a.discarded_reason)
+
+        batch = evaluate_users(users, day, tenant_id=tenant)
+        batch_audits = [key(a) for a in _audits(tenant)]
+        _clear_audits(tenant)
+        single = {uid: evaluate_user(uid, day, tenant_id=tenant) for uid in users}
+
+        assert {u: _summary(e) for u, e in batch.items()} == {u: _summary(e) for u, e in single.items()}
+        assert batch_audits == [key(a) for a in _audits(tenant)]
+        assert any(f"flat_{tenant}" in [e.rule_id for e in events] for events in batch.values())
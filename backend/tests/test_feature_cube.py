@@ -0,0 +1,41 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from backend.rules_engine.feature_cube import FeatureCube, write_feature_cube
+from backend.rules_engine.features import build_features_all
+
+from backend.tests.test_features import _sample_frame
+
+
+def test_cube_aggregates_match_feature_matrix(tmp_path):
+    df = _sample_frame(n_users=5, n_days=60)
+    # Filas repetidas del mismo (user_id, date): build_features las cuenta como filas distintas
+    user2 = df[df["user_id"] == "user-2"]
+    near = user2["date"].between("2025-01-05", "2025-01-09") | user2["date"].between("2025-02-15", "2025-02-19")
+    dups = user2[near].assign(steps=123.0)
+    assert len(dups) >= 4
+    df = pd.concat([df, dups, dups.assign(steps=456.0)], ignore_index=True)
+    write_feature_cube(df, str(tmp_path))
+    cube = FeatureCube.open(str(tmp_path))
+
+    for target in (date(2025, 1, 10), date(2025, 2, 20)):
+        expected = build_features_all(df, target)
+        got = cube.aggregate(target, chunk_size=2)
+        assert sorted(got.index) == sorted(expected.index)
+        assert ("max_hr_pct_user_max", "current") in got.columns
+        exp = expected.loc[got.index, got.columns].astype(float)
+        np.testing.assert_array_equal(got.to_numpy(), exp.to_numpy())
+
+
+def test_cube_user_window_is_last_rows(tmp_path):
+    df = _sample_frame(n_users=2, n_days=40)
+    write_feature_cube(df, str(tmp_path))
+    cube = FeatureCube.open(str(tmp_path))
+    target = date(2025, 1, 31)
+
+    rows = df[(df["user_id"] == "user-1") & (df["date"] <= pd.Timestamp(target))].sort_values("date").tail(7)
+    window = cube.user_window("user-1", target, 7)
+    steps = window[:, cube.variable_position("steps")]
+    assert np.allclose(steps, rows["steps"].to_numpy(), equal_nan=True)
@@ -0,0 +1,131 @@
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+from backend.config import settings
+from backend.rules_engine.feature_state import DatasetFeatureState, FeatureStateStore
+from backend.rules_engine.features import UserRowIndex, build_features, compact_dataframe, dataset_cache
+
+from backend.tests.test_features import _sample_frame
+
+
+def _assert_same_features(got, expected):
+    for var, aggs in expected.items():
+        for agg, value in aggs.items():
+            observed = got.get(var, {}).get(agg)
+            if value is None:
+                assert observed is None, (var, agg)
+            else:
+                assert observed == pytest.approx(value, rel=1e-9, abs=1e-12), (var, agg)
+
+
+def test_incremental_state_matches_full_rescan():
+    df = _sample_frame(n_users=3, n_days=50).sort_values(["user_id", "date"]).reset_index(drop=True)
+    history = df[df["date"] < pd.Timestamp("2025-02-10")]
+    new_days = df[df["date"] >= pd.Timestamp("2025-02-10")]
+
+    store = FeatureStateStore()
+    assert store.seed_from_dataframe(history) == 3
+
+    for _, row in new_days.iterrows():
+        uid = row["user_id"]
+        store.upsert(uid, row["date"].date(), row.to_dict())
+        _assert_same_features(store.features(uid), build_features(df, row["date"].date(), uid))
+
+
+def test_replacing_a_day_recomputes_windows():
+    df = _sample_frame(n_users=1, n_days=30).sort_values("date").reset_index(drop=True)
+    store = FeatureStateStore()
+    store.seed_from_dataframe(df)
+    last = df.iloc[-1]
+    store.upsert("user-0", last["date"].date(), {**last.to_dict(), "steps": 123456.0})
+
+    patched = df.copy()
+    patched.loc[patched.index[-1], "steps"] = 123456.0
+    _assert_same_features(store.features("user-0"), build_features(patched, last["date"].date(), "user-0"))
+    assert store.features("user-0")["steps"]["current"] == 123456.0
+
+
+def test_features_are_a_copy_and_upsert_restores_compact_values():
+    df = _sample_frame(n_users=1, n_days=30).sort_values("date").reset_index(drop=True)
+    df["steps"] = df["steps"].round()
+    df["acwr"] = df["acwr"].round(2)
+    compact = compact_dataframe(df.copy(), {"acwr": {"decimals": 2, "valid_min": 0, "valid_max": 2.5}})
+    store = FeatureStateStore()
+    store.seed_from_dataframe(compact.iloc[:-1])
+
+    last = compact.iloc[-1]
+    store.upsert("user-0", last["date"].date(), last.to_dict(), source=compact)
+    feats = store.features("user-0")
+    assert type(feats["steps"]["current"]) is float
+    assert feats["acwr"]["current"] == df["acwr"].iloc[-1]
+
+    feats["steps"]["current"] = -1
+    assert store.features("user-0")["steps"]["current"] != -1
+
+
+def test_dataset_state_serves_the_cached_frame_only(monkeypatch):
+    df = _sample_frame(n_users=3, n_days=40)
+    index = UserRowIndex(df)
+    monkeypatch.setattr(dataset_cache, "_index", index)
+    state = DatasetFeatureState()
+    last_day = index.rows("user-1", None)["date"].iloc[-1].date()
+
+    got = state.features(index.frame, "user-1", last_day, "v1")
+    _assert_same_features(got, build_features(index.frame, last_day, "user-1"))
+    # Días anteriores al último, usuarios sin datos o un DataFrame que no es el cacheado: build_features
+    assert state.features(index.frame, "user-1", last_day - timedelta(days=1), "v1") is None
+    assert state.features(index.frame, "missing", last_day, "v1") is None
+    assert state.features(df.copy(), "user-1", last_day, "v1") is None
+
+    # Otra versión de datos: el usuario se pone al día con sus filas actuales
+    patched = index.frame.copy()
+    patched.loc[patched["user_id"] == "user-1", "steps"] = 42.0
+    patched_index = UserRowIndex(patched)
+    monkeypatch.setattr(dataset_cache, "_index", patched_index)
+    assert state.features(patched_index.frame, "user-1", last_day, "v2")["steps"]["current"] == 42.0
+
+
+def test_new_data_version_upserts_only_new_and_changed_rows(monkeypatch):
+    df = _sample_frame(n_users=2, n_days=40)
+    full = UserRowIndex(df).frame
+    user = full[full["user_id"] == "user-1"]
+    last_day = user["date"].iloc[-1].date()
+    old = full.drop(index=user.index[-1])
+    old.loc[user.index[-3], "steps"] = 1.0
+
+    state = DatasetFeatureState()
+    old_index = UserRowIndex(old)
+    monkeypatch.setattr(dataset_cache, "_index", old_index)
+    state.features(old_index.frame, "user-1", last_day, "v1")
+
+    applied = []
+    real = FeatureStateStore.upsert
+    monkeypatch.setattr(FeatureStateStore, "upsert", lambda self, uid, day, *a, **k: applied.append(day) or real(self, uid, day, *a, **k))
+    new_index = UserRowIndex(full)
+    monkeypatch.setattr(dataset_cache, "_index", new_index)
+    got = state.features(new_index.frame, "user-1", last_day, "v2")
+
+    # El día añadido y el día corregido; el resto de la ventana no se toca
+    assert sorted(applied) == sorted([last_day, user["date"].iloc[-3].date()])
+    assert got == build_features(new_index.frame, last_day, "user-1")
+
+
+def test_state_keeps_required_columns_only_and_is_bounded(monkeypatch):
+    df = _sample_frame(n_users=3, n_days=40)
+    index = UserRowIndex(df)
+    monkeypatch.setattr(dataset_cache, "_index", index)
+    monkeypatch.setattr(settings, "feature_state_max_users", 2)
+    state = DatasetFeatureState()
+    required = {("steps", "mean_7d"), ("acwr", "zscore_28d")}
+
+    for uid in ("user-0", "user-1", "user-2"):
+        last_day = index.rows(uid, None)["date"].iloc[-1].date()
+        got = state.features(index.frame, uid, last_day, "v1", required)
+        assert got == build_features(index.frame, last_day, uid, required=required)
+        assert {(var, agg) for var, aggs in got.items() for agg in aggs} == required
+
+    store = state._store
+    assert store.numeric_columns == ["steps", "acwr"] and store.other_columns == []
+    assert len(store) == 2 and "user-0" not in store
@@ -0,0 +1,79 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from backend.config import settings
+from backend.rules_engine.feature_store import read_feature_store, write_feature_store
+from backend.rules_engine.features import dataset_cache, dataset_scope, load_base_dataframe
+
+
+def test_feature_store_projection_and_filters(tmp_path):
+    df = pd.DataFrame(
+        {
+            "user_id": ["b", "a", "a", "b", "a"],
+            "date": pd.to_datetime(["2025-01-02", "2025-01-03", "2025-01-01", "2025-01-01", "2025-01-02"]),
+            "steps": [10, 20, 30, 40, 50],
+            "acwr": [1.1, 1.2, 1.3, 1.4, 1.5],
+        }
+    )
+    path = str(tmp_path / "daily.parquet")
+    write_feature_store(df, path, row_group_size=2)
+
+    full = read_feature_store(path)
+    assert list(full["user_id"]) == ["a", "a", "a", "b", "b"]
+    assert list(full["steps"]) == [30, 50, 20, 40, 10]
+    assert str(full["date"].dtype).startswith("datetime64")
+
+    part = read_feature_store(path, columns=["steps", "missing"], user_ids=["a"], start=date(2025, 1, 2))
+    assert list(part.columns) == ["user_id", "date", "steps"]
+    assert list(part["steps"]) == [50, 20]
+
+
+def test_dataset_cache_reads_only_the_scope_the_engine_needs(tmp_path, monkeypatch):
+    df = pd.DataFrame(
+        {
+            "user_id": ["a"] * 4 + ["b"] * 4,
+            "date": pd.to_datetime(["2025-01-01", "2025-01-02", "2025-01-03", "2025-01-04"] * 2),
+            "steps": [10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0, 80.0],
+            "acwr": [1.1, 1.2, 1.3, 1.4, 1.5, 1.6, 1.7, 1.8],
+            "max_heart_rate_bpm": 150.0,
+            "user_max_heart_rate_bpm": 190.0,
+        }
+    )
+    path = tmp_path / "daily.parquet"
+    write_feature_store(df, str(path), row_group_size=2)
+    monkeypatch.setenv("FEATURE_STORE_PATH", str(path))
+    monkeypatch.setattr(settings, "dataset_history_days", 1)
+    dataset_cache.invalidate()
+    try:
+        # Variables de las reglas (y dependencias de las derivadas) y filas hasta el día evaluado
+        scope = dataset_scope({("steps", "mean_7d"), ("max_hr_pct_user_max", "current")}, date(2025, 1, 3))
+        assert scope == {
+            "columns": ["max_heart_rate_bpm", "steps", "user_max_heart_rate_bpm"],
+            "start": date(2025, 1, 2),
+            "end": date(2025, 1, 3),
+        }
+        first = load_base_dataframe(**scope)
+        assert set(first.columns) == {"user_id", "date", "steps", "max_heart_rate_bpm", "user_max_heart_rate_bpm"}
+        assert sorted(first["date"].dt.day.unique()) == [2, 3]
+        version = dataset_cache.data_version()
+
+        # Lo que cabe en lo cargado no relee
+        misses = dataset_cache.stats()["misses"]
+        assert load_base_dataframe(columns=["steps"], start=date(2025, 1, 3), end=date(2025, 1, 3)) is first
+        assert dataset_cache.stats()["misses"] == misses
+
+        # Más columnas y un día posterior: se relee la unión, sin límite por el final
+        wider = load_base_dataframe(columns=["acwr"], start=date(2025, 1, 3), end=date(2025, 1, 4))
+        assert {"steps", "acwr"} <= set(wider.columns)
+        assert sorted(wider["date"].dt.day.unique()) == [2, 3, 4]
+        assert dataset_cache.stats()["end"] is None and dataset_cache.stats()["start"] == "2025-01-02"
+        assert dataset_cache.data_version() != version
+
+        # Sin argumentos, todo el fichero
+        assert len(load_base_dataframe()) == len(df)
+    finally:
+        dataset_cache.invalidate()
@@ -0,0 +1,152 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.rules_engine.features import (
+    UserRowIndex,
+    build_features,
+    build_features_all,
+    compact_dataframe,
+    dataset_cache,
+    features_from_matrix,
+)
+
+
+def _sample_frame(n_users: int = 4, n_days: int = 40, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    rows = []
+    for u in range(n_users):
+        for d in pd.date_range("2025-01-01", periods=n_days, freq="D"):
+            if rng.random() < 0.15:
+                continue  # días sin registro
+            rows.append(
+                {
+                    "user_id": f"user-{u}",
+                    "date": d,
+                    "steps": float(rng.integers(1000, 15000)) if rng.random() > 0.1 else np.nan,
+                    "acwr": float(rng.normal(1.0, 0.3)),
+                    "max_heart_rate_bpm": float(rng.integers(120, 190)),
+                    "user_max_heart_rate_bpm": 190.0,
+                }
+            )
+    # Desordenado a propósito
+    return pd.DataFrame(rows).sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+
+def test_user_row_index_matches_boolean_mask():
+    df = _sample_frame()
+    index = UserRowIndex(df)
+    target = date(2025, 1, 25)
+    for uid in ["user-0", "user-3", "missing"]:
+        expected = df[(df["user_id"] == uid) & (df["date"] <= pd.Timestamp(target))].sort_values("date")
+        got = index.rows(uid, target)
+        assert list(got["date"]) == list(expected["date"])
+        assert np.allclose(got["acwr"].to_numpy(), expected["acwr"].to_numpy())
+
+
+def test_build_features_uses_cached_index(monkeypatch):
+    df = _sample_frame()
+    target = date(2025, 1, 30)
+    expected = build_features(df, target, "user-1")
+
+    index = UserRowIndex(df)
+    monkeypatch.setattr(dataset_cache, "_index", index)
+    got = build_features(index.frame, target, "user-1")
+    assert got == expected
+
+
+def test_build_features_all_matches_per_user_features():
+    df = _sample_frame(n_users=6, n_days=45)
+    target = date(2025, 2, 5)
+    matrix = build_features_all(df, target)
+    assert set(matrix.index) == set(df["user_id"])
+
+    for uid in matrix.index:
+        expected = build_features(df, target, uid)
+        got = features_from_matrix(matrix, uid)
+        for var, aggs in expected.items():
+            for agg, value in aggs.items():
+                observed = got[var][agg]
+                if value is None:
+                    assert observed is None, (uid, var, agg)
+                else:
+                    assert observed == pytest.approx(value, rel=1e-9, abs=1e-12), (uid, var, agg)
+
+
+def test_build_features_required_subset():
+    df = _sample_frame()
+    target = date(2025, 1, 30)
+    full = build_features(df, target, "user-2")
+    required = {("steps", "delta_pct_3v14"), ("acwr", "zscore_28d"), ("max_hr_pct_user_max", "current")}
+    got = build_features(df, target, "user-2", required=required)
+    for var, agg in required:
+        assert got[var][agg] == full[var][agg]
+    assert "mean_7d" not in got["steps"]
+    assert "current" not in got["acwr"]
+
+    matrix = build_features_all(df, target, required=required)
+    assert set(matrix.columns.get_level_values("var")) == {
+        "steps", "acwr", "max_heart_rate_bpm", "user_max_heart_rate_bpm", "max_hr_pct_user_max",
+    }
+
+
+def test_compact_dataframe_keeps_feature_values():
+    df = _sample_frame(n_users=5, n_days=45)
+    df["steps"] = df["steps"].round()  # enteros con NaN -> Int16/Int32
+    df["acwr"] = df["acwr"].round(2)  # 2 decimales declarados -> float32
+    target = date(2025, 2, 10)
+    expected = {uid: build_features(df, target, uid) for uid in df["user_id"].unique()}
+    expected_matrix = build_features_all(df, target)
+
+    compact = compact_dataframe(df.copy(), {"acwr": {"decimals": 2, "valid_min": 0, "valid_max": 2.5}})
+    assert isinstance(compact["user_id"].dtype, pd.CategoricalDtype)
+    assert str(compact["steps"].dtype) in {"Int16", "Int32"}
+    assert compact["acwr"].dtype == np.float32
+    assert compact.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum()
+
+    index = UserRowIndex(compact)
+    for uid, feats in expected.items():
+        got = build_features(index.frame, target, uid)
+        assert got == feats
+        # Mismo tipo que sin compactar: 5000.0 y no 5000 en las respuestas JSON
+        assert {k: type(v.get("current")) for k, v in got.items()} == {
+            k: type(v.get("current")) for k, v in feats.items()
+        }
+    matrix = build_features_all(index.frame, target)
+    uid = next(iter(expected))
+    assert type(features_from_matrix(matrix, uid)["steps"]["current"]) is type(expected[uid]["steps"]["current"])
+    pd.testing.assert_frame_equal(
+        matrix.astype(float).sort_index(), expected_matrix.astype(float).sort_index(), check_exact=False, rtol=1e-12
+    )
+
+
+def _constant_frame():
+    """Ventanas constantes de floats no representables (np.std no da 0 exacto) y con NaN."""
+    days = pd.date_range("2025-01-01", periods=35, freq="D")
+    rows = []
+    for i, value in enumerate([0.1, 0.7, 1.1, 97.3]):
+        for d in days:
+            rows.append({"user_id": f"c{i}", "date": d, "steps": value, "acwr": value})
+    for d in days:
+        rows.append({"user_id": "nan", "date": d, "steps": np.nan if d.day % 5 == 0 else 0.7, "acwr": 0.1})
+    return pd.DataFrame(rows)
+
+
+def test_window_aggregates_agree_on_constant_windows():
+    from backend.rules_engine.feature_state import window_features
+
+    df = _constant_frame()
+    target = date(2025, 2, 4)
+    matrix = build_features_all(df, target)
+    for uid in df["user_id"].unique():
+        expected = build_features(df, target, uid)
+        rows = df[df["user_id"] == uid].drop(columns=["user_id"]).to_dict("records")
+        state = window_features(rows)
+        got = features_from_matrix(matrix, uid)
+        for var in ("steps", "acwr"):
+            assert got[var] == expected[var] == state[var], (uid, var)
+        if uid != "nan":
+            assert expected["steps"]["zscore_28d"] == 0.0
+    assert build_features(df, target, "nan")["steps"]["zscore_28d"] is None
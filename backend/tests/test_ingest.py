@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+from src.data.ingest import SCHEMAS, csv_to_parquet, iter_csv_typed, read_csv_typed
+
+
+def test_read_csv_typed_coerces_malformed_numbers(tmp_path):
+    path = tmp_path / "daily.csv"
+    path.write_text(
+        "patient_id;date;steps;max_heart_rate_bpm\n"
+        "u1;2025-01-01;1000;150\n"
+        "u2;2025-01-02;12,5;NULL\n",
+        encoding="utf-8",
+    )
+    df = read_csv_typed(str(path), SCHEMAS["activity_daily"])
+    assert list(df["patient_id"]) == ["u1", "u2"]
+    assert df["steps"].dtype == "float64"
+    assert df["steps"].iloc[0] == 1000.0 and df["steps"].isna().iloc[1]
+    assert str(df["date"].dtype).startswith("datetime64")
+
+
+def test_csv_to_parquet_streams_blocks_and_coerces_from_the_bad_block(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "daily.csv"
+    lines = ["patient_id;date;steps;max_heart_rate_bpm;device_source"]
+    lines += [f"u{i};2025-01-{i + 1:02d};{1000 + i};150;{i}" for i in range(5)]
+    lines += ["u5;2025-01-06;12,5;NULL;x", "u6;2025-01-07;2000;160;y"]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    chunks = list(iter_csv_typed(str(path), SCHEMAS["activity_daily"], chunksize=2))
+    assert [len(c) for c in chunks] == [2, 2, 2, 1]
+    # Las columnas sin declarar se leen como texto en todos los bloques
+    assert all(c["device_source"].dtype == object for c in chunks)
+
+    out = tmp_path / "staging" / "daily.parquet"
+    assert csv_to_parquet(str(path), SCHEMAS["activity_daily"], str(out), chunksize=2) == 7
+    assert pq.ParquetFile(out).num_row_groups == 4
+    got = pd.read_parquet(out)
+    expected = read_csv_typed(str(path), SCHEMAS["activity_daily"])
+    pd.testing.assert_frame_equal(got.drop(columns="device_source"), expected.drop(columns="device_source"))
+    assert list(got["device_source"]) == ["0", "1", "2", "3", "4", "x", "y"]
@@ -0,0 +1,53 @@
+from alembic import command
+from sqlalchemy import create_engine, inspect, text
+
+from backend.rules_engine.persistence import BASELINE_REVISION, alembic_config, create_all_tables
+
+
+def _revision(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT version_num FROM alembic_version")).scalar_one()
+
+
+def test_fresh_database_is_created_by_migrations(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    create_all_tables(engine)
+    insp = inspect(engine)
+    assert {"rules", "audits", "rule_fire_state", "rule_set_versions", "feature_snapshots"} <= set(insp.get_table_names())
+    indexes = {ix["name"] for ix in insp.get_indexes("audits")}
+    assert {"ix_audits_delivered", "ix_audits_user_date"} <= indexes
+    # ix_audits_user_id lo sustituye ix_audits_user_date (0003); la analítica lee rule_daily_stats (0004)
+    assert not {"ix_audits_user_id", "ix_audits_fired_tenant_date", "ix_audits_fired_rule_message"} & indexes
+    head = _revision(engine)
+
+    # Ida y vuelta hasta la base
+    cfg = alembic_config()
+    with engine.begin() as conn:
+        cfg.attributes["connection"] = conn
+        command.downgrade(cfg, BASELINE_REVISION)
+        assert "ix_audits_user_id" in {ix["name"] for ix in inspect(conn).get_indexes("audits")}
+        command.upgrade(cfg, "head")
+    assert {ix["name"] for ix in inspect(engine).get_indexes("audits")} == indexes
+
+    # Idempotente
+    create_all_tables(engine)
+    assert _revision(engine) == head
+
+
+def test_database_without_alembic_version_is_stamped_and_upgraded(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    # Esquema base sin `alembic_version`, como lo dejaba `create_all`
+    cfg = alembic_config()
+    with engine.begin() as conn:
+        cfg.attributes["connection"] = conn
+        command.upgrade(cfg, BASELINE_REVISION)
+        conn.execute(text("DROP TABLE alembic_version"))
+        conn.execute(text("INSERT INTO audits (tenant_id, user_id, date, fired, created_at) "
+                          "VALUES ('default', 'u1', '2025-01-01', 1, CURRENT_TIMESTAMP)"))
+
+    create_all_tables(engine)
+    columns = {c["name"] for c in inspect(engine).get_columns("audits")}
+    assert "feature_snapshot_id" in columns
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM audits")).scalar_one() == 1
+    assert _revision(engine) != BASELINE_REVISION
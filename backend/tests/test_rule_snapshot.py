@@ -0,0 +1,39 @@
+import uuid
+
+from fastapi.testclient import TestClient
+
+from backend.app import app
+from backend.rules_engine.rule_snapshot import rule_sets
+
+
+def test_rule_set_snapshot_rebuilt_on_version_bump():
+    tenant = f"t_{uuid.uuid4().hex[:8]}"
+    rule = {
+        "id": f"snap_{uuid.uuid4().hex[:8]}",
+        "tenant_id": tenant,
+        "category": "actividad",
+        "logic": {"var": "steps", "agg": "mean_7d", "op": "<", "value": 5000},
+        "messages": {"candidates": [{"text": "Camina más ({{steps:mean_7d}})"}]},
+    }
+    with TestClient(app) as client:
+        empty = rule_sets.get(tenant)
+        assert empty.rules == ()
+        assert rule_sets.get(tenant) is empty
+
+        rid = client.post("/rules", json={"rule": rule}).json()["id"]
+        created = rule_sets.get(tenant)
+        assert created.version > empty.version
+        assert [r.id for r in created.rules] == [rid]
+        assert created.rules[0].compiled.ok
+        assert created.required == {("steps", "mean_7d")}
+
+        client.post(f"/rules/{rid}/variants", json={"text": "Sueño: {{sleep_minutes}}"})
+        with_variant = rule_sets.get(tenant)
+        assert len(with_variant.rules[0].messages) == 2
+        assert ("sleep_minutes", "current") in with_variant.required
+        # El snapshot anterior no cambia: las evaluaciones en curso lo siguen usando
+        assert len(created.rules[0].messages) == 1
+
+        client.post(f"/rules/{rid}/enable", json={"enabled": False})
+        assert rule_sets.get(tenant).rules == ()
+        client.delete(f"/rules/{rid}")
@@ -6,9 +6,10 @@ from backend.app import app
 
 
 def test_simulate_endpoint_minimal():
-    client = TestClient(app)
-    payload = {"user_id": "demo_user", "date": str(date.today())}
-    resp = client.post("/simulate", json=payload)
+    # `with` ejecuta el startup (creación de tablas y seeds)
+    with TestClient(app) as client:
+        payload = {"user_id": "demo_user", "date": str(date.today())}
+        resp = client.post("/simulate", json=payload)
     assert resp.status_code == 200
     body = resp.json()
     assert "count" in body
@@ -0,0 +1,46 @@
+from datetime import date
+
+import numpy as np
+
+from backend.rules_engine.compiler import CompiledRule
+from backend.rules_engine.dsl import RuleModel
+from backend.rules_engine.engine import eval_node
+from backend.rules_engine.features import build_features_all, features_from_matrix
+from backend.rules_engine.vectorized import evaluate_matrix
+from backend.tests.test_features import _sample_frame
+
+
+LOGICS = {
+    "low_steps": {"var": "steps", "agg": "mean_7d", "op": "<", "value": 8000, "required": True},
+    "acwr_band": {"all": [
+        {"var": "acwr", "agg": "current", "op": "between", "value": [0.8, 1.3]},
+        {"none": [{"var": "device_source", "op": "in", "value": ["garmin"]}]},
+    ]},
+    "above_baseline": {"any": [
+        {"left": {"var": "steps", "agg": "current"}, "op": ">", "right": {"var": "steps", "agg": "mean_14d", "scale": 1.1}},
+        {"var": "max_hr_pct_user_max", "op": ">=", "value": 0.9},
+        {"var": "missing_var", "op": "==", "value": 1},
+    ]},
+    "empty_all": {"all": []},
+}
+
+
+def _compiled(rule_id, logic):
+    model = RuleModel(id=rule_id, category="c", logic=logic, messages={"candidates": [{"text": "x"}]})
+    return CompiledRule(rule_id=rule_id, key=(rule_id,), logic=logic, model=model)
+
+
+def test_evaluate_matrix_matches_eval_node():
+    df = _sample_frame(n_users=12, n_days=40)
+    df["device_source"] = np.where(df.index % 3 == 0, "garmin", "apple")
+    matrix = build_features_all(df, date(2025, 2, 5))
+    rules = [_compiled(rid, logic) for rid, logic in LOGICS.items()]
+
+    fired = evaluate_matrix(matrix, rules)
+    assert list(fired.columns) == list(LOGICS)
+    assert fired.dtypes.eq(bool).all()
+    for uid in matrix.index:
+        feats = features_from_matrix(matrix, uid)
+        for rule in rules:
+            assert fired.at[uid, rule.rule_id] == eval_node(rule.model.logic, feats, []), (uid, rule.rule_id)
+    assert fired["low_steps"].any() and not fired["low_steps"].all()
@@ -5,6 +5,7 @@ Incluye tanto configuración del backend como del procesamiento de datos.
 """
 
 from datetime import date
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -28,9 +29,42 @@ class AppSettings(BaseSettings):
     max_recs_per_day: int = 3
     max_recs_per_category_per_day: int = 1
 
+    # Fuera de debug, dejar de evaluar reglas cuando los límites anteriores ya están cubiertos
+    engine_early_termination: bool = True
+
     # Anti-repetición de variantes
     anti_repeat_days: int = 7
 
+    # Auditoría: filas por commit al escribir un lote (0 = un único commit)
+    audit_commit_rows: int = 5000
+    # Auditoría asíncrona: hilo de escritura con cola acotada (en filas)
+    audit_async: bool = True
+    audit_queue_max_rows: int = 50000
+    audit_flush_interval_ms: int = 200
+    audit_enqueue_timeout_seconds: float = 2.0
+    # Reintentos de un bloque fallido antes de abandonar sus filas no entregadas
+    audit_write_retries: int = 3
+    # Qué evaluaciones se auditan: full (todas), fired_only (disparadas o descartadas)
+    # o sampled (además, las no disparadas de una fracción estable de usuarios)
+    audit_policy: Literal["full", "fired_only", "sampled"] = "full"
+    audit_policy_by_tenant: dict[str, Literal["full", "fired_only", "sampled"]] = {}
+    audit_sample_rate: float = 0.1
+    audit_sample_rate_by_tenant: dict[str, float] = {}
+    # Retención: días de auditoría en la tabla `audits` (mínimo 30, el máximo de cooldown_days);
+    # lo anterior se exporta a Parquet particionado por tenant y día y se borra
+    audit_hot_days: int = 90
+    audit_hot_days_by_tenant: dict[str, int] = {}
+    audit_archive_dir: str = "output/audit_archive"
+    audit_archive_batch_rows: int = 50000
+
+    # Dataset en memoria: user_id categórico y métricas en tipos compactos
+    dataset_compact_dtypes: bool = True
+    # Días de historia antes del día evaluado que lee el motor del feature store (0 = toda).
+    # Las ventanas son las últimas 28 filas del usuario: con huecos, un límite puede acortarlas
+    dataset_history_days: int = 0
+    # Estado de features por usuario de `/simulate`: usuarios en memoria como máximo (LRU)
+    feature_state_max_users: int = 50000
+
     # Seguridad
     auth_enabled: bool = False
 
@@ -26,6 +26,8 @@ if ROOT_DIR not in sys.path:
 
 from config import FILES, COLMAP, START_DATE, END_DATE, OUT_DIR
 from src.ratios.register import register_ratio_features
+from backend.rules_engine.feature_store import write_feature_store
+from src.data.ingest import SCHEMAS, csv_to_parquet, pq, read_csv_typed
 
 
 pd.options.mode.copy_on_write = True
@@ -34,23 +36,30 @@ pd.options.mode.copy_on_write = True
 
 
 
-def load_csv(path, parse_dates=None):
-    # Carga robusta de CSV con autodetección de separador y parseo de fechas.
-    # `sep=None` + `engine='python'` permite que pandas detecte automáticamente
-    # si el separador es coma o punto y coma. `parse_dates` delega el parseo
-    # a pandas, evitando conversiones manuales.
+def load_csv(source):
+    # Carga tipada según el esquema declarado de cada fuente (separador, dtypes,
+    # formatos de fecha y token NULL) con el lector C de pandas.
+    # Sustituye a `sep=None` + `engine='python'`, que además obligaba a inferir tipos.
+    # Con pyarrow, el CSV se convierte por bloques a un Parquet en OUT_DIR/staging
+    # (memoria acotada por bloque al parsear) y se reutiliza mientras el CSV no cambie.
 
-    return pd.read_csv(path, sep=None, engine="python", parse_dates=parse_dates)
+    path = FILES[source]
+    if pq is None:
+        return read_csv_typed(path, SCHEMAS[source])
+    staged = os.path.join(OUT_DIR, "staging", f"{source}.parquet")
+    if not os.path.exists(staged) or os.path.getmtime(staged) < os.path.getmtime(path):
+        csv_to_parquet(path, SCHEMAS[source], staged)
+    return pd.read_parquet(staged)
 
 
 
 
 
 # --- Carga de fuentes crudas (pacientes, actividad, sueño, encuesta)
-p  = load_csv(FILES["patient"],          parse_dates=["birth_date"])
-a  = load_csv(FILES["activity_daily"],   parse_dates=["date"])
-s  = load_csv(FILES["sleep_daily"],      parse_dates=["calculation_date"])
-di = load_csv(FILES["survey"],           parse_dates=["date"])
+p  = load_csv("patient")
+a  = load_csv("activity_daily")
+s  = load_csv("sleep_daily")
+di = load_csv("survey")
 
 
 
@@ -265,8 +274,9 @@ except Exception as e:
     print(f"Aviso: fallo al calcular ratios en 10_load_and_merge.py: {e}")
 
 
-# Orden final y persistencia a parquet
+# Orden final y persistencia al feature store (Parquet ordenado por user_id/date,
+# con estadísticas por row group para que el backend filtre sin leer todo)
 
 d = d.sort_values(["user_id","date"]).reset_index(drop=True)
-d.to_parquet(f"{OUT_DIR}/daily_merged.parquet", index=False)
+write_feature_store(d, f"{OUT_DIR}/daily_merged.parquet")
 print("OK daily:", d.shape, "users:", d.user_id.nunique())
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.rules_engine.feature_cube import write_feature_cube
+from backend.rules_engine.features import load_base_dataframe
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Materializa el dataset diario como cubo memory-mapped")
+    parser.add_argument("--out", default=os.path.join("output", "feature_cube"))
+    parser.add_argument("--dtype", default="float64", choices=["float64", "float32"])
+    args = parser.parse_args()
+
+    df = load_base_dataframe()
+    write_feature_cube(df, args.out, dtype=args.dtype)
+    print("OK cube:", args.out, "rows:", len(df), "users:", df["user_id"].nunique() if not df.empty else 0)
+
+
+if __name__ == "__main__":
+    main()
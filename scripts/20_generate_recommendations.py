@@ -1,62 +1,162 @@
 from __future__ import annotations
 
+import argparse
 import csv
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import date
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Iterable
 
-from backend.rules_engine.engine import evaluate_user
+import pandas as pd
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.rules_engine import persistence
+from backend.rules_engine.engine import RecommendationEvent, evaluate_users
+from backend.rules_engine.features import dataset_scope, load_base_dataframe
+from backend.rules_engine.rule_snapshot import rule_sets
+
+
+FIELDNAMES = [
+    "date",
+    "tenant_id",
+    "user_id",
+    "rule_id",
+    "category",
+    "severity",
+    "priority",
+    "message_id",
+    "message_text",
+    "locale",
+]
 
 
 def write_recs_today(rows: Iterable[dict[str, str]], path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    fieldnames = [
-        "date",
-        "tenant_id",
-        "user_id",
-        "rule_id",
-        "category",
-        "severity",
-        "priority",
-        "message_id",
-        "message_text",
-        "locale",
-    ]
+    if path.suffix.lower() == ".parquet":
+        pd.DataFrame(list(rows), columns=FIELDNAMES).to_parquet(path, index=False)
+        return
     with path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
         writer.writeheader()
         for r in rows:
             writer.writerow(r)
 
 
+def _event_row(e: RecommendationEvent) -> dict[str, str]:
+    return {
+        "date": str(e.date),
+        "tenant_id": e.tenant_id,
+        "user_id": e.user_id,
+        "rule_id": e.rule_id,
+        "category": e.category or "",
+        "severity": str(e.severity),
+        "priority": str(e.priority),
+        "message_id": str(e.message_id or ""),
+        "message_text": e.message_text,
+        "locale": e.locale,
+    }
+
+
+def users_with_data(df: pd.DataFrame, day: date) -> list[str]:
+    """Usuarios con fila en el dataset para `day`, en orden estable."""
+    if df.empty:
+        return []
+    on_day = df[pd.to_datetime(df["date"]).dt.normalize() == pd.Timestamp(day)]
+    return sorted({str(u) for u in on_day["user_id"].unique()})
+
+
+def _init_worker(scope: dict[str, Any]) -> None:
+    # Con fork el proceso hereda la conexión del padre: cada worker abre las suyas (solo lectura:
+    # las auditorías vuelven al padre, que es el único que escribe en la base de datos).
+    # El dataset y el snapshot de reglas cargados en el padre se comparten copy-on-write;
+    # con spawn se cargan aquí una vez por worker.
+    persistence.engine.dispose(close=False)
+    load_base_dataframe(**scope)
+
+
+def run_chunk(
+    index: int, user_ids: list[str], day: date, tenant_id: str, seed: int | None
+) -> tuple[int, int, list[dict[str, str]], list[dict[str, Any]]]:
+    if seed is not None:
+        random.seed(seed + index)
+    audits: list[dict[str, Any]] = []
+    results = evaluate_users(user_ids, day, tenant_id=tenant_id, audit_sink=audits.extend)
+    rows = [_event_row(e) for uid in user_ids for e in results.get(uid, [])]
+    return index, len(user_ids), rows, audits
+
+
 def main() -> None:
-    tenant_id = "default"
-    users = ["demo_user"]
-    today = date.today()
-
-    all_rows: list[dict[str, str]] = []
-    for uid in users:
-        events = evaluate_user(uid, today, tenant_id=tenant_id)
-        for e in events:
-            all_rows.append(
-                {
-                    "date": str(e.date),
-                    "tenant_id": e.tenant_id,
-                    "user_id": e.user_id,
-                    "rule_id": e.rule_id,
-                    "category": e.category or "",
-                    "severity": str(e.severity),
-                    "priority": str(e.priority),
-                    "message_id": str(e.message_id or ""),
-                    "message_text": e.message_text,
-                    "locale": e.locale,
-                }
-            )
-
-    write_recs_today(all_rows, Path("output/recs_today.csv"))
+    parser = argparse.ArgumentParser(description="Genera las recomendaciones del día para todos los usuarios con datos")
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today(), help="Fecha objetivo (YYYY-MM-DD)")
+    parser.add_argument("--tenant", default="default")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=500, help="Usuarios por tarea")
+    parser.add_argument("--output", default=os.path.join("output", "recs_today.csv"), help=".csv o .parquet")
+    parser.add_argument("--seed", type=int, default=None, help="Semilla para la selección de variantes (por chunk)")
+    args = parser.parse_args()
 
+    started = time.perf_counter()
+    persistence.create_all_tables()
+    persistence.backfill_rule_fire_state()
+    persistence.backfill_rule_daily_stats()
+    # Cargar en el padre antes de crear el pool: los workers lo heredan. Solo las variables
+    # de las reglas del tenant y las filas hasta el día objetivo, lo mismo que pide el motor
+    rule_set = rule_sets.get(args.tenant)
+    scope = dataset_scope(set(rule_set.required), args.date)
+    df = load_base_dataframe(**scope)
+    users = users_with_data(df, args.date)
+    size = max(1, args.chunk_size)
+    chunks = [users[i : i + size] for i in range(0, len(users), size)]
+    print(
+        f"{args.date} tenant={args.tenant} usuarios={len(users)} reglas={len(rule_set.rules)} "
+        f"chunks={len(chunks)} workers={args.workers}"
+    )
 
-if __name__ == "__main__":
-    main()
+    results: dict[int, list[dict[str, str]]] = {}
+    failed = 0
+    done_users = 0
+
+    def report(index: int, n_users: int, rows: list[dict[str, str]], audits: list[dict[str, Any]]) -> None:
+        nonlocal done_users
+        # Varios procesos escribiendo el mismo SQLite acaban en "database is locked": inserta solo el padre
+        persistence.bulk_insert_audits(audits)
+        results[index] = rows
+        done_users += n_users
+        print(
+            f"[{len(results) + failed}/{len(chunks)}] chunk={index} usuarios={n_users} eventos={len(rows)} "
+            f"progreso={done_users}/{len(users)} t={time.perf_counter() - started:.1f}s",
+            flush=True,
+        )
 
+    if args.workers <= 1 or len(chunks) <= 1:
+        for i, chunk in enumerate(chunks):
+            report(*run_chunk(i, chunk, args.date, args.tenant, args.seed))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(scope,)) as pool:
+            futures = {
+                pool.submit(run_chunk, i, chunk, args.date, args.tenant, args.seed): i
+                for i, chunk in enumerate(chunks)
+            }
+            for fut in as_completed(futures):
+                try:
+                    report(*fut.result())
+                except Exception as e:  # noqa: BLE001
+                    failed += 1
+                    print(f"[ERROR] chunk={futures[fut]}: {e}", file=sys.stderr, flush=True)
 
+    all_rows = [row for i in sorted(results) for row in results[i]]
+    write_recs_today(all_rows, Path(args.output))
+    print(f"OK {args.output} eventos={len(all_rows)} t={time.perf_counter() - started:.1f}s")
+    if failed:
+        sys.exit(f"{failed} chunk(s) con error")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Retención de auditorías: exporta a Parquet y borra de `audits` lo anterior a la ventana caliente.
+
+Pensado para ejecutarse una vez al día después de `20_generate_recommendations.py`:
+
+    python scripts/30_archive_audits.py
+    python scripts/30_archive_audits.py --tenant clinica_a --dry-run
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.config import settings
+from backend.rules_engine import persistence
+from backend.rules_engine.audit_archive import archive_audits
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tenant", default=None, help="Solo este tenant (por defecto todos los de audits)")
+    parser.add_argument("--today", type=date.fromisoformat, default=date.today(), help="Día de referencia (YYYY-MM-DD)")
+    parser.add_argument("--batch-rows", type=int, default=settings.audit_archive_batch_rows, help="Filas por lote")
+    parser.add_argument("--dry-run", action="store_true", help="Solo contar las filas a archivar")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    persistence.create_all_tables()
+    # Sin resumen diario previo, los días archivados perderían su analítica
+    persistence.backfill_rule_daily_stats()
+    report = archive_audits(args.tenant, today=args.today, batch_rows=args.batch_rows, dry_run=args.dry_run)
+    for tenant, summary in report.items():
+        print(
+            f"tenant={tenant} corte={summary['cutoff']} auditorías={summary['archived']} "
+            f"snapshots={summary['snapshots_deleted']} ficheros={len(summary['files'])}"
+        )
+    action = "a archivar" if args.dry_run else "archivadas"
+    total = sum(s["archived"] for s in report.values())
+    print(f"{total} auditorías {action} en {settings.audit_archive_dir} ({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
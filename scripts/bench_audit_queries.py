@@ -0,0 +1,207 @@
+"""Latencia de las consultas calientes sobre `audits` sin y con sus índices de ruta de acceso.
+
+Crea una base de datos SQLite aparte con el esquema actual y N auditorías
+sintéticas, mide cada consulta sin los índices de `Audit` (ix_audits_delivered
+e ix_audits_user_date, con el índice simple de user_id que sustituyen), los
+crea y vuelve a medir. Las consultas son las de la aplicación
+(`FireHistory.load`, la comprobación de usuarios distintos de
+`update_rule_daily_stats` y la auditoría por usuario y día), no copias.
+`/analytics/triggers` y `/rules/{id}/stats` leen de `rule_daily_stats`, que se
+construye una vez tras la carga y no depende de esos índices: se miden como
+referencia.
+
+    python scripts/bench_audit_queries.py --rows 10000000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Any, Callable
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--rules", type=int, default=40)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por consulta (se informa la mediana)")
+    parser.add_argument("--batch", type=int, default=200_000, help="Filas por INSERT")
+    parser.add_argument("--db", default=None, help="Fichero SQLite (por defecto uno temporal)")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+DB_PATH = ARGS.db or os.path.join(tempfile.mkdtemp(prefix="bench_audits_"), "audits.db")
+# Antes de importar backend: `persistence` crea el engine con settings.database_url
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from sqlalchemy import Index, inspect, select, text  # noqa: E402
+
+from backend.api.analytics import triggers  # noqa: E402
+from backend.api.rules import rule_stats  # noqa: E402
+from backend.rules_engine.engine import FireHistory  # noqa: E402
+from backend.rules_engine.persistence import (  # noqa: E402
+    Audit,
+    _delivered_before,
+    create_all_tables,
+    engine,
+    get_session,
+    rebuild_rule_daily_stats,
+)
+
+
+TENANT = "default"
+END_DAY = date(2025, 8, 31)
+ACCESS_PATH_INDEXES = [
+    index for index in Audit.__table__.indexes if index.name in ("ix_audits_delivered", "ix_audits_user_date")
+]
+
+
+def _user(i: int) -> str:
+    return f"user_{i:07d}"
+
+
+def _rule(i: int) -> str:
+    return f"R-{i:03d}"
+
+
+def load_rows(rows: int, users: int, rules: int, days: int, batch: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    first_day = END_DAY - timedelta(days=days - 1)
+    sql = (
+        "INSERT INTO audits (tenant_id, user_id, date, rule_id, fired, discarded_reason, why, message_id, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)"
+    )
+    reasons = np.array([None, None, None, "category_cap", "daily_cap", "cooldown"], dtype=object)
+    done = 0
+    started = time.perf_counter()
+    while done < rows:
+        n = min(batch, rows - done)
+        u = rng.integers(0, users, n)
+        r = rng.integers(0, rules, n)
+        d = rng.integers(0, days, n)
+        fired = rng.random(n) < 0.15
+        reason = np.where(fired, reasons[rng.integers(0, len(reasons), n)], None)
+        delivered = fired & (reason == None)  # noqa: E711
+        message = np.where(delivered, r * 10 + rng.integers(0, 3, n), -1)
+        params = [
+            (
+                TENANT,
+                _user(int(u[k])),
+                (first_day + timedelta(days=int(d[k]))).isoformat(),
+                _rule(int(r[k])),
+                int(fired[k]),
+                reason[k],
+                '{"conditions": []}',
+                int(message[k]) if message[k] >= 0 else None,
+            )
+            for k in range(n)
+        ]
+        with engine.begin() as conn:
+            conn.exec_driver_sql(sql, params)
+        done += n
+        print(f"  {done:,}/{rows:,} filas ({time.perf_counter() - started:.0f}s)", flush=True)
+
+
+def _median_ms(fn: Callable[[], Any], repeat: int) -> float:
+    fn()  # calentar caché de páginas
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def queries(users: int, rules: int) -> dict[str, Callable[[], Any]]:
+    batch_users = [_user(i) for i in range(0, min(users, 500))]
+    rule_ids = [_rule(i) for i in range(rules)]
+    probe_user = _user(users // 2)
+
+    def distinct_users_check() -> Any:
+        with get_session() as session:
+            return _delivered_before(session, {(TENANT, rule_id, END_DAY): set(batch_users) for rule_id in rule_ids})
+
+    def simulate_debug() -> Any:
+        with get_session() as session:
+            return session.scalars(
+                select(Audit).where(Audit.user_id == probe_user, Audit.date == END_DAY).order_by(Audit.id.desc())
+            ).all()
+
+    return {
+        "anti-repetición (500 usuarios, 7 días)": lambda: FireHistory.load(
+            TENANT, batch_users, rule_ids, messages_since=END_DAY - timedelta(days=7)
+        ),
+        "rule_daily_stats: usuarios ya entregados (500 usuarios)": distinct_users_check,
+        "/analytics/triggers (30 días)": lambda: triggers(END_DAY - timedelta(days=29), END_DAY, TENANT),
+        "/analytics/triggers (30 días, 3 reglas)": lambda: triggers(
+            END_DAY - timedelta(days=29), END_DAY, TENANT, ",".join(rule_ids[:3])
+        ),
+        "/rules/{id}/stats": lambda: rule_stats(rule_ids[0]),
+        "/simulate debug (usuario y día)": simulate_debug,
+    }
+
+
+def _set_access_path_indexes(enabled: bool) -> None:
+    """Índices de ruta de acceso de `audits` (o, sin ellos, el índice simple de user_id que sustituyen)."""
+    user_id_index = Index("ix_audits_user_id", Audit.__table__.c.user_id)
+    with engine.begin() as conn:
+        existing = {ix["name"] for ix in inspect(conn).get_indexes("audits")}
+        for index in ACCESS_PATH_INDEXES:
+            if enabled and index.name not in existing:
+                index.create(conn)
+            elif not enabled and index.name in existing:
+                index.drop(conn)
+        if enabled and user_id_index.name in existing:
+            user_id_index.drop(conn)
+        elif not enabled and user_id_index.name not in existing:
+            user_id_index.create(conn)
+        conn.exec_driver_sql("ANALYZE")
+
+
+def main() -> None:
+    print(f"DB: {DB_PATH}")
+    create_all_tables()
+    # Carga sin los índices compuestos (más rápida) y primera medición sin ellos
+    _set_access_path_indexes(False)
+    with engine.connect() as conn:
+        existing = conn.execute(text("SELECT count(*) FROM audits")).scalar_one()
+    if existing < ARGS.rows:
+        print(f"Cargando {ARGS.rows - existing:,} auditorías sintéticas...")
+        load_rows(ARGS.rows - existing, ARGS.users, ARGS.rules, ARGS.days, ARGS.batch, ARGS.seed + existing)
+    started = time.perf_counter()
+    rebuild_rule_daily_stats()
+    print(f"rule_daily_stats reconstruida en {time.perf_counter() - started:.1f}s")
+    _set_access_path_indexes(False)
+
+    plan = queries(ARGS.users, ARGS.rules)
+    before = {name: _median_ms(fn, ARGS.repeat) for name, fn in plan.items()}
+
+    started = time.perf_counter()
+    _set_access_path_indexes(True)
+    build_seconds = time.perf_counter() - started
+    after = {name: _median_ms(fn, ARGS.repeat) for name, fn in plan.items()}
+
+    print(f"\n{ARGS.rows:,} auditorías, mediana de {ARGS.repeat} ejecuciones; creación de índices {build_seconds:.1f}s\n")
+    width = max(len(name) for name in plan)
+    print(f"{'consulta':<{width}}  {'sin (ms)':>10}  {'con (ms)':>10}  {'x':>7}")
+    for name in plan:
+        speedup = before[name] / after[name] if after[name] > 0 else float("inf")
+        print(f"{name:<{width}}  {before[name]:>10.1f}  {after[name]:>10.1f}  {speedup:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
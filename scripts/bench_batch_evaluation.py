@@ -0,0 +1,136 @@
+"""Coste de evaluar un lote de usuarios según la política de auditoría.
+
+Crea una base de datos SQLite aparte con N reglas sintéticas y un dataset de
+U usuarios en memoria, y mide `evaluate_users` (la ruta de lote de
+`scripts/20_generate_recommendations.py`) con cada política. El lote siempre
+calcula las features y la máscara usuarios × reglas en una pasada; la traza
+por regla (`why` + snapshot) solo se ahorra en las reglas que no disparan y
+cuyas auditorías no se guardan: con `full` (la política por defecto) se trazan
+todas, y la diferencia con `fired_only` es lo que cuesta guardar el `why` de
+las no disparadas. Las auditorías van a una lista, no a la base de datos.
+
+    python scripts/bench_batch_evaluation.py --users 5000 --rules 40
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--rules", type=int, default=40)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--batch", type=int, default=500, help="Usuarios por llamada a evaluate_users")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por política (se informa la mediana)")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bench_batch_"), "rules.db")
+# Antes de importar backend: `persistence` crea el engine con settings.database_url
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from backend.app import app  # noqa: E402
+from backend.config import settings  # noqa: E402
+from backend.rules_engine import engine  # noqa: E402
+from backend.rules_engine.persistence import create_all_tables  # noqa: E402
+
+
+TENANT = "default"
+POLICIES = ("full", "sampled", "fired_only")
+VARIABLES = ("steps", "acwr", "sleep_efficiency")
+AGGS = ("current", "mean_7d", "mean_14d", "zscore_28d")
+
+
+def make_frame(users: int, days: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end="2025-08-31", periods=days, freq="D")
+    n = users * days
+    return pd.DataFrame(
+        {
+            "user_id": np.repeat([f"user_{i:07d}" for i in range(users)], days),
+            "date": np.tile(dates, users),
+            "steps": rng.integers(1_000, 15_000, n).astype(float),
+            "acwr": rng.normal(1.0, 0.3, n),
+            "sleep_efficiency": rng.uniform(0.6, 1.0, n),
+            "max_heart_rate_bpm": rng.integers(120, 190, n).astype(float),
+            "user_max_heart_rate_bpm": 190.0,
+        }
+    )
+
+
+def make_rules(rules: int, frame: pd.DataFrame, seed: int) -> list[dict]:
+    """Reglas `var agg op umbral` con umbrales en cuantiles altos: disparan pocas, como en producción."""
+    rng = np.random.default_rng(seed)
+    out = []
+    for i in range(rules):
+        var = VARIABLES[i % len(VARIABLES)]
+        agg = AGGS[(i // len(VARIABLES)) % len(AGGS)]
+        value = 1.5 if agg == "zscore_28d" else float(np.quantile(frame[var], rng.uniform(0.9, 0.99)))
+        out.append(
+            {
+                "id": f"R-{i:03d}",
+                "tenant_id": TENANT,
+                "category": f"cat_{i % 5}",
+                "priority": int(rng.integers(1, 100)),
+                "logic": {"var": var, "agg": agg, "op": ">", "value": value},
+                "messages": {"candidates": [{"text": f"{var} alto"}]},
+            }
+        )
+    return out
+
+
+def run(users: list[str], target: date) -> int:
+    audits: list[dict] = []
+    for start in range(0, len(users), ARGS.batch):
+        engine.evaluate_users(users[start:start + ARGS.batch], target, TENANT, audit_sink=audits.extend)
+    return len(audits)
+
+
+def main() -> None:
+    print(f"DB: {DB_PATH}")
+    create_all_tables()
+    frame = make_frame(ARGS.users, ARGS.days, ARGS.seed)
+    engine.load_base_dataframe = lambda **_: frame
+    client = TestClient(app)
+    for rule in make_rules(ARGS.rules, frame, ARGS.seed):
+        client.post("/rules", json={"rule": rule}).raise_for_status()
+
+    users = sorted(frame["user_id"].unique())
+    target = frame["date"].max().date()
+    results: dict[str, tuple[float, int]] = {}
+    for policy in POLICIES:
+        settings.audit_policy = policy
+        run(users[: ARGS.batch], target)  # calentar cachés de reglas y dataset
+        samples, rows = [], 0
+        for _ in range(ARGS.repeat):
+            started = time.perf_counter()
+            rows = run(users, target)
+            samples.append(time.perf_counter() - started)
+        results[policy] = (statistics.median(samples), rows)
+
+    print(f"\n{ARGS.users:,} usuarios × {ARGS.rules} reglas, lotes de {ARGS.batch}, mediana de {ARGS.repeat}\n")
+    print(f"{'política':<12}  {'total (s)':>10}  {'µs/usuario':>11}  {'auditorías':>11}")
+    for policy, (seconds, rows) in results.items():
+        print(f"{policy:<12}  {seconds:>10.2f}  {seconds / ARGS.users * 1e6:>11.0f}  {rows:>11,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -30,8 +30,10 @@ print([r.id for r in en])
 print("Evaluating user with debug=True...")
 res = evaluate_user(USER, DAY, tenant_id=TENANT, debug=True)
 try:
-    results, per_rule_debug = res
+    results, debug_payload = res
+    per_rule_debug = debug_payload["rules"]
     print("results count:", len(results))
+    print("features:", debug_payload["values"])
     print("per_rule_debug count:", len(per_rule_debug))
     for d in per_rule_debug:
         print(d)
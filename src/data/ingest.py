@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Lectura tipada de los CSV de origen.
+
+Interfaces:
+- SCHEMAS: esquema declarado por fuente (mismas claves que config.FILES)
+- read_csv_typed(path, schema, usecols=None) -> pd.DataFrame
+- iter_csv_typed(path, schema, usecols=None, chunksize=...) -> bloques pd.DataFrame
+- csv_to_parquet(path, schema, out_path, usecols=None, chunksize=...) -> filas escritas
+
+Notas:
+- Se usa el lector C de pandas con dtypes explícitos en lugar de
+  `sep=None, engine='python'`: no hay inferencia de tipos ni un segundo pase
+  con `pd.to_numeric` salvo que alguna celda numérica esté mal formada, en
+  cuyo caso esas celdas quedan NaN.
+- `read_csv_typed` lee el fichero en un único pase. `csv_to_parquet` lo
+  recorre por bloques (`iter_csv_typed`) y escribe cada bloque en un
+  `ParquetWriter`: la memoria de trabajo queda acotada por bloque y el
+  Parquet resultante se relee tipado y por columnas.
+- Las fechas se parsean con el formato declarado; los valores que no encajan
+  se reintentan con `format="mixed"` para no perder filas.
+"""
+from __future__ import annotations
+
+import csv
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Optional
+
+import pandas as pd
+
+try:  # pyarrow es opcional: sin él solo está la lectura completa del CSV
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depende del entorno
+    pa = None
+    pq = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 250_000
+NULL_TOKENS = ["NULL", "null", ""]
+
+
+@dataclass(frozen=True)
+class CsvSchema:
+    # sep=None: se detecta con la cabecera (barato) en lugar de con el sniffer de pandas
+    sep: Optional[str] = None
+    dtypes: dict[str, str] = field(default_factory=dict)
+    dates: dict[str, str] = field(default_factory=dict)
+    dayfirst: bool = False
+    na_values: tuple[str, ...] = tuple(NULL_TOKENS)
+
+
+_DATETIME = "%Y-%m-%d %H:%M:%S"
+
+_WEARABLE_COMMON = {
+    "patient_id": "str",
+    "heart_rate_average_bpm": "float64",
+    "max_heart_rate_bpm": "float64",
+    "min_heart_rate_bpm": "float64",
+    "resting_heart_rate_bpm": "float64",
+    "user_max_heart_rate_bpm": "float64",
+    "heart_rate_variability_rmssd": "float64",
+    "heart_rate_variability_sdnn": "float64",
+    "device_source": "str",
+}
+
+SCHEMAS: dict[str, CsvSchema] = {
+    "activity_daily": CsvSchema(
+        sep=";",
+        dtypes={
+            **_WEARABLE_COMMON,
+            "activity_minutes": "float64",
+            "inactivity_minutes": "float64",
+            "low_intensity_minutes": "float64",
+            "moderate_intensity_minutes": "float64",
+            "continuous_inactive_periods": "float64",
+            "rest_minutes": "float64",
+            "vigorous_intensity_minutes": "float64",
+            "activity_calories": "float64",
+            "steps": "float64",
+            "distance_meters": "float64",
+            "elevation_meters": "float64",
+            "floors_climbed": "float64",
+            "activity_stress_duration_seconds": "float64",
+            "avg_stress_level": "float64",
+            "high_stress_duration_seconds": "float64",
+            "low_stress_duration_seconds": "float64",
+            "max_stress_level": "float64",
+            "medium_stress_duration_seconds": "float64",
+            "rest_stress_duration_seconds": "float64",
+            "stress_duration_seconds": "float64",
+            "stress_samples": "float64",
+        },
+        dates={
+            "date": "%Y-%m-%d",
+            "start_date_time": _DATETIME,
+            "webhook_date_time": _DATETIME,
+            "last_webhook_update_date_time": _DATETIME,
+        },
+    ),
+    "sleep_daily": CsvSchema(
+        sep=";",
+        dtypes={
+            **_WEARABLE_COMMON,
+            "rem_sleep_minutes": "float64",
+            "asleep_state_minutes": "float64",
+            "deep_sleep_state_minutes": "float64",
+            "light_sleep_state_minutes": "float64",
+            "awake_state_minutes": "float64",
+            "avg_breaths_per_min": "float64",
+            "max_breaths_per_min": "float64",
+            "min_breaths_per_min": "float64",
+        },
+        dates={
+            "calculation_date": "%Y-%m-%d",
+            "start_date_time": _DATETIME,
+            "end_date_time": _DATETIME,
+        },
+    ),
+    # data/patient.csv usa ';' y data/patient_fixed.csv ',': se detecta por cabecera
+    "patient": CsvSchema(
+        sep=None,
+        dtypes={
+            "id": "str",
+            "name": "str",
+            "surname": "str",
+            "phone": "str",
+            "gender": "str",
+            "height": "float64",
+            "weight": "float64",
+            "doctor_id": "str",
+            "activ_age": "float64",
+            "pro_age": "float64",
+            "pro_activ_age": "float64",
+        },
+        dates={"birth_date": "%d/%m/%Y", "last_subscription_check": "%d/%m/%Y"},
+        dayfirst=True,
+    ),
+    "survey": CsvSchema(
+        sep=";",
+        dtypes={
+            "id": "float64",
+            "category": "str",
+            "label": "str",
+            "value": "float64",
+            "user_id": "str",
+        },
+        dates={"date": "%Y-%m-%d %H:%M:%S.%f"},
+    ),
+}
+
+
+def read_header(path: str, sep: str | None = None) -> tuple[str, list[str]]:
+    """Devuelve (separador, columnas) leyendo solo la primera línea."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        line = f.readline()
+    if sep is None:
+        counts = {cand: line.count(cand) for cand in (";", ",", "\t", "|")}
+        sep = max(counts, key=counts.get) if any(counts.values()) else ","
+    names = next(csv.reader([line], delimiter=sep), [])
+    return sep, [n.strip() for n in names]
+
+
+def _parse_dates(series: pd.Series, fmt: str, dayfirst: bool) -> pd.Series:
+    parsed = pd.to_datetime(series, format=fmt, errors="coerce")
+    failed = parsed.isna() & series.notna()
+    if failed.any():
+        parsed.loc[failed] = pd.to_datetime(series[failed], format="mixed", dayfirst=dayfirst, errors="coerce")
+    return parsed
+
+
+def _read(path: str, sep: str, cols: list[str], dtype: dict[str, str], na_values: list[str], **kwargs: Any) -> Any:
+    return pd.read_csv(
+        path,
+        sep=sep,
+        engine="c",
+        usecols=cols,
+        dtype=dtype,
+        na_values=na_values,
+        keep_default_na=True,
+        **kwargs,
+    )
+
+
+def _plan(path: str, schema: CsvSchema, usecols: Iterable[str] | None) -> tuple[str, list[str], dict[str, str], dict[str, str]]:
+    """(separador, columnas, dtypes de lectura, formatos de fecha) de un CSV según su esquema."""
+    sep, header = read_header(path, schema.sep)
+    cols = header if usecols is None else [c for c in header if c in set(usecols)]
+    dtype = {c: t for c, t in schema.dtypes.items() if c in cols}
+    dates = {c: fmt for c, fmt in schema.dates.items() if c in cols}
+    # Las fechas se leen como texto y se parsean con el formato declarado
+    dtype.update({c: "str" for c in dates})
+    return sep, cols, dtype, dates
+
+
+def _coerce_numeric(df: pd.DataFrame, numeric: dict[str, str]) -> None:
+    for col, t in numeric.items():
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype(t)
+
+
+def read_csv_typed(path: str, schema: CsvSchema, usecols: Iterable[str] | None = None) -> pd.DataFrame:
+    """Lee un CSV con el esquema declarado en un único pase del lector C.
+
+    Si alguna celda numérica no se puede convertir (p. ej. `12,5`), se avisa
+    y se relee con esas columnas como texto y `pd.to_numeric(errors="coerce")`:
+    la celda queda NaN y el resto del fichero se conserva.
+    """
+    sep, cols, dtype, dates = _plan(path, schema, usecols)
+    na_values = list(schema.na_values)
+
+    try:
+        df = _read(path, sep, cols, dtype, na_values)
+    except ValueError as e:
+        numeric = {c: t for c, t in dtype.items() if t != "str"}
+        logger.warning("%s: valores no numéricos (%s); se convierten a NaN", path, e)
+        df = _read(path, sep, cols, {**dtype, **{c: "str" for c in numeric}}, na_values)
+        _coerce_numeric(df, numeric)
+    for col, fmt in dates.items():
+        df[col] = _parse_dates(df[col], fmt, schema.dayfirst)
+    return df
+
+
+def iter_csv_typed(
+    path: str,
+    schema: CsvSchema,
+    usecols: Iterable[str] | None = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+) -> Iterator[pd.DataFrame]:
+    """Itera bloques tipados de un CSV, `chunksize` filas cada uno.
+
+    Todos los bloques tienen los mismos dtypes: las columnas que el esquema no
+    declara se leen como texto en lugar de inferirse por bloque. Si un bloque
+    tiene una celda numérica mal formada, el lector se reabre desde ese bloque
+    con las columnas numéricas como texto y `pd.to_numeric(errors="coerce")`;
+    los bloques ya entregados no se releen.
+    """
+    sep, cols, dtype, dates = _plan(path, schema, usecols)
+    dtype.update({c: "str" for c in cols if c not in dtype})
+    numeric = {c: t for c, t in dtype.items() if t != "str"}
+    na_values = list(schema.na_values)
+    size = max(1, int(chunksize))
+
+    done = 0
+    coerce = False
+    while True:
+        read_dtype = {**dtype, **{c: "str" for c in numeric}} if coerce else dtype
+        # Las filas ya entregadas se saltan sin parsear (la 0 es la cabecera)
+        skip = range(1, done + 1) if done else None
+        reader = _read(path, sep, cols, read_dtype, na_values, chunksize=size, skiprows=skip)
+        try:
+            for chunk in reader:
+                if coerce:
+                    _coerce_numeric(chunk, numeric)
+                for col, fmt in dates.items():
+                    chunk[col] = _parse_dates(chunk[col], fmt, schema.dayfirst)
+                done += len(chunk)
+                yield chunk.reset_index(drop=True)
+            return
+        except ValueError as e:
+            if coerce or not numeric:
+                raise
+            logger.warning("%s: valores no numéricos a partir de la fila %d (%s); se convierten a NaN", path, done + 1, e)
+            coerce = True
+        finally:
+            reader.close()
+
+
+def _arrow_type(dtype: str) -> Any:
+    return pa.string() if dtype == "str" else pa.from_numpy_dtype(pd.api.types.pandas_dtype(dtype))
+
+
+def csv_to_parquet(
+    path: str,
+    schema: CsvSchema,
+    out_path: str,
+    usecols: Iterable[str] | None = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+) -> int:
+    """Convierte un CSV a Parquet bloque a bloque con el esquema declarado; devuelve las filas escritas.
+
+    Cada bloque de `iter_csv_typed` se escribe como un row group de un
+    `ParquetWriter`, así que nunca hay más de un bloque en memoria. La
+    escritura es atómica (fichero temporal + `os.replace`).
+    """
+    if pq is None:
+        raise RuntimeError("Conversión a Parquet no disponible: instalar pyarrow")
+    _, cols, dtype, dates = _plan(path, schema, usecols)
+    arrow_schema = pa.schema(
+        [(c, pa.timestamp("ns") if c in dates else _arrow_type(dtype.get(c, "str"))) for c in cols]
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp_path = f"{out_path}.tmp"
+    rows = 0
+    with pq.ParquetWriter(tmp_path, arrow_schema, compression="zstd") as writer:
+        for chunk in iter_csv_typed(path, schema, usecols=usecols, chunksize=chunksize):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=arrow_schema, preserve_index=False))
+            rows += len(chunk)
+    os.replace(tmp_path, out_path)
+    return rows
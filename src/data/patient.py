@@ -19,24 +19,28 @@ from typing import Optional
 import numpy as np
 import pandas as pd
 
+from src.data.ingest import SCHEMAS, read_csv_typed
+
 
 def load_patient_metadata(path: str = "data/patient") -> pd.DataFrame:
     """Carga CSV(s) de metadatos de paciente desde un directorio o un archivo.
 
     - Si `path` es carpeta, concatena todos los CSV dentro.
-    - Delimitador autodetectado por pandas (sep=None, engine='python').
+    - Esquema declarado en `src.data.ingest.SCHEMAS["patient"]`; el delimitador
+      se detecta por la cabecera y se lee con el lector C.
     """
+    schema = SCHEMAS["patient"]
     if os.path.isdir(path):
         files = sorted(glob.glob(os.path.join(path, "*.csv")))
         frames = []
         for f in files:
-            frames.append(pd.read_csv(f, sep=None, engine="python"))
+            frames.append(read_csv_typed(f, schema))
         if not frames:
             return pd.DataFrame()
         return pd.concat(frames, ignore_index=True)
 
     if os.path.isfile(path):
-        return pd.read_csv(path, sep=None, engine="python")
+        return read_csv_typed(path, schema)
 
     return pd.DataFrame()
 